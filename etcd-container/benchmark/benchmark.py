@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the metadata collector and data processor.
+
+Generates a synthetic snapshot series in the shape extract_metadata
+produces, writes it with the collector's snapshot writer and times each
+processor stage separately. Nothing here talks to a cluster.
+
+Example:
+    python benchmark.py --objects 60000 --namespaces 300 --churn 0.02 --window 12
+    python benchmark.py --json results.json --baseline previous.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import datetime
+import subprocess
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "metadata-collector"))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "data-processing"))
+
+import metadata_collector  # noqa: E402
+import data_processor  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmark")
+
+# Share of objects per resource type in the synthetic cluster. ReplicaSets
+# are not drawn from the mix but generated for their Deployments: a current
+# one each and, for half of them, a scaled-down previous revision.
+TYPE_MIX = {
+    "pods": 0.45,
+    "configmaps": 0.15,
+    "secrets": 0.15,
+    "services": 0.08,
+    "deployments": 0.04,
+    "statefulsets": 0.02,
+    "daemonsets": 0.01,
+    "jobs": 0.03,
+    "ingresses": 0.02,
+    "networkpolicies": 0.02,
+}
+# Resource types that own pods directly
+POD_OWNER_TYPES = ("replicasets", "statefulsets", "daemonsets")
+POD_PHASES = ("Running", "Running", "Running", "Pending", "Succeeded", "Failed")
+# Share of running pods that are not ready
+UNREADY_SHARE = 0.1
+
+
+class SyntheticCluster:
+    """Synthetic cluster whose objects look like extract_metadata output.
+
+    Deployments own ReplicaSets, which own pods like StatefulSets and
+    DaemonSets do; pods carry a phase and readiness. Every step applies the
+    configured churn: a share of objects is updated (new resourceVersion,
+    possibly a new phase), deleted or created. Deleted owners leave their
+    children behind, as before garbage collection catches up.
+    """
+
+    def __init__(self, objects, namespaces, churn, seed=42):
+        self.random = random.Random(seed)
+        self.churn = churn
+        self.namespaces = [f"ns-{i}" for i in range(namespaces)]
+        self.resource_version = 1
+        self.next_id = 0
+        self.objects = {}
+
+        for namespace in self.namespaces:
+            self._add(self._make("namespaces", None))
+
+        for resource_type, share in TYPE_MIX.items():
+            if resource_type == "pods":
+                continue
+            for _ in range(int(objects * share)):
+                self._add(self._make(resource_type, self.random.choice(self.namespaces)))
+
+        deployments = [obj for obj in self.objects.values() if obj["resource_type"] == "deployments"]
+        for deployment in deployments:
+            self._add(self._make_replicaset(deployment, deployment["status"]["replicas"]))
+            if self.random.random() < 0.5:
+                self._add(self._make_replicaset(deployment, 0))
+
+        owners = self._pod_owners()
+        for _ in range(int(objects * TYPE_MIX["pods"])):
+            self._add(self._make_pod(self.random.choice(owners) if owners else None))
+
+    def _next_version(self):
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def _make(self, resource_type, namespace):
+        self.next_id += 1
+        name = f"{resource_type[:-1]}-{self.next_id}"
+        obj = {
+            "resource_type": resource_type,
+            "name": name,
+            "namespace": namespace,
+            "creation_timestamp": "2024-01-01T00:00:00+00:00",
+            "resource_version": self._next_version(),
+            "uid": f"uid-{self.next_id:012d}",
+            "labels": {"app": f"app-{self.next_id % 50}", "tier": self.random.choice(("web", "db", "cache"))},
+            "annotations": {"owner": "benchmark"},
+            "owner_references": [],
+        }
+        if resource_type in ("deployments", "replicasets", "statefulsets"):
+            replicas = self.random.randint(1, 5)
+            obj["status"] = {"ready_replicas": replicas, "replicas": replicas}
+        elif resource_type == "jobs":
+            obj["status"] = {"active": 0, "succeeded": 1, "failed": None}
+        elif resource_type in ("namespaces", "services", "ingresses", "daemonsets"):
+            # DaemonSet status carries no replica counts in extract_metadata
+            obj["status"] = {}
+        return obj
+
+    @staticmethod
+    def _owner_reference(owner):
+        return {"kind": data_processor.RESOURCE_KINDS[owner["resource_type"]], "name": owner["name"], "uid": owner["uid"]}
+
+    def _make_replicaset(self, deployment, replicas):
+        replicaset = self._make("replicasets", deployment["namespace"])
+        replicaset["status"] = {"ready_replicas": replicas, "replicas": replicas}
+        replicaset["owner_references"] = [self._owner_reference(deployment)]
+        return replicaset
+
+    def _pod_owners(self):
+        """Owners new pods are assigned to: StatefulSets, DaemonSets and scaled-up ReplicaSets"""
+        return [
+            obj for obj in self.objects.values()
+            if obj["resource_type"] in POD_OWNER_TYPES
+            and (obj["resource_type"] != "replicasets" or obj["status"]["replicas"])
+        ]
+
+    def _pod_phase(self):
+        """Return a random phase and readiness; only running pods can be ready"""
+        phase = self.random.choice(POD_PHASES)
+        return phase, phase == "Running" and self.random.random() >= UNREADY_SHARE
+
+    def _make_pod(self, owner):
+        namespace = owner["namespace"] if owner else self.random.choice(self.namespaces)
+        pod = self._make("pods", namespace)
+        phase, ready = self._pod_phase()
+        pod["status"] = {"phase": phase, "restart_count": 0, "ready": ready}
+        if owner:
+            pod["owner_references"] = [self._owner_reference(owner)]
+        return pod
+
+    def _add(self, obj):
+        self.objects[obj["uid"]] = obj
+
+    def step(self):
+        """Apply one interval of churn"""
+        changes = max(1, int(len(self.objects) * self.churn))
+        uids = list(self.objects)
+
+        for uid in self.random.sample(uids, min(changes, len(uids))):
+            obj = dict(self.objects[uid])
+            obj["resource_version"] = self._next_version()
+            if obj["resource_type"] == "pods":
+                phase, ready = self._pod_phase()
+                obj["status"] = dict(obj["status"], phase=phase, ready=ready)
+            self.objects[uid] = obj
+
+        for uid in self.random.sample(uids, min(changes // 2, len(uids))):
+            if self.objects[uid]["resource_type"] != "namespaces":
+                del self.objects[uid]
+
+        owners = self._pod_owners()
+        for _ in range(changes // 2):
+            self._add(self._make_pod(self.random.choice(owners) if owners else None))
+
+    def snapshot(self):
+        """Return the current objects in the order the collector writes them"""
+        return list(self.objects.values())
+
+
+def calculate_ewma(series, span=3):
+    """Full-window EWMA, the reference for FeatureWindow's incremental _ewma columns"""
+    return series.ewm(span=span).mean()
+
+
+def write_snapshot_series(cluster, count, input_dir, snapshot_format, interval=300):
+    """Write count snapshots with the collector's writer, one interval apart"""
+    metadata_collector.OUTPUT_DIR = input_dir
+    metadata_collector.SNAPSHOT_FORMAT = snapshot_format
+    metadata_collector.SNAPSHOTS_TO_KEEP = max(count, metadata_collector.SNAPSHOTS_TO_KEEP)
+    metadata_collector.snapshot_chain.update({"objects": None, "filename": None, "deltas": 0})
+
+    start = datetime.datetime(2024, 1, 1)
+    timings = []
+    for i in range(count):
+        if i:
+            cluster.step()
+        metadata = cluster.snapshot()
+        timestamp = (start + datetime.timedelta(seconds=i * interval)).strftime("%Y%m%d_%H%M%S")
+        begin = time.perf_counter()
+        metadata_collector.save_metadata_snapshot(metadata, timestamp)
+        timings.append(time.perf_counter() - begin)
+    return timings
+
+
+def measure(stage, function, repeat, objects, results):
+    """Time function over repeat runs, then run it once more under tracemalloc for peak memory.
+
+    The traced run is kept out of the latencies because tracemalloc slows
+    allocation-heavy code down considerably.
+    """
+    latencies = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - begin)
+
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results[stage] = summarize(latencies, objects, peak)
+    return result
+
+
+def summarize(latencies, objects, peak_bytes):
+    """Summarize a list of latencies in seconds"""
+    latencies = np.array(latencies)
+    return {
+        "runs": len(latencies),
+        "p50_seconds": float(np.percentile(latencies, 50)),
+        "p95_seconds": float(np.percentile(latencies, 95)),
+        "p99_seconds": float(np.percentile(latencies, 99)),
+        "objects_per_second": float(objects / np.median(latencies)) if np.median(latencies) > 0 else None,
+        "peak_memory_bytes": int(peak_bytes),
+    }
+
+
+def run_benchmark(args):
+    """Generate the synthetic series and time every pipeline stage"""
+    workdir = args.workdir or tempfile.mkdtemp(prefix="k8s-metadata-benchmark-")
+    input_dir = os.path.join(workdir, "snapshots")
+    output_dir = os.path.join(workdir, "processed")
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    logging.getLogger("metadata-collector").setLevel(logging.WARNING)
+    logging.getLogger("data-processor").setLevel(logging.WARNING)
+
+    results = {}
+    try:
+        # Cold import of the processor module in a fresh interpreter
+        import_timings = []
+        for _ in range(args.repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", "import time; t = time.perf_counter(); import data_processor; print(time.perf_counter() - t)"],
+                cwd=os.path.join(BENCHMARK_DIR, "..", "data-processing"), capture_output=True, text=True, check=True
+            ).stdout
+            import_timings.append(float(output.split()[-1]))
+        results["processor_import"] = summarize(import_timings, 1, 0)
+
+        logger.info(f"Generating {args.objects} objects in {args.namespaces} namespaces")
+        cluster = SyntheticCluster(args.objects, args.namespaces, args.churn, args.seed)
+        objects_per_snapshot = len(cluster.objects)
+        window_objects = objects_per_snapshot * args.window
+
+        # Collector: snapshot writing (the first write of a delta series is a keyframe)
+        save_timings = write_snapshot_series(cluster, args.window + 1, input_dir, args.snapshot_format)
+        results["save_metadata_snapshot"] = summarize(save_timings, objects_per_snapshot, 0)
+
+        # Collector: per-uid change tracking, one interval of churn per run. A
+        # separate cluster steps ahead so the stages below see one interval per cycle
+        churn_cluster = SyntheticCluster(args.objects, args.namespaces, args.churn, args.seed)
+        state = metadata_collector.ObjectStateTable()
+        state.resync(churn_cluster.snapshot(), count=False)
+        churn_snapshots = []
+        for _ in range(args.repeat + 1):
+            churn_cluster.step()
+            churn_snapshots.append(churn_cluster.snapshot())
+        churn_snapshots = iter(churn_snapshots)
+        measure(
+            "object_state_resync",
+            lambda: state.resync(next(churn_snapshots)),
+            args.repeat, objects_per_snapshot, results
+        )
+        del churn_cluster, churn_snapshots
+
+        # Processor stages on a full window
+        snapshots = measure(
+            "load_snapshots",
+            lambda: data_processor.load_snapshots(input_dir, args.window),
+            args.repeat, window_objects, results
+        )
+        features_df = measure(
+            "extract_features",
+            lambda: data_processor.extract_features(snapshots),
+            args.repeat, window_objects, results
+        )
+
+        def ewma_step():
+            ewma_df = features_df.copy()
+            for column in features_df.columns:
+                if column != 'timestamp':
+                    ewma_df[f"{column}_ewma"] = calculate_ewma(features_df[column])
+            return ewma_df
+
+        ewma_df = measure("ewma", ewma_step, args.repeat, len(features_df), results)
+
+        # Incremental window: cold fill, then one new snapshot per cycle
+        window = data_processor.FeatureWindow(args.window)
+        measure(
+            "feature_window_cold",
+            lambda: data_processor.FeatureWindow(args.window).update(input_dir),
+            1, window_objects, results
+        )
+        window.update(input_dir)
+        cycle_timings = []
+        peak = 0
+        for i in range(args.repeat + 1):
+            cluster.step()
+            timestamp = (datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=i)).strftime("%Y%m%d_%H%M%S")
+            metadata_collector.save_metadata_snapshot(cluster.snapshot(), timestamp)
+            if i < args.repeat:
+                begin = time.perf_counter()
+                window.update(input_dir)
+                cycle_timings.append(time.perf_counter() - begin)
+            else:
+                tracemalloc.start()
+                window.update(input_dir)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        results["feature_window_incremental"] = summarize(cycle_timings, objects_per_snapshot, peak)
+
+        # Warm restart: checkpoint the window, restore it and take one new snapshot
+        checkpoint_path = os.path.join(output_dir, "processor_checkpoint.pkl")
+        measure("checkpoint_save", lambda: window.save(checkpoint_path), args.repeat, window_objects, results)
+        measure(
+            "checkpoint_restore",
+            lambda: data_processor.FeatureWindow.load(checkpoint_path, args.window),
+            args.repeat, window_objects, results
+        )
+        restored = data_processor.FeatureWindow.load(checkpoint_path, args.window)
+        cluster.step()
+        timestamp = (datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=args.repeat + 1)).strftime("%Y%m%d_%H%M%S")
+        metadata_collector.save_metadata_snapshot(cluster.snapshot(), timestamp)
+        begin = time.perf_counter()
+        restored.update(input_dir)
+        results["feature_window_restored"] = summarize([time.perf_counter() - begin], objects_per_snapshot, 0)
+
+        anomalies_df = measure(
+            "detect_anomalies",
+            lambda: data_processor.detect_anomalies(ewma_df),
+            args.repeat, len(ewma_df), results
+        )
+        measure(
+            "save_processed_data",
+            lambda: data_processor.save_processed_data(ewma_df, anomalies_df, output_dir),
+            args.repeat, len(ewma_df), results
+        )
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            "objects": args.objects,
+            "namespaces": args.namespaces,
+            "churn": args.churn,
+            "window": args.window,
+            "snapshot_format": args.snapshot_format,
+            "repeat": args.repeat,
+            "objects_per_snapshot": objects_per_snapshot,
+        },
+        "stages": results,
+    }
+
+
+def print_report(report):
+    """Print the per-stage results as a table"""
+    print(f"{'stage':<28} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'objects/s':>14} {'peak MiB':>10}")
+    for stage, result in report["stages"].items():
+        throughput = f"{result['objects_per_second']:.0f}" if result["objects_per_second"] else "-"
+        print(
+            f"{stage:<28} {result['p50_seconds'] * 1000:>10.1f} {result['p95_seconds'] * 1000:>10.1f} "
+            f"{result['p99_seconds'] * 1000:>10.1f} {throughput:>14} "
+            f"{result['peak_memory_bytes'] / 2**20:>10.1f}"
+        )
+
+
+def compare_to_baseline(report, baseline_path, max_regression):
+    """Return the stages whose p50 latency regressed beyond max_regression"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for stage, result in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous or not previous["p50_seconds"]:
+            continue
+        ratio = result["p50_seconds"] / previous["p50_seconds"]
+        if ratio > max_regression:
+            regressions.append(f"{stage}: {ratio:.2f}x slower than baseline")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=20000, help="objects per snapshot (excluding namespaces)")
+    parser.add_argument("--namespaces", type=int, default=100)
+    parser.add_argument("--churn", type=float, default=0.02, help="share of objects changed per interval")
+    parser.add_argument("--window", type=int, default=int(os.environ.get('WINDOW_SIZE', '12')))
+    parser.add_argument("--snapshot-format", choices=("delta", "json"), default="delta")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per stage")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="directory for generated files (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file from a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=1.25, help="allowed p50 slowdown vs the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote results to {args.json}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(report, args.baseline, args.max_regression)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
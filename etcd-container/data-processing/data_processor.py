@@ -1,16 +1,37 @@
 #!/usr/bin/env python3
 import os
 import json
-import time
 import logging
 import glob
+import gzip
+import importlib
+import pickle
+import queue
+import random
+import struct
+import time
+import cProfile
+import socketserver
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
 import pandas as pd
 import numpy as np
-from scipy import stats
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.feature_selection import chi2
-from sklearn.ensemble import IsolationForest
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server, Counter as MetricCounter, Gauge, Histogram
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
 
 # Set up logging
 logging.basicConfig(
@@ -21,210 +42,1501 @@ logger = logging.getLogger("data-processor")
 
 # Configuration
 PROCESSING_INTERVAL = int(os.environ.get('PROCESSING_INTERVAL', '600'))
+# File-mode cycles run at fixed-rate deadlines. Within MIN_PROCESSING_INTERVAL
+# and MAX_PROCESSING_INTERVAL (both default to PROCESSING_INTERVAL, a fixed
+# rate) the interval is halved when more than CHURN_HIGH of the objects changed
+# in the newest snapshot and grown by a quarter below CHURN_LOW
+MIN_PROCESSING_INTERVAL = float(os.environ.get('MIN_PROCESSING_INTERVAL', str(PROCESSING_INTERVAL)))
+MAX_PROCESSING_INTERVAL = float(os.environ.get('MAX_PROCESSING_INTERVAL', str(PROCESSING_INTERVAL)))
+CHURN_HIGH = float(os.environ.get('CHURN_HIGH', '0.05'))
+CHURN_LOW = float(os.environ.get('CHURN_LOW', '0.005'))
 INPUT_DIR = os.environ.get('INPUT_DIR', '/data')
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', '/processed_data')
 WINDOW_SIZE = int(os.environ.get('WINDOW_SIZE', '12'))  # Number of snapshots to include in time series window
+# 'json' reads metadata snapshots, 'table' reads the collector's columnar Arrow tables
+INPUT_FORMAT = os.environ.get('INPUT_FORMAT', 'json')
+# 'csv' or 'parquet' for processed features and anomalies
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'csv')
+# Persistent anomaly model: where it is stored, how many feature rows it is
+# trained on, how often it is refit and the mean |z| of new rows that counts as drift
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(OUTPUT_DIR, 'anomaly_model.pkl'))
+MODEL_HISTORY_SIZE = int(os.environ.get('MODEL_HISTORY_SIZE', '2016'))
+MODEL_MIN_SAMPLES = int(os.environ.get('MODEL_MIN_SAMPLES', '48'))
+MODEL_REFIT_INTERVAL = int(os.environ.get('MODEL_REFIT_INTERVAL', '21600'))
+MODEL_DRIFT_THRESHOLD = float(os.environ.get('MODEL_DRIFT_THRESHOLD', '3.0'))
+# Per-namespace and per-resource-type scoring: the group model's history size,
+# the number of namespaces given their own feature vector and how many of the
+# highest-scoring namespaces are exported to Prometheus
+GROUP_MODEL_PATH = os.environ.get('GROUP_MODEL_PATH', os.path.join(OUTPUT_DIR, 'group_anomaly_model.pkl'))
+GROUP_MODEL_HISTORY_SIZE = int(os.environ.get('GROUP_MODEL_HISTORY_SIZE', '50000'))
+MAX_NAMESPACES = int(os.environ.get('MAX_NAMESPACES', '500'))
+ANOMALY_TOP_K = int(os.environ.get('ANOMALY_TOP_K', '20'))
+
+# Namespaces beyond MAX_NAMESPACES share one feature vector
+OTHER_NAMESPACE = "_other"
+GROUP_FEATURE_COLUMNS = [
+    'log_count', 'owner_ref_ratio', 'status_ratio', 'version_change_ratio', 'count_change_ratio',
+    'churn_ratio'
+]
+# An object whose status changes FLAP_THRESHOLD times within FLAP_WINDOW
+# snapshots is counted as flapping
+FLAP_WINDOW = int(os.environ.get('FLAP_WINDOW', '6'))
+FLAP_THRESHOLD = int(os.environ.get('FLAP_THRESHOLD', '3'))
+CHANGE_COLUMNS = ['created', 'deleted', 'updated', 'restarted', 'flapping']
+# Ownership graph features: orphans are counted per missing owner kind and
+# workloads of GRAPH_WORKLOAD_KINDS are checked for having only unready pods
+RESOURCE_KINDS = {
+    'namespaces': 'Namespace', 'pods': 'Pod', 'services': 'Service', 'configmaps': 'ConfigMap',
+    'secrets': 'Secret', 'deployments': 'Deployment', 'replicasets': 'ReplicaSet',
+    'statefulsets': 'StatefulSet', 'daemonsets': 'DaemonSet', 'jobs': 'Job', 'cronjobs': 'CronJob',
+    'ingresses': 'Ingress', 'networkpolicies': 'NetworkPolicy'
+}
+GRAPH_OWNER_KINDS = ['ReplicaSet', 'Deployment', 'StatefulSet', 'DaemonSet', 'Job', 'CronJob']
+GRAPH_WORKLOAD_KINDS = ['Deployment', 'StatefulSet', 'DaemonSet']
+GRAPH_MAX_DEPTH = 16
+# Opt-in profiling: a share of cycles (PROFILE_SAMPLE_RATE) runs under cProfile
+# and cycles slower than PROFILE_THRESHOLD seconds are dumped to PROFILE_DIR
+PROFILE_THRESHOLD = float(os.environ.get('PROFILE_THRESHOLD', '0'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '1.0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(OUTPUT_DIR, 'profiles'))
+PROFILES_TO_KEEP = int(os.environ.get('PROFILES_TO_KEEP', '20'))
+# 'file' polls INPUT_DIR every PROCESSING_INTERVAL, 'stream' processes each
+# snapshot as the collector pushes it to HANDOFF_PORT; at most
+# HANDOFF_QUEUE_SIZE received snapshots wait before the collector is held back
+HANDOFF_MODE = os.environ.get('HANDOFF_MODE', 'file')
+HANDOFF_PORT = int(os.environ.get('HANDOFF_PORT', '9000'))
+HANDOFF_QUEUE_SIZE = int(os.environ.get('HANDOFF_QUEUE_SIZE', '4'))
+# Sharded collectors write partial snapshots that are merged per timestamp once
+# every shard has arrived. In file mode MERGE_PARTIALS merges the partials in
+# INPUT_DIR into MERGED_DIR, which is then read instead; in stream mode partials
+# are merged as they arrive. At most PARTIAL_MAX_PENDING incomplete timestamps
+# are held back before the oldest is dropped
+MERGE_PARTIALS = os.environ.get('MERGE_PARTIALS', 'false').lower() == 'true'
+MERGED_DIR = os.environ.get('MERGED_DIR', os.path.join(OUTPUT_DIR, 'merged'))
+MERGED_SNAPSHOTS_TO_KEEP = int(os.environ.get('MERGED_SNAPSHOTS_TO_KEEP', '100'))
+PARTIAL_MAX_PENDING = int(os.environ.get('PARTIAL_MAX_PENDING', '4'))
+# Correlation of categorical metadata (resource type, pod phase, owner kind and
+# label keys): how many fields and values per field are tracked, the fewest
+# objects a field pair needs to be scored and how many pairs are exported
+CORRELATION_MAX_FIELDS = int(os.environ.get('CORRELATION_MAX_FIELDS', '32'))
+CORRELATION_MAX_VALUES = int(os.environ.get('CORRELATION_MAX_VALUES', '20'))
+CORRELATION_MIN_OBJECTS = int(os.environ.get('CORRELATION_MIN_OBJECTS', '30'))
+CORRELATION_TOP_N = int(os.environ.get('CORRELATION_TOP_N', '20'))
+# Backfill mode featurizes every snapshot in INPUT_DIR in chunks of
+# BACKFILL_CHUNK_SIZE snapshots on BACKFILL_WORKERS processes, retrains the
+# anomaly model on the result and exits
+BACKFILL = os.environ.get('BACKFILL', 'false').lower() == 'true'
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', str(os.cpu_count() or 1)))
+BACKFILL_CHUNK_SIZE = int(os.environ.get('BACKFILL_CHUNK_SIZE', '288'))
+# SQLite feature store with raw, hourly and daily tiers (empty path disables
+# it) and the number of days each tier is kept
+FEATURE_STORE_PATH = os.environ.get('FEATURE_STORE_PATH', os.path.join(OUTPUT_DIR, 'features.db'))
+FEATURE_STORE_RAW_DAYS = float(os.environ.get('FEATURE_STORE_RAW_DAYS', '7'))
+FEATURE_STORE_HOURLY_DAYS = float(os.environ.get('FEATURE_STORE_HOURLY_DAYS', '90'))
+FEATURE_STORE_DAILY_DAYS = float(os.environ.get('FEATURE_STORE_DAILY_DAYS', '730'))
+# Feature window state (cached rows, EWMA state, per-uid tables) is checkpointed
+# here atomically after every cycle and restored on start; empty disables it.
+# The anomaly models are persisted separately at MODEL_PATH and GROUP_MODEL_PATH
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH', os.path.join(OUTPUT_DIR, 'processor_checkpoint.pkl'))
 
 # Prometheus metrics
 processed_features_count = Gauge('k8s_processed_features_count', 'Count of processed features')
 anomaly_score = Gauge('k8s_anomaly_score', 'Anomaly score from isolation forest', ['resource_type'])
+namespace_anomaly_score = Gauge('k8s_namespace_anomaly_score', 'Anomaly score of the top-K most anomalous namespaces', ['namespace'])
 correlation_score = Gauge('k8s_correlation_score', 'Correlation score between metadata fields', ['field_pair'])
+model_fit_seconds = Histogram(
+    'k8s_anomaly_model_fit_seconds', 'Time spent fitting the anomaly model',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+model_score_seconds = Histogram(
+    'k8s_anomaly_model_score_seconds', 'Time spent scoring feature rows with the anomaly model',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+)
+stage_duration = Histogram(
+    'k8s_processor_stage_duration_seconds', 'Time spent in each processing stage', ['stage'],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+bytes_read = MetricCounter('k8s_processor_bytes_read', 'Bytes read from snapshot files')
+bytes_written = MetricCounter('k8s_processor_bytes_written', 'Bytes written to processed data and model files')
+objects_per_second = Gauge('k8s_processor_objects_per_second', 'Snapshot objects featurized per second in the last update')
+handoff_received = MetricCounter('k8s_handoff_snapshots_received', 'Snapshots received over the handoff stream', ['kind'])
+partial_snapshots_dropped = MetricCounter('k8s_processor_partial_snapshots_dropped', 'Timestamps whose partial snapshots never covered every shard')
+handoff_lag = Gauge('k8s_handoff_lag_seconds', 'Seconds between the collector sending a snapshot and its processing starting')
+effective_interval = Gauge('k8s_processor_effective_interval_seconds', 'Current interval between processing deadlines')
+missed_deadlines = MetricCounter('k8s_processor_missed_deadlines', 'Processing deadlines skipped because a cycle overran')
+import_seconds = Gauge('k8s_processor_import_seconds', 'Time spent importing scikit-learn at startup')
+time_to_first_result = Gauge('k8s_processor_time_to_first_result_seconds', 'Time from main() starting to the first processed result')
+
+# Namespaces currently exported by namespace_anomaly_score
+exported_namespaces = set()
+# Field pairs currently exported by correlation_score
+exported_field_pairs = set()
+# Whether time_to_first_result has been exported
+first_result_recorded = False
+# time.perf_counter() when main() started, the reference for time_to_first_result
+started_at = None
 
+def list_snapshot_files(input_dir):
+    """List snapshot files (legacy JSON dumps, keyframes and deltas) in time order"""
+    return sorted(
+        f for f in glob.glob(os.path.join(input_dir, "metadata_snapshot_*"))
+        if f.endswith((".json", ".gz", ".zst"))
+    )
+
+def parse_snapshot_name(file_path):
+    """Return (timestamp, kind) for a snapshot file, kind being 'full' or 'delta'"""
+    basename = os.path.basename(file_path)
+    timestamp = basename.split('_')[2:4]
+    timestamp = f"{timestamp[0]}_{timestamp[1]}".split('.')[0]
+    kind = "delta" if ".delta." in basename else "full"
+    return timestamp, kind
+
+def read_snapshot_file(file_path):
+    """Read and decompress a snapshot file"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    bytes_read.inc(len(data))
+    return decode_snapshot(data, file_path.rsplit(".", 1)[-1])
+
+def list_partial_snapshots(input_dir):
+    """Group partial snapshot files from sharded collectors by timestamp"""
+    partials = {}
+    for file_path in sorted(glob.glob(os.path.join(input_dir, "metadata_partial_*"))):
+        if file_path.endswith((".json", ".gz", ".zst")):
+            partials.setdefault(parse_snapshot_name(file_path)[0], []).append(file_path)
+    return partials
+
+def decode_snapshot(data, encoding):
+    """Decompress ('gz', 'zst' or anything else for none) and parse snapshot bytes"""
+    if encoding == "gz":
+        data = gzip.decompress(data)
+    elif encoding == "zst":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst snapshots")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return json.loads(data)
+
+def apply_delta(objects, delta):
+    """Apply a delta to a uid-keyed snapshot in place"""
+    for uid in delta["removed"]:
+        objects.pop(uid, None)
+    for obj in delta["added"]:
+        objects[obj["uid"]] = obj
+    for obj in delta["modified"]:
+        objects[obj["uid"]] = obj
+    return objects
+
+@stage_duration.labels(stage='load_snapshots').time()
 def load_snapshots(input_dir, window_size):
-    """Load the most recent snapshots"""
-    snapshot_files = sorted(glob.glob(os.path.join(input_dir, "metadata_snapshot_*.json")))
+    """Load the most recent snapshots.
+
+    Delta snapshots are rebuilt from the nearest keyframe at or before the
+    start of the window, so the window can begin on any snapshot.
+    """
+    snapshot_files = list_snapshot_files(input_dir)
     
     if not snapshot_files:
         logger.warning(f"No snapshot files found in {input_dir}")
         return []
     
     # Take the most recent snapshots based on window_size
-    recent_snapshots = snapshot_files[-window_size:] if len(snapshot_files) >= window_size else snapshot_files
+    window_start = max(0, len(snapshot_files) - window_size)
+    return load_snapshot_range(snapshot_files, window_start)
+
+@stage_duration.labels(stage='load_snapshot_range').time()
+def load_snapshot_range(snapshot_files, window_start, state=None):
+    """Load snapshot_files[window_start:], replaying deltas as needed.
+
+    state holds the last rebuilt snapshot ('objects', keyed by uid) and
+    its file name ('previous_name'). When the file just before
+    window_start is the one in state, replay resumes from it instead of
+    walking back to a keyframe. state is updated in place.
+    """
+    state = state if state is not None else {}
+    objects = state.get('objects')
+    previous_name = state.get('previous_name')
+    
+    replay_start = window_start
+    resumable = (
+        objects is not None and window_start > 0
+        and os.path.basename(snapshot_files[window_start - 1]) == previous_name
+    )
+    if not resumable:
+        objects = None
+        previous_name = None
+        # Walk back to the keyframe the first snapshot in the window depends on
+        while replay_start > 0 and parse_snapshot_name(snapshot_files[replay_start])[1] == "delta":
+            replay_start -= 1
     
     snapshots = []
-    for file_path in recent_snapshots:
+    for index in range(replay_start, len(snapshot_files)):
+        file_path = snapshot_files[index]
         try:
-            with open(file_path, 'r') as f:
-                snapshot = json.load(f)
-                timestamp = os.path.basename(file_path).split('_')[2:4]
-                timestamp = f"{timestamp[0]}_{timestamp[1]}".split('.')[0]
+            timestamp, kind = parse_snapshot_name(file_path)
+            content = read_snapshot_file(file_path)
+            
+            if kind == "full":
+                objects = {obj["uid"]: obj for obj in content}
+            elif objects is None or content.get("base") != previous_name:
+                # The chain is broken (missing keyframe or delta), skip until the next keyframe
+                logger.warning(f"Skipping delta snapshot {file_path}: base {content.get('base')} not loaded")
+                objects = None
+                previous_name = os.path.basename(file_path)
+                continue
+            else:
+                apply_delta(objects, content)
+            
+            previous_name = os.path.basename(file_path)
+            if index >= window_start:
                 snapshots.append({
                     'timestamp': timestamp,
-                    'data': snapshot
+                    'file': file_path,
+                    'data': list(objects.values()),
+                    'delta': content if kind == "delta" else None
                 })
         except Exception as e:
             logger.error(f"Error loading snapshot {file_path}: {e}")
+            objects = None
+            previous_name = os.path.basename(file_path)
     
+    state['objects'] = objects
+    state['previous_name'] = previous_name
     return snapshots
 
-def calculate_ewma(series, span=3):
-    """Calculate Exponentially Weighted Moving Average for trend analysis"""
-    return series.ewm(span=span).mean()
+def list_snapshot_tables(input_dir):
+    """List columnar snapshot tables in time order"""
+    return sorted(glob.glob(os.path.join(input_dir, "metadata_table_*.arrow")))
 
-def calculate_categorical_correlation(df, cat_columns):
-    """Calculate correlation between categorical variables using Cramer's V"""
-    correlations = {}
+def read_snapshot_table(file_path):
+    """Memory-map one Arrow IPC snapshot table into a long-format frame"""
+    with pa.memory_map(file_path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    bytes_read.inc(os.path.getsize(file_path))
+    frame = table.to_pandas()
+    frame['timestamp'] = os.path.basename(file_path)[len("metadata_table_"):-len(".arrow")]
+    return frame
+
+def contingency_gram(codes, n_categories):
+    """Count co-occurring categories over objects with one bincount.
+
+    codes is an (objects x fields) array of category indices, -1 where an
+    object has no value for a field. Entry [a, b] of the result counts the
+    objects with both category a and category b, so the block of two
+    fields is their contingency table.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    counts = np.zeros(n_categories * n_categories, dtype=np.int64)
+    if codes.size == 0:
+        return counts.reshape(n_categories, n_categories)
     
-    for i, col1 in enumerate(cat_columns):
-        for col2 in cat_columns[i+1:]:
-            # Create contingency table
-            contingency = pd.crosstab(df[col1], df[col2])
-            
-            # Calculate Cramer's V
-            chi2_stat = stats.chi2_contingency(contingency)[0]
-            n = contingency.sum().sum()
-            phi2 = chi2_stat / n
-            r, k = contingency.shape
-            phi2corr = max(0, phi2 - ((k-1)*(r-1))/(n-1))
-            rcorr = r - ((r-1)**2)/(n-1)
-            kcorr = k - ((k-1)**2)/(n-1)
-            cramer_v = np.sqrt(phi2corr / min((kcorr-1), (rcorr-1)))
-            
-            correlations[f"{col1}__{col2}"] = cramer_v
+    # Rows are taken in chunks so the pair array stays around a few million entries
+    chunk_size = max(1, 4_000_000 // (codes.shape[1] ** 2))
+    for start in range(0, len(codes), chunk_size):
+        chunk = codes[start:start + chunk_size]
+        pairs = chunk[:, :, None] * n_categories + chunk[:, None, :]
+        valid = (chunk[:, :, None] >= 0) & (chunk[:, None, :] >= 0)
+        counts += np.bincount(pairs[valid], minlength=n_categories * n_categories)
+    return counts.reshape(n_categories, n_categories)
+
+def batch_cramers_v(gram, category_fields, n_fields, min_objects=2):
+    """Bias-corrected Cramer's V for every pair of fields from a co-occurrence matrix.
+
+    category_fields gives the field of each category. A pair is measured
+    over the objects that have a value for both fields. Returns an
+    (n_fields x n_fields) array, NaN where V is undefined.
+    """
+    gram = gram.astype(float)
+    membership = np.zeros((len(category_fields), n_fields))
+    membership[np.arange(len(category_fields)), category_fields] = 1.0
+    
+    # marginals[a, j]: objects with category a that also have a value for field j
+    marginals = gram @ membership
+    n = membership.T @ marginals
+    # Expected counts of cell [a, b] are marginals[a, field(b)] * marginals[b, field(a)] / n
+    expected = marginals[:, category_fields]
+    expected = expected * expected.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(expected > 0, gram ** 2 / expected, 0.0)
+        phi2 = membership.T @ ratios @ membership - 1
+        r = membership.T @ (marginals > 0)
+        k = r.T
+        phi2corr = np.maximum(0, phi2 - (k - 1) * (r - 1) / (n - 1))
+        rcorr = r - (r - 1) ** 2 / (n - 1)
+        kcorr = k - (k - 1) ** 2 / (n - 1)
+        cramer_v = np.sqrt(phi2corr / np.minimum(kcorr - 1, rcorr - 1))
+    cramer_v[(n < max(min_objects, 2)) | (r < 2) | (k < 2)] = np.nan
+    return cramer_v
+
+def snapshots_to_frame(snapshots):
+    """Flatten snapshots into a long-format frame with one row per object per snapshot"""
+    resources = [resource for snapshot in snapshots for resource in snapshot['data']]
+    timestamps = np.repeat(
+        [snapshot['timestamp'] for snapshot in snapshots],
+        [len(snapshot['data']) for snapshot in snapshots]
+    )
     
-    return correlations
+    return pd.DataFrame({
+        'timestamp': timestamps,
+        'resource_type': [resource['resource_type'] for resource in resources],
+        'namespace': [resource.get('namespace', 'cluster') for resource in resources],
+        'name': [resource.get('name', 'unknown') for resource in resources],
+        'uid': [resource.get('uid') for resource in resources],
+        'resource_version': [resource.get('resource_version', '0') for resource in resources],
+        'owner_ref_count': np.fromiter(
+            (len(resource.get('owner_references', ())) for resource in resources),
+            dtype=np.int64, count=len(resources)
+        ),
+        'has_status': np.fromiter(
+            ('status' in resource for resource in resources),
+            dtype=bool, count=len(resources)
+        ),
+    })
 
+@stage_duration.labels(stage='extract_features').time()
 def extract_features(snapshots):
     """Extract features from snapshots for anomaly detection"""
     if not snapshots:
         logger.warning("No snapshots available for feature extraction")
         return pd.DataFrame()
     
-    # Resource counts over time
-    resource_counts = {}
-    owner_ref_counts = {}
-    resource_versions = {}
-    status_changes = {}
-    
-    for snapshot in snapshots:
-        timestamp = snapshot['timestamp']
-        
-        # Initialize counters for this timestamp
-        if timestamp not in resource_counts:
-            resource_counts[timestamp] = {}
-            owner_ref_counts[timestamp] = {}
-            resource_versions[timestamp] = {}
-            status_changes[timestamp] = {}
-        
-        # Process each resource
-        for resource in snapshot['data']:
-            resource_type = resource['resource_type']
-            
-            # Count resources by type
-            if resource_type not in resource_counts[timestamp]:
-                resource_counts[timestamp][resource_type] = 0
-            resource_counts[timestamp][resource_type] += 1
-            
-            # Count owner references
-            if resource_type not in owner_ref_counts[timestamp]:
-                owner_ref_counts[timestamp][resource_type] = 0
-            owner_ref_counts[timestamp][resource_type] += len(resource.get('owner_references', []))
-            
-            # Track resource versions (for rate of change)
-            resource_id = f"{resource_type}_{resource.get('namespace', 'cluster')}_{resource.get('name', 'unknown')}"
-            resource_versions[timestamp][resource_id] = resource.get('resource_version', '0')
-            
-            # Track status changes
-            if 'status' in resource:
-                status_key = f"{resource_type}_status"
-                if status_key not in status_changes[timestamp]:
-                    status_changes[timestamp][status_key] = 0
-                status_changes[timestamp][status_key] += 1
-    
-    # Create time series dataframes
-    timestamps = sorted(resource_counts.keys())
-    
-    # Resource count features
-    resource_types = set()
-    for ts_counts in resource_counts.values():
-        resource_types.update(ts_counts.keys())
-    
-    resource_count_data = []
-    for ts in timestamps:
-        row = {'timestamp': ts}
-        for rt in resource_types:
-            row[f"count_{rt}"] = resource_counts[ts].get(rt, 0)
-        resource_count_data.append(row)
-    
-    resource_count_df = pd.DataFrame(resource_count_data)
-    
-    # Owner reference features
-    owner_ref_data = []
-    for ts in timestamps:
-        row = {'timestamp': ts}
-        for rt in resource_types:
-            row[f"owner_refs_{rt}"] = owner_ref_counts[ts].get(rt, 0)
-        owner_ref_data.append(row)
-    
-    owner_ref_df = pd.DataFrame(owner_ref_data)
-    
-    # Resource version change rate
-    version_change_data = []
-    for i in range(1, len(timestamps)):
-        prev_ts = timestamps[i-1]
-        curr_ts = timestamps[i]
-        
-        row = {'timestamp': curr_ts}
-        version_changes = 0
-        
-        for resource_id in set(resource_versions[prev_ts].keys()) | set(resource_versions[curr_ts].keys()):
-            prev_version = resource_versions[prev_ts].get(resource_id, '0')
-            curr_version = resource_versions[curr_ts].get(resource_id, '0')
-            
-            if prev_version != curr_version:
-                version_changes += 1
-        
-        row['version_change_rate'] = version_changes
-        version_change_data.append(row)
+    features_df = extract_features_from_frame(snapshots_to_frame(snapshots))
+    if features_df.empty:
+        return features_df
+    
+    # Ownership graph features, advancing one graph through the snapshots in time order
+    graph = OwnershipGraph()
+    graph_rows = {}
+    for snapshot in sorted(snapshots, key=lambda snapshot: snapshot['timestamp']):
+        graph.resync(snapshot['data'])
+        graph_rows[snapshot['timestamp']] = graph.features()
+    graph_df = pd.DataFrame.from_dict(graph_rows, orient='index')
+    return features_df.merge(graph_df, left_on='timestamp', right_index=True, how='left')
+
+@stage_duration.labels(stage='extract_features_from_frame').time()
+def extract_features_from_frame(frame):
+    """Extract features from a long-format object frame using group-bys.
+
+    The frame has one row per object per snapshot with at least the
+    timestamp, resource_type, namespace, name, resource_version,
+    owner_ref_count and has_status columns. The output has the same
+    columns as extract_features.
+    """
+    if frame.empty:
+        logger.warning("No snapshots available for feature extraction")
+        return pd.DataFrame()
+    
+    timestamps = sorted(frame['timestamp'].unique())
+    by_type = frame.groupby(['timestamp', 'resource_type'])
+    
+    # Resource counts and owner references per type
+    counts = by_type.size().unstack(fill_value=0).reindex(timestamps, fill_value=0)
+    counts.columns = [f"count_{rt}" for rt in counts.columns]
     
-    version_change_df = pd.DataFrame(version_change_data) if version_change_data else pd.DataFrame(columns=['timestamp', 'version_change_rate'])
+    owner_refs = by_type['owner_ref_count'].sum().unstack(fill_value=0).reindex(timestamps, fill_value=0)
+    owner_refs.columns = [f"owner_refs_{rt}" for rt in owner_refs.columns]
     
-    # Status change features
-    status_keys = set()
-    for ts_status in status_changes.values():
-        status_keys.update(ts_status.keys())
+    # Status counts, only for types that ever report a status
+    with_status = frame[frame['has_status']]
+    status = with_status.groupby(['timestamp', 'resource_type']).size().unstack(fill_value=0)
+    status = status.reindex(timestamps, fill_value=0)
+    status.columns = [f"{rt}_status" for rt in status.columns]
     
-    status_change_data = []
-    for ts in timestamps:
-        row = {'timestamp': ts}
-        for status_key in status_keys:
-            row[status_key] = status_changes[ts].get(status_key, 0)
-        status_change_data.append(row)
+    features_df = counts.reset_index().rename(columns={'index': 'timestamp'})
+    features_df.columns = ['timestamp'] + list(counts.columns)
     
-    status_change_df = pd.DataFrame(status_change_data)
+    if len(timestamps) > 1:
+        features_df['version_change_rate'] = calculate_version_changes(frame, timestamps).values
     
-    # Merge all features
-    feature_dfs = [resource_count_df]
+    features_df = pd.concat(
+        [features_df, owner_refs.reset_index(drop=True), status.reset_index(drop=True)],
+        axis=1
+    )
+    return features_df.fillna(0)
+
+def version_change_matrix(frame, timestamps):
+    """Flag objects whose resource version differs from the previous snapshot.
+
+    Objects and versions are factorized to integer codes and laid out in a
+    (snapshot x object) matrix, so every adjacent pair is compared in one
+    vectorized step. Objects missing from a snapshot get version '0'.
+    Returns the boolean change matrix (row 0 is all False) and the object
+    code of every frame row.
+    """
+    key_columns = ['resource_type', 'namespace', 'name']
+    position = frame['timestamp'].map({ts: i for i, ts in enumerate(timestamps)}).to_numpy()
+    object_codes = frame.groupby(key_columns, sort=False, dropna=False).ngroup().to_numpy()
+    version_codes, versions = pd.factorize(
+        pd.concat([pd.Series(['0']), frame['resource_version'].fillna('0')], ignore_index=True)
+    )
     
-    if not owner_ref_df.empty:
-        feature_dfs.append(owner_ref_df.drop(columns=['timestamp'], errors='ignore'))
+    # Code 0 is the placeholder version '0' for absent objects
+    matrix = np.zeros((len(timestamps), object_codes.max() + 1), dtype=np.int64)
+    matrix[position, object_codes] = version_codes[1:]
     
-    if not version_change_df.empty:
-        # For the first timestamp, we don't have version change data
-        merged_df = pd.merge(
-            feature_dfs[0], 
-            version_change_df,
-            on='timestamp',
-            how='left'
+    changed = np.zeros(matrix.shape, dtype=bool)
+    changed[1:] = matrix[1:] != matrix[:-1]
+    return changed, object_codes
+
+def calculate_version_changes(frame, timestamps):
+    """Count objects whose resource version differs between adjacent snapshots"""
+    changed, _ = version_change_matrix(frame, timestamps)
+    return pd.Series(changed.sum(axis=1).astype(float), index=timestamps)
+
+@stage_duration.labels(stage='extract_group_features_from_frame').time()
+def extract_group_features_from_frame(frame, max_namespaces=None, changes=None):
+    """Extract per-resource-type and per-namespace feature vectors.
+
+    Returns one row per (timestamp, scope, key), scope being
+    'resource_type' or 'namespace'. Only the max_namespaces largest
+    namespaces get their own key, the rest are folded into OTHER_NAMESPACE.
+    Raw counts are kept for reference, and the model features in
+    GROUP_FEATURE_COLUMNS are ratios and log counts so that small and large
+    groups can be scored by one model.
+
+    changes is an optional frame from changes_to_frame with the exact
+    per-uid change counts that led up to the newest snapshot; they are
+    attached to the rows of the last timestamp.
+    """
+    if frame.empty:
+        return pd.DataFrame()
+    
+    max_namespaces = max_namespaces or MAX_NAMESPACES
+    timestamps = sorted(frame['timestamp'].unique())
+    changed, object_codes = version_change_matrix(frame, timestamps)
+    
+    namespaces = frame['namespace']
+    largest = frame.loc[namespaces.notna()].groupby('namespace').size().nlargest(max_namespaces).index
+    namespace_keys = namespaces.where(namespaces.isin(largest) | namespaces.isna(), OTHER_NAMESPACE)
+    
+    group_frames = []
+    for scope, keys in (('resource_type', frame['resource_type']), ('namespace', namespace_keys)):
+        valid = keys.notna().to_numpy()
+        scoped = frame.loc[valid, ['timestamp', 'owner_ref_count', 'has_status']].assign(key=keys[valid])
+        if scoped.empty:
+            continue
+        
+        stats_df = scoped.groupby(['timestamp', 'key']).agg(
+            count=('owner_ref_count', 'size'),
+            owner_refs=('owner_ref_count', 'sum'),
+            with_status=('has_status', 'sum')
         )
-        merged_df['version_change_rate'] = merged_df['version_change_rate'].fillna(0)
-        feature_dfs[0] = merged_df
+        key_values = sorted(scoped['key'].unique())
+        full_index = pd.MultiIndex.from_product([timestamps, key_values], names=['timestamp', 'key'])
+        stats_df = stats_df.reindex(full_index, fill_value=0)
+        
+        # Sum per-object version changes into their groups in one scatter-add
+        key_position = {key: i for i, key in enumerate(key_values)}
+        object_groups = np.full(changed.shape[1], -1)
+        object_groups[object_codes[valid]] = scoped['key'].map(key_position).to_numpy()
+        in_scope = object_groups >= 0
+        group_changes = np.zeros((len(key_values), len(timestamps)))
+        np.add.at(group_changes, object_groups[in_scope], changed.T[in_scope])
+        stats_df['version_changes'] = group_changes.T.reshape(-1)
+        
+        counts = stats_df['count'].unstack()
+        previous_counts = counts.shift(1).fillna(counts)
+        count_change = ((counts - previous_counts) / previous_counts.clip(lower=1)).stack()
+        
+        denominator = stats_df['count'].clip(lower=1)
+        stats_df['log_count'] = np.log1p(stats_df['count'])
+        stats_df['owner_ref_ratio'] = stats_df['owner_refs'] / denominator
+        stats_df['status_ratio'] = stats_df['with_status'] / denominator
+        stats_df['version_change_ratio'] = stats_df['version_changes'] / denominator
+        stats_df['count_change_ratio'] = count_change.reindex(stats_df.index).values
+        
+        for column in CHANGE_COLUMNS:
+            stats_df[column] = 0
+        if changes is not None and not changes.empty:
+            if scope == 'resource_type':
+                change_keys = changes['resource_type']
+            else:
+                change_keys = changes['namespace'].where(
+                    changes['namespace'].isin(largest) | changes['namespace'].isna(), OTHER_NAMESPACE
+                )
+            by_key = changes[CHANGE_COLUMNS].groupby(change_keys.to_numpy()).sum()
+            by_key.index = pd.MultiIndex.from_product([[timestamps[-1]], by_key.index], names=['timestamp', 'key'])
+            latest = by_key.reindex(stats_df.index).dropna().index
+            stats_df.loc[latest, CHANGE_COLUMNS] = by_key.loc[latest, CHANGE_COLUMNS].to_numpy()
+        stats_df['churn_ratio'] = (
+            stats_df['created'] + stats_df['deleted'] + stats_df['updated']
+        ) / denominator
+        
+        group_frames.append(stats_df.reset_index().assign(scope=scope))
     
-    if not status_change_df.empty:
-        feature_dfs.append(status_change_df.drop(columns=['timestamp'], errors='ignore'))
+    group_df = pd.concat(group_frames, ignore_index=True)
+    return group_df[
+        ['timestamp', 'scope', 'key', 'count', 'owner_refs', 'with_status', 'version_changes']
+        + CHANGE_COLUMNS + GROUP_FEATURE_COLUMNS
+    ]
+
+def order_feature_columns(columns):
+    """Order feature columns the way extract_features lays them out"""
+    def sort_key(column):
+        if column == 'timestamp':
+            return (0, column)
+        if column.startswith('count_'):
+            return (1, column)
+        if column == 'version_change_rate':
+            return (2, column)
+        if column.startswith('owner_refs_'):
+            return (3, column)
+        return (4, column)
+    return sorted(columns, key=sort_key)
+
+class ObjectStateTable:
+    """Per-uid state table kept in step with the snapshot stream.
+
+    Mirrors the collector's table: each uid maps to its resource type,
+    namespace, name, resource version, status, owner uids and container
+    restart count. Deltas are applied object by object, so tracking costs
+    O(changes) per snapshot; only keyframes need a full resync.
+    """
+
+    def __init__(self, flap_window=FLAP_WINDOW, flap_threshold=FLAP_THRESHOLD):
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        # uid -> (resource_type, namespace, name, resource_version, status, owners, restarts)
+        self.objects = {}
+        # (resource_type, namespace, name) -> interval in which it was last deleted
+        self.recently_deleted = {}
+        # uid -> intervals in which its status changed, only for objects that changed recently
+        self.status_changes = {}
+        self.changes = Counter()
+        self.interval = 0
+
+    @staticmethod
+    def _state(obj):
+        status = dict(obj.get('status') or {})
+        restarts = status.pop('restart_count', None) or 0
+        owners = tuple(owner['uid'] for owner in obj.get('owner_references', []))
+        return (
+            obj['resource_type'], obj.get('namespace'), obj.get('name'),
+            obj.get('resource_version'), tuple(sorted(status.items())), owners, restarts
+        )
+
+    def upsert(self, obj, count=True):
+        """Record an added or modified object"""
+        uid = obj['uid']
+        new = self._state(obj)
+        old = self.objects.get(uid)
+        self.objects[uid] = new
+        if not count:
+            return
+        
+        resource_type, namespace, name = new[:3]
+        if old is None:
+            self.changes[(resource_type, namespace, 'created')] += 1
+            # A new uid under a name deleted this or last interval is a recreation
+            deleted_in = self.recently_deleted.pop((resource_type, namespace, name), None)
+            if deleted_in is not None and self.interval - deleted_in <= 1:
+                self.changes[(resource_type, namespace, 'restarted')] += 1
+        elif old[3] != new[3]:
+            self.changes[(resource_type, namespace, 'updated')] += 1
+            if old[4] != new[4]:
+                self.status_changes.setdefault(uid, deque()).append(self.interval)
+            if new[6] > old[6]:
+                self.changes[(resource_type, namespace, 'restarted')] += new[6] - old[6]
+
+    def delete(self, uid, count=True):
+        """Record a deleted object"""
+        old = self.objects.pop(uid, None)
+        if old is None:
+            return
+        self.status_changes.pop(uid, None)
+        if count:
+            resource_type, namespace, name = old[:3]
+            self.changes[(resource_type, namespace, 'deleted')] += 1
+            self.recently_deleted[(resource_type, namespace, name)] = self.interval
+
+    def apply_delta(self, delta):
+        """Apply a collector delta (added, modified and removed objects)"""
+        for uid in delta['removed']:
+            self.delete(uid)
+        for obj in delta['added']:
+            self.upsert(obj)
+        for obj in delta['modified']:
+            self.upsert(obj)
+
+    def resync(self, objects, count=True):
+        """Reconcile the table with a full snapshot, re-processing only changed versions"""
+        current = {obj['uid']: obj for obj in objects}
+        for uid in list(self.objects):
+            if uid not in current:
+                self.delete(uid, count)
+        for uid, obj in current.items():
+            state = self.objects.get(uid)
+            if state is None or state[3] != obj.get('resource_version'):
+                self.upsert(obj, count)
+
+    def end_interval(self):
+        """Return and reset the change counts of the snapshot just applied.
+
+        Returns (changes, flapping): changes maps (resource_type, namespace,
+        kind) to a count and flapping maps (resource_type, namespace) to the
+        number of objects whose status changed flap_threshold times within
+        the last flap_window snapshots.
+        """
+        changes = self.changes
+        self.changes = Counter()
+        
+        flapping = Counter()
+        oldest = self.interval - self.flap_window + 1
+        for uid, intervals in list(self.status_changes.items()):
+            while intervals and intervals[0] < oldest:
+                intervals.popleft()
+            if not intervals:
+                del self.status_changes[uid]
+            elif len(intervals) >= self.flap_threshold:
+                resource_type, namespace = self.objects[uid][:2]
+                flapping[(resource_type, namespace)] += 1
+        
+        self.recently_deleted = {
+            key: deleted_in for key, deleted_in in self.recently_deleted.items()
+            if self.interval - deleted_in < 1
+        }
+        self.interval += 1
+        return changes, flapping
+
+class CorrelationTracker:
+    """Running co-occurrence counts of categorical metadata over live objects.
+
+    The fields are the resource type, pod phase, the first owner's kind
+    and label keys, registered first come first served up to max_fields.
+    Each field keeps max_values values, later values share an "<other>"
+    category. The counts always describe the objects that currently
+    exist: deltas and resyncs subtract the categories an object was
+    counted with and add its new ones, so a cycle only encodes what changed.
+    """
+
+    def __init__(self, max_fields=CORRELATION_MAX_FIELDS, max_values=CORRELATION_MAX_VALUES):
+        self.max_fields = max_fields
+        self.max_values = max_values
+        # field name -> field index
+        self.fields = {}
+        # (field index, value) -> category index, and the field of each category
+        self.categories = {}
+        self.category_fields = []
+        self.field_value_counts = []
+        capacity = max_fields * (max_values + 1)
+        self.gram = np.zeros((capacity, capacity), dtype=np.int64)
+        # uid -> category indices the object is counted with
+        self.codes = {}
+        for field in ('resource_type', 'status_phase', 'owner_kind'):
+            self._field(field)
+
+    def _field(self, name):
+        field = self.fields.get(name)
+        if field is None and len(self.fields) < self.max_fields:
+            field = self.fields[name] = len(self.fields)
+            self.field_value_counts.append(0)
+        return field
+
+    def _category(self, field, value):
+        category = self.categories.get((field, value))
+        if category is None:
+            # the extra slot of each field is kept for "<other>"
+            if value != "<other>" and self.field_value_counts[field] >= self.max_values:
+                return self._category(field, "<other>")
+            category = self.categories[(field, value)] = len(self.category_fields)
+            self.category_fields.append(field)
+            self.field_value_counts[field] += 1
+        return category
+
+    def _encode(self, obj):
+        values = [('resource_type', obj.get('resource_type'))]
+        phase = (obj.get('status') or {}).get('phase')
+        if phase is not None:
+            values.append(('status_phase', phase))
+        owners = obj.get('owner_references') or []
+        values.append(('owner_kind', owners[0].get('kind') if owners else 'none'))
+        for key, value in sorted((obj.get('labels') or {}).items()):
+            values.append((f"label:{key}", value))
+        
+        codes = []
+        for name, value in values:
+            field = self._field(name)
+            if field is not None:
+                category = self._category(field, str(value))
+                if category is not None:
+                    codes.append(category)
+        return tuple(codes)
+
+    def _accumulate(self, code_lists, sign):
+        if not code_lists:
+            return
+        codes = np.full((len(code_lists), max(len(c) for c in code_lists)), -1, dtype=np.int64)
+        for row, object_codes in enumerate(code_lists):
+            codes[row, :len(object_codes)] = object_codes
+        n = len(self.category_fields)
+        self.gram[:n, :n] += sign * contingency_gram(codes, n)
+
+    def _update(self, objects, removed_uids):
+        added = []
+        subtracted = []
+        for obj in objects:
+            codes = self._encode(obj)
+            previous = self.codes.get(obj['uid'])
+            if previous == codes:
+                continue
+            if previous is not None:
+                subtracted.append(previous)
+            added.append(codes)
+            self.codes[obj['uid']] = codes
+        for uid in removed_uids:
+            previous = self.codes.pop(uid, None)
+            if previous is not None:
+                subtracted.append(previous)
+        self._accumulate(added, 1)
+        self._accumulate(subtracted, -1)
+
+    def apply_delta(self, delta):
+        """Update the counts from a delta snapshot"""
+        self._update(delta['added'] + delta['modified'], delta['removed'])
+
+    def resync(self, objects):
+        """Update the counts to a full snapshot"""
+        objects = list(objects)
+        live = {obj['uid'] for obj in objects}
+        self._update(objects, [uid for uid in self.codes if uid not in live])
+
+    @stage_duration.labels(stage='correlations').time()
+    def scores(self, min_objects=CORRELATION_MIN_OBJECTS):
+        """Return Cramer's V of every field pair with enough objects, keyed 'field1__field2'"""
+        n = len(self.category_fields)
+        if n == 0:
+            return {}
+        cramer_v = batch_cramers_v(
+            self.gram[:n, :n], np.array(self.category_fields), len(self.fields), min_objects
+        )
+        names = list(self.fields)
+        rows, columns = np.triu_indices(len(names), k=1)
+        return {
+            f"{names[i]}__{names[j]}": float(cramer_v[i, j])
+            for i, j in zip(rows, columns) if not np.isnan(cramer_v[i, j])
+        }
+
+def update_correlation_metrics(correlations, top_n=None):
+    """Export the top_n most strongly associated field pairs and drop the rest"""
+    global exported_field_pairs
+    top_n = top_n or CORRELATION_TOP_N
+    top = sorted(correlations.items(), key=lambda item: item[1], reverse=True)[:top_n]
     
-    # Combine all feature sets
-    features_df = feature_dfs[0]
-    for df in feature_dfs[1:]:
-        features_df = pd.concat([features_df, df], axis=1)
+    for field_pair, value in top:
+        correlation_score.labels(field_pair=field_pair).set(value)
+    for field_pair in exported_field_pairs - {field_pair for field_pair, _ in top}:
+        correlation_score.remove(field_pair)
+    exported_field_pairs = {field_pair for field_pair, _ in top}
+
+class OwnershipGraph:
+    """Ownership forest of the live objects, indexed by uid.
+
+    Every uid gets a dense node id. Owners that are referenced but not (or
+    no longer) present get a placeholder node carrying the referenced kind,
+    so a reference never has to be resolved later. Nodes are stored in
+    parallel arrays: kind code, parent node (the first owner, -1 for none),
+    whether the object exists, pod readiness (-1 for other kinds) and how
+    many nodes point at it. A node is freed for reuse once its object is
+    gone and nothing references it. Updates cost O(changed objects) and
+    features are computed with vectorized passes over the arrays.
+    """
+
+    def __init__(self, capacity=1024):
+        # uid -> node id, node id -> uid (None for free nodes)
+        self.ids = {}
+        self.uids = []
+        self.free = []
+        # kind name -> kind code
+        self.kinds = {}
+        self.kind = np.zeros(capacity, dtype=np.int16)
+        self.parent = np.full(capacity, -1, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.ready = np.full(capacity, -1, dtype=np.int8)
+        self.refs = np.zeros(capacity, dtype=np.int32)
+        # Objects removed in the last update whose owner no longer exists
+        self.cascade_deletions = 0
+
+    def _kind(self, name):
+        return self.kinds.setdefault(name, len(self.kinds))
+
+    def _grow(self):
+        capacity = 2 * len(self.kind)
+        for name in ('kind', 'parent', 'alive', 'ready', 'refs'):
+            old = getattr(self, name)
+            new = np.full(capacity, -1 if name in ('parent', 'ready') else 0, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _node(self, uid, kind):
+        """Return the node of a uid, adding a placeholder if it is new"""
+        node = self.ids.get(uid)
+        if node is not None:
+            return node
+        if self.free:
+            node = self.free.pop()
+        else:
+            node = len(self.uids)
+            self.uids.append(None)
+            if node >= len(self.kind):
+                self._grow()
+        self.ids[uid] = node
+        self.uids[node] = uid
+        self.kind[node] = self._kind(kind)
+        self.parent[node] = -1
+        self.alive[node] = False
+        self.ready[node] = -1
+        self.refs[node] = 0
+        return node
+
+    def _release(self, node):
+        """Free a node that is gone and unreferenced, then its owners in turn"""
+        while node >= 0 and not self.alive[node] and self.refs[node] == 0:
+            parent = self.parent[node]
+            del self.ids[self.uids[node]]
+            self.uids[node] = None
+            self.parent[node] = -1
+            self.free.append(node)
+            if parent >= 0:
+                self.refs[parent] -= 1
+            node = parent
+
+    def upsert(self, obj):
+        """Add or update one object"""
+        kind = RESOURCE_KINDS.get(obj['resource_type'], obj['resource_type'])
+        node = self._node(obj['uid'], kind)
+        self.kind[node] = self._kind(kind)
+        self.alive[node] = True
+        
+        if obj['resource_type'] == 'pods':
+            status = obj.get('status') or {}
+            ready = status.get('ready')
+            if ready is None:
+                # Snapshots from before pod readiness was collected
+                ready = status.get('phase', status.get('status_phase')) == 'Running'
+            self.ready[node] = 1 if ready else 0
+        
+        owners = obj.get('owner_references') or []
+        parent = -1
+        if owners and owners[0].get('uid') and owners[0]['uid'] != obj['uid']:
+            parent = self._node(owners[0]['uid'], owners[0].get('kind'))
+        previous = self.parent[node]
+        if parent != previous:
+            self.parent[node] = parent
+            if parent >= 0:
+                self.refs[parent] += 1
+            if previous >= 0:
+                self.refs[previous] -= 1
+                self._release(previous)
+
+    def _remove(self, uids):
+        nodes = [self.ids[uid] for uid in uids if uid in self.ids and self.alive[self.ids[uid]]]
+        self.alive[nodes] = False
+        # Removals are applied together, so a child removed alongside its owner counts
+        self.cascade_deletions = sum(
+            1 for node in nodes if self.parent[node] >= 0 and not self.alive[self.parent[node]]
+        )
+        for node in nodes:
+            self._release(node)
+
+    def apply_delta(self, delta):
+        """Update the graph from a delta snapshot"""
+        for obj in delta['added'] + delta['modified']:
+            self.upsert(obj)
+        self._remove(delta['removed'])
+
+    def resync(self, objects):
+        """Update the graph to a full snapshot"""
+        live = set()
+        for obj in objects:
+            self.upsert(obj)
+            live.add(obj['uid'])
+        self._remove([uid for uid, node in self.ids.items() if self.alive[node] and uid not in live])
+
+    @stage_duration.labels(stage='ownership_graph').time()
+    def features(self):
+        """Return depth, fan-out, orphan, unready workload and cascade deletion features"""
+        n = len(self.uids)
+        alive = self.alive[:n]
+        parent = self.parent[:n]
+        kind = self.kind[:n]
+        has_parent = alive & (parent >= 0)
+        parent_alive = np.zeros(n, dtype=bool)
+        parent_alive[has_parent] = alive[parent[has_parent]]
+        features = {}
+        
+        # Objects whose owner does not exist, by the owner's kind
+        orphans = np.bincount(kind[parent[has_parent & ~parent_alive]], minlength=len(self.kinds))
+        for name in GRAPH_OWNER_KINDS:
+            code = self.kinds.get(name)
+            features[f"orphans_{name.lower()}"] = int(orphans[code]) if code is not None else 0
+        
+        # Fan-out over edges between existing objects
+        up = np.where(has_parent & parent_alive, parent, -1)
+        fanout = np.bincount(up[up >= 0], minlength=n)
+        owner_fanout = fanout[alive & (fanout > 0)]
+        features['owner_fanout_mean'] = float(owner_fanout.mean()) if owner_fanout.size else 0.0
+        features['owner_fanout_p90'] = float(np.percentile(owner_fanout, 90)) if owner_fanout.size else 0.0
+        features['owner_fanout_max'] = int(owner_fanout.max()) if owner_fanout.size else 0
+        replicasets = alive & (kind == self.kinds.get('ReplicaSet', -1))
+        features['replicaset_fanout_max'] = int(fanout[replicasets].max()) if replicasets.any() else 0
+        
+        # Walk every object up one level per pass, counting its depth and
+        # crediting each pod to all of its ancestors
+        depth = np.zeros(n, dtype=np.int64)
+        pods = alive & (self.ready[:n] >= 0)
+        ready_pods = pods & (self.ready[:n] == 1)
+        pod_total = np.zeros(n, dtype=np.int64)
+        pod_ready = np.zeros(n, dtype=np.int64)
+        ancestor = up.copy()
+        for _ in range(GRAPH_MAX_DEPTH):
+            linked = ancestor >= 0
+            if not linked.any():
+                break
+            depth[linked] += 1
+            pod_total += np.bincount(ancestor[linked & pods], minlength=n)
+            pod_ready += np.bincount(ancestor[linked & ready_pods], minlength=n)
+            ancestor[linked] = up[ancestor[linked]]
+        
+        depth = depth[alive]
+        features['owner_depth_max'] = int(depth.max()) if depth.size else 0
+        features['owner_depth_mean'] = float(depth.mean()) if depth.size else 0.0
+        for name in GRAPH_WORKLOAD_KINDS:
+            workloads = alive & (kind == self.kinds.get(name, -1)) & (pod_total > 0) & (pod_ready == 0)
+            features[f"unready_{name.lower()}s"] = int(workloads.sum())
+        features['cascade_deletions'] = self.cascade_deletions
+        return features
+
+def changes_to_frame(changes, flapping):
+    """Turn end_interval counters into one row per (resource_type, namespace)"""
+    rows = {}
+    for (resource_type, namespace, kind), count in changes.items():
+        rows.setdefault((resource_type, namespace), dict.fromkeys(CHANGE_COLUMNS, 0))[kind] += count
+    for (resource_type, namespace), count in flapping.items():
+        rows.setdefault((resource_type, namespace), dict.fromkeys(CHANGE_COLUMNS, 0))['flapping'] += count
     
-    # Fill NaN values
-    features_df = features_df.fillna(0)
+    return pd.DataFrame(
+        [{'resource_type': rt, 'namespace': ns, **counts} for (rt, ns), counts in rows.items()],
+        columns=['resource_type', 'namespace'] + CHANGE_COLUMNS
+    )
+
+def frame_to_objects(frame):
+    """Rebuild minimal object dicts from a columnar snapshot for state tracking"""
+    objects = []
+    for row in frame.itertuples(index=False):
+        status = {}
+        # Tables from older collectors have no ready or owner columns
+        for field in ('status_phase', 'ready_replicas', 'replicas', 'ready'):
+            value = getattr(row, field, None)
+            if value is not None and not pd.isna(value):
+                status[field] = value
+        owner_uid = getattr(row, 'owner_uid', None)
+        objects.append({
+            'uid': row.uid,
+            'resource_type': row.resource_type,
+            'namespace': row.namespace,
+            'name': row.name,
+            'resource_version': row.resource_version,
+            'status': status,
+            'owner_references': [{'kind': row.owner_kind, 'uid': owner_uid}] if isinstance(owner_uid, str) else [],
+        })
+    return objects
+
+class FeatureWindow:
+    """Sliding window of per-snapshot feature rows maintained incrementally.
+
+    Feature rows are cached by (snapshot file, mtime). Each update only
+    reads and featurizes snapshots that are not cached yet, evicts rows
+    that fell out of the window and advances the EWMA state by the new
+    rows, so the cost of a cycle is proportional to the new data.
+    """
+
+    def __init__(self, window_size, input_format="json", span=3):
+        self.window_size = window_size
+        self.input_format = input_format
+        self.alpha = 2.0 / (span + 1)
+        # (file, mtime) -> feature row including its _ewma columns
+        self.rows = OrderedDict()
+        # (file, mtime) -> per-resource-type and per-namespace feature rows
+        self.group_rows = OrderedDict()
+        # Replay state for delta snapshots (see load_snapshot_range)
+        self.replay_state = {}
+        # Frame of the newest snapshot, for version changes against the next one
+        self.last_frame = None
+        # Per-uid state for exact created/deleted/updated counts and the file it reflects
+        self.object_state = ObjectStateTable()
+        self.last_state_file = None
+        # Running contingency counts of categorical metadata
+        self.correlations = CorrelationTracker()
+        self.graph = OwnershipGraph()
+        # EWMA numerators per column and the shared denominator (pandas adjust=True form)
+        self.ewma_numerators = {}
+        self.ewma_denominator = 0.0
+        self.feature_columns = []
+
+    def _list_files(self, input_dir):
+        if self.input_format == "table":
+            return list_snapshot_tables(input_dir)
+        return list_snapshot_files(input_dir)
+
+    def _load_new(self, files, first_new):
+        """Yield (file, long-format frame, snapshot or None) for files[first_new:]"""
+        if self.input_format == "table":
+            for file_path in files[first_new:]:
+                try:
+                    yield file_path, read_snapshot_table(file_path), None
+                except Exception as e:
+                    logger.error(f"Error loading snapshot table {file_path}: {e}")
+        else:
+            for snapshot in load_snapshot_range(files, first_new, self.replay_state):
+                yield snapshot['file'], snapshots_to_frame([snapshot]), snapshot
+
+    def _track_changes(self, file_path, frame, snapshot):
+        """Advance the per-uid state table by one snapshot and return its changes.
+
+        A delta that follows the last applied snapshot is applied object by
+        object; anything else (keyframes, tables, gaps) is resynced.
+        """
+        delta = snapshot.get('delta') if snapshot else None
+        follows = self.last_state_file is not None and delta is not None \
+            and delta.get('base') == os.path.basename(self.last_state_file)
+        
+        if follows:
+            self.object_state.apply_delta(delta)
+            self.correlations.apply_delta(delta)
+            self.graph.apply_delta(delta)
+        else:
+            objects = snapshot['data'] if snapshot else frame_to_objects(frame)
+            # The first snapshot seen is the baseline rather than a burst of creations
+            self.object_state.resync(objects, count=self.last_state_file is not None)
+            self.correlations.resync(objects)
+            self.graph.resync(objects)
+        
+        self.last_state_file = file_path
+        return changes_to_frame(*self.object_state.end_interval())
+
+    def _featurize(self, frame, changes):
+        """Compute the feature row and group rows for a single snapshot's frame"""
+        timestamp = frame['timestamp'].iloc[0]
+        pair = frame if self.last_frame is None else pd.concat([self.last_frame, frame], ignore_index=True)
+        
+        row = extract_features_from_frame(pair).iloc[-1].to_dict()
+        row.setdefault('version_change_rate', 0.0)
+        row['objects_created'] = int(changes['created'].sum())
+        row['objects_deleted'] = int(changes['deleted'].sum())
+        row['objects_updated'] = int(changes['updated'].sum())
+        row['object_restarts'] = int(changes['restarted'].sum())
+        row['flapping_objects'] = int(changes['flapping'].sum())
+        row.update(self.graph.features())
+        groups = extract_group_features_from_frame(pair, changes=changes)
+        groups = groups[groups['timestamp'] == timestamp].reset_index(drop=True)
+        
+        self.last_frame = frame[[
+            'timestamp', 'resource_type', 'namespace', 'name',
+            'resource_version', 'owner_ref_count', 'has_status'
+        ]]
+        return row, groups
+
+    def _advance_ewma(self, row):
+        """Add the _ewma columns to a new row and advance the EWMA state"""
+        decay = 1.0 - self.alpha
+        self.ewma_denominator = 1.0 + decay * self.ewma_denominator
+        for column in set(self.ewma_numerators) | set(row):
+            if column == 'timestamp' or column.endswith('_ewma'):
+                continue
+            # Columns that are new to the stream count as zero before they appeared
+            self.ewma_numerators[column] = row.get(column, 0) + decay * self.ewma_numerators.get(column, 0.0)
+            row[f"{column}_ewma"] = self.ewma_numerators[column] / self.ewma_denominator
+
+    @staticmethod
+    def _file_key(file_path):
+        """Key a window row by file and mtime, so a rewritten file is featurized again"""
+        try:
+            return file_path, os.path.getmtime(file_path)
+        except OSError:
+            # Removed by cleanup since it was listed
+            return file_path, None
+
+    @stage_duration.labels(stage='feature_window_update').time()
+    def update(self, input_dir):
+        """Bring the window up to date and return its features with _ewma columns"""
+        all_files = self._list_files(input_dir)
+        keys = [self._file_key(file_path) for file_path in all_files[-self.window_size:]]
+        
+        # Evict rows that left the window or whose file was rewritten
+        for key in list(self.rows):
+            if key not in keys:
+                del self.rows[key]
+                del self.group_rows[key]
+        
+        new_keys = [key for key in keys if key not in self.rows]
+        if new_keys and any(keys.index(key) > keys.index(new_keys[0]) for key in self.rows):
+            # A snapshot inside the window changed, so the incremental state is stale
+            logger.warning("Snapshot window changed out of order, rebuilding")
+            self.__init__(self.window_size, self.input_format, span=2.0 / self.alpha - 1)
+            new_keys = keys
+        
+        if new_keys:
+            start_time = time.time()
+            objects = 0
+            first_new = all_files.index(new_keys[0][0])
+            listed = dict(keys)
+            for file_path, frame, snapshot in self._load_new(all_files, first_new):
+                if frame.empty:
+                    continue
+                objects += len(frame)
+                self._append((file_path, listed[file_path]), file_path, frame, snapshot)
+            elapsed = time.time() - start_time
+            if elapsed > 0:
+                objects_per_second.set(objects / elapsed)
+            logger.info(f"Featurized {len(new_keys)} new snapshots, window has {len(self.rows)}")
+        
+        return self.features()
+
+    @stage_duration.labels(stage='feature_window_push').time()
+    def push(self, snapshot):
+        """Add a snapshot received over the handoff stream and return the window's features"""
+        frame = snapshots_to_frame([snapshot])
+        if not frame.empty:
+            start_time = time.time()
+            # Streamed snapshots have no file on this side, so they are keyed by name alone
+            self._append((snapshot['file'], None), snapshot['file'], frame, snapshot)
+            elapsed = time.time() - start_time
+            if elapsed > 0:
+                objects_per_second.set(len(frame) / elapsed)
+        return self.features()
+
+    def _append(self, key, file_path, frame, snapshot):
+        """Featurize one snapshot, append its rows and drop rows beyond the window"""
+        changes = self._track_changes(file_path, frame, snapshot)
+        row, groups = self._featurize(frame, changes)
+        self._advance_ewma(row)
+        self.rows[key] = row
+        self.group_rows[key] = groups
+        while len(self.rows) > self.window_size:
+            self.rows.popitem(last=False)
+            self.group_rows.popitem(last=False)
+
+    def features(self):
+        """Return the window's feature rows with their _ewma columns"""
+        if not self.rows:
+            return pd.DataFrame()
+        
+        features_df = pd.DataFrame(list(self.rows.values())).fillna(0)
+        self.feature_columns = order_feature_columns(
+            [column for column in features_df.columns if not column.endswith('_ewma')]
+        )
+        ewma_columns = [f"{column}_ewma" for column in self.feature_columns if column != 'timestamp']
+        return features_df[self.feature_columns + ewma_columns]
+
+    def group_features(self):
+        """Return the per-resource-type and per-namespace rows of the window"""
+        if not self.group_rows:
+            return pd.DataFrame()
+        return pd.concat(list(self.group_rows.values()), ignore_index=True)
+
+    # Bumped whenever the pickled state changes shape, so old checkpoints are ignored
+    CHECKPOINT_VERSION = 1
+
+    @stage_duration.labels(stage='checkpoint_save').time()
+    def save(self, path):
+        """Pickle the window state atomically"""
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp-{os.path.basename(path)}")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': self.CHECKPOINT_VERSION, 'window': self}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        bytes_written.inc(os.path.getsize(path))
+
+    @classmethod
+    @stage_duration.labels(stage='checkpoint_restore').time()
+    def load(cls, path, window_size, input_format="json", span=3):
+        """Restore a checkpointed window, or start an empty one if none matches the configuration"""
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    checkpoint = pickle.load(f)
+                window = checkpoint['window']
+                if checkpoint.get('version') != cls.CHECKPOINT_VERSION:
+                    logger.info(f"Ignoring checkpoint {path} from an older version")
+                elif (window.window_size, window.input_format, window.alpha) != (window_size, input_format, 2.0 / (span + 1)):
+                    logger.info(f"Ignoring checkpoint {path} taken with a different window configuration")
+                else:
+                    logger.info(f"Restored feature window with {len(window.rows)} snapshots from {path}")
+                    return window
+            except Exception as e:
+                logger.error(f"Error loading checkpoint {path}: {e}")
+        return cls(window_size, input_format, span)
+
+class PartialSnapshotMerger:
+    """Merges the partial snapshots of sharded collectors into full snapshots.
+
+    Partials are grouped by their timestamp, which the collectors align to
+    the collection interval. A timestamp is complete once its partials
+    cover every shard; its objects are then merged by uid, so a shard
+    collected twice during a rebalance is not counted twice. Incomplete
+    timestamps older than a completed one are dropped, as are partials
+    arriving for a timestamp at or before the last merged one.
+    """
+
+    def __init__(self, max_pending=PARTIAL_MAX_PENDING, last_merged=None):
+        self.max_pending = max_pending
+        self.last_merged = last_merged
+        # timestamp -> {partial name: partial content}
+        self.pending = {}
+
+    def _drop(self, timestamp):
+        shards = set().union(*(set(partial["shards"]) for partial in self.pending.pop(timestamp).values()))
+        logger.warning(f"Dropping incomplete partial snapshots for {timestamp}: only shards {sorted(shards)} arrived")
+        partial_snapshots_dropped.inc()
+
+    def add(self, timestamp, name, partial):
+        """Add a partial snapshot; returns the merged objects once the timestamp is complete, else None"""
+        if self.last_merged is not None and timestamp <= self.last_merged:
+            logger.warning(f"Ignoring partial snapshot {name}: {timestamp} was already merged")
+            return None
+        
+        partials = self.pending.setdefault(timestamp, {})
+        partials[name] = partial
+        covered = set().union(*(set(p["shards"]) for p in partials.values()))
+        if not covered >= set(range(partial["shard_count"])):
+            while len(self.pending) > self.max_pending:
+                self._drop(min(self.pending))
+            return None
+        
+        objects = {}
+        for p in partials.values():
+            for obj in p["objects"]:
+                objects[obj["uid"]] = obj
+        del self.pending[timestamp]
+        for older in [t for t in self.pending if t < timestamp]:
+            self._drop(older)
+        self.last_merged = timestamp
+        return list(objects.values())
+
+@stage_duration.labels(stage='merge_partial_snapshots').time()
+def merge_partial_snapshots(input_dir, merged_dir):
+    """Merge complete sets of partial snapshots in input_dir into full snapshots in merged_dir"""
+    os.makedirs(merged_dir, exist_ok=True)
+    merged_files = list_snapshot_files(merged_dir)
+    merger = PartialSnapshotMerger(
+        max_pending=float('inf'),
+        last_merged=parse_snapshot_name(merged_files[-1])[0] if merged_files else None
+    )
     
-    return features_df
+    for timestamp, file_paths in sorted(list_partial_snapshots(input_dir).items()):
+        if merger.last_merged is not None and timestamp <= merger.last_merged:
+            continue
+        for file_path in file_paths:
+            try:
+                objects = merger.add(timestamp, os.path.basename(file_path), read_snapshot_file(file_path))
+            except Exception as e:
+                logger.error(f"Error reading partial snapshot {file_path}: {e}")
+                continue
+            if objects is not None:
+                path = os.path.join(merged_dir, f"metadata_snapshot_{timestamp}.full.json.gz")
+                tmp_path = os.path.join(merged_dir, f".tmp-{os.path.basename(path)}")
+                with open(tmp_path, 'wb') as f:
+                    f.write(gzip.compress(json.dumps(objects).encode('utf-8')))
+                os.replace(tmp_path, path)
+                bytes_written.inc(os.path.getsize(path))
+                logger.info(f"Merged {len(file_paths)} partial snapshots for {timestamp} ({len(objects)} objects)")
+    
+    # Incomplete timestamps are picked up again on the next cycle
+    for old_file in list_snapshot_files(merged_dir)[:-MERGED_SNAPSHOTS_TO_KEEP]:
+        os.remove(old_file)
+
+class SnapshotReceiver:
+    """Accepts snapshots streamed by the metadata collector.
+
+    Frames carry a length-prefixed JSON header (name, kind, encoding,
+    sent_at) and the length-prefixed snapshot bytes. A frame is
+    acknowledged once it is queued; the queue is bounded, so when
+    processing falls behind the connection stops being read and the
+    collector is held back by TCP flow control. Deltas are replayed on
+    top of the last received snapshot in the order they are taken from
+    the queue, and partial snapshots from sharded collectors are merged.
+    """
+
+    def __init__(self, port, queue_size=HANDOFF_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Last rebuilt snapshot keyed by uid and its name (see load_snapshot_range)
+        self.replay_state = {}
+        self.merger = PartialSnapshotMerger()
+        receiver = self
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                logger.info(f"Handoff connection from {self.client_address[0]}")
+                try:
+                    while True:
+                        header_length = self.rfile.read(4)
+                        if len(header_length) < 4:
+                            break
+                        header = json.loads(self.rfile.read(struct.unpack(">I", header_length)[0]))
+                        data = self.rfile.read(struct.unpack(">I", self.rfile.read(4))[0])
+                        bytes_read.inc(len(data))
+                        receiver.queue.put((header, data))
+                        self.wfile.write(b"\x01")
+                except (OSError, ValueError, struct.error) as e:
+                    logger.error(f"Handoff connection from {self.client_address[0]} failed: {e}")
+        
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(("", port), Handler)
+        self.server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="handoff-receiver", daemon=True).start()
+
+    def next_snapshot(self, timeout=None):
+        """Wait for the next snapshot and rebuild it, or return None on timeout or a broken chain"""
+        try:
+            header, data = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        
+        handoff_lag.set(max(0.0, time.time() - header.get('sent_at', time.time())))
+        handoff_received.labels(kind=header['kind']).inc()
+        name = header['name']
+        try:
+            content = decode_snapshot(data, header.get('encoding', ''))
+        except Exception as e:
+            logger.error(f"Error decoding streamed snapshot {name}: {e}")
+            self.replay_state = {}
+            return None
+        
+        if name.startswith("metadata_partial_"):
+            timestamp = parse_snapshot_name(name)[0]
+            objects = self.merger.add(timestamp, name, content)
+            if objects is None:
+                return None
+            return {
+                'timestamp': timestamp,
+                'file': f"metadata_snapshot_{timestamp}.merged",
+                'data': objects,
+                'delta': None
+            }
+        
+        if header['kind'] == "full":
+            self.replay_state['objects'] = {obj["uid"]: obj for obj in content}
+        elif self.replay_state.get('objects') is None or content.get("base") != self.replay_state.get('previous_name'):
+            logger.warning(f"Skipping streamed delta {name}: base {content.get('base')} not received")
+            return None
+        else:
+            apply_delta(self.replay_state['objects'], content)
+        self.replay_state['previous_name'] = name
+        
+        return {
+            'timestamp': parse_snapshot_name(name)[0],
+            'file': name,
+            'data': list(self.replay_state['objects'].values()),
+            'delta': content if header['kind'] == "delta" else None
+        }
+
+class AnomalyModel:
+    """Long-lived anomaly model trained on a bounded history of feature rows.
+
+    The scaler is updated with partial_fit as rows arrive (running mean and
+    variance) and the Isolation Forest is refit on the whole history only
+    when it is missing, stale, the feature set changed or the new rows
+    drift away from the running statistics. The model is pickled to the
+    output volume so restarts keep it.
+    """
 
-def detect_anomalies(features_df):
-    """Detect anomalies using Isolation Forest"""
+    def __init__(self, history_size=MODEL_HISTORY_SIZE, id_columns=('timestamp',)):
+        self.history_size = history_size
+        # Columns that identify a row rather than describe it
+        self.id_columns = list(id_columns)
+        self.history = pd.DataFrame()
+        self.columns = []
+        self.scaler = None
+        self.clf = None
+        self.fitted_at = 0.0
+        self.drift_detected = False
+
+    def observe(self, features_df):
+        """Add rows not seen before to the history and update the scaler"""
+        new_rows = features_df
+        if not self.history.empty and 'timestamp' in features_df:
+            new_rows = features_df[~features_df['timestamp'].isin(self.history['timestamp'])]
+        if new_rows.empty:
+            return new_rows
+        
+        self.history = pd.concat([self.history, new_rows], ignore_index=True).fillna(0)
+        self.history = self.history.iloc[-self.history_size:].reset_index(drop=True)
+        
+        X_new = new_rows.drop(columns=self.id_columns, errors='ignore')
+        if self.scaler is not None and list(X_new.columns) == self.columns:
+            z = np.abs(self.scaler.transform(X_new))
+            if np.mean(z) > MODEL_DRIFT_THRESHOLD:
+                logger.info(f"Feature drift detected (mean |z| = {np.mean(z):.2f})")
+                self.drift_detected = True
+            self.scaler.partial_fit(X_new)
+        
+        return new_rows
+
+    def needs_refit(self, columns):
+        """Decide whether the forest has to be retrained"""
+        return (
+            self.clf is None
+            or list(columns) != self.columns
+            or self.drift_detected
+            or len(self.history) < MODEL_MIN_SAMPLES
+            or time.time() - self.fitted_at > MODEL_REFIT_INTERVAL
+        )
+
+    def fit(self, columns):
+        """Fit the scaler and Isolation Forest on the full history"""
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+        
+        with model_fit_seconds.time():
+            self.columns = list(columns)
+            X = self.history.reindex(columns=self.columns, fill_value=0)
+            self.scaler = StandardScaler()
+            X_scaled = self.scaler.fit_transform(X)
+            self.clf = IsolationForest(
+                n_estimators=100,
+                max_samples='auto',
+                contamination=0.1,
+                random_state=42
+            )
+            self.clf.fit(X_scaled)
+        self.fitted_at = time.time()
+        self.drift_detected = False
+        logger.info(f"Fitted anomaly model on {len(X)} rows with {len(self.columns)} features")
+
+    def score(self, X):
+        """Return anomaly scores (higher = more anomalous) and the anomaly threshold"""
+        with model_score_seconds.time():
+            scores = -self.clf.score_samples(self.scaler.transform(X[self.columns]))
+        return scores, -self.clf.offset_
+
+    def save(self, path):
+        """Pickle the model atomically next to the processed data"""
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp-{os.path.basename(path)}")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(tmp_path, path)
+        bytes_written.inc(os.path.getsize(path))
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Load a persisted model, or start a new one if none can be read"""
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    model = pickle.load(f)
+                logger.info(f"Loaded anomaly model with {len(model.history)} rows of history from {path}")
+                return model
+            except Exception as e:
+                logger.error(f"Error loading anomaly model {path}: {e}")
+        return cls(**kwargs)
+
+@stage_duration.labels(stage='detect_anomalies').time()
+def detect_anomalies(features_df, model=None):
+    """Detect anomalies using Isolation Forest.
+
+    With a persistent AnomalyModel the window is added to its history and
+    scored against it; without one a throwaway model is fit on the window.
+    """
     if features_df.empty or len(features_df) < 2:
         logger.warning("Not enough data for anomaly detection")
         return pd.DataFrame()
@@ -232,26 +1544,36 @@ def detect_anomalies(features_df):
     # Drop timestamp column for modeling
     X = features_df.drop(columns=['timestamp'], errors='ignore')
     
-    # Scale features
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-    
-    # Apply Isolation Forest
-    clf = IsolationForest(
-        n_estimators=100,
-        max_samples='auto',
-        contamination=0.1,
-        random_state=42
-    )
-    
-    # Fit and predict
-    anomaly_scores = clf.fit_predict(X_scaled)
-    anomaly_scores = -clf.score_samples(X_scaled)  # Higher score = more anomalous
+    if model is not None:
+        model.observe(features_df)
+        if model.needs_refit(X.columns):
+            model.fit(X.columns)
+        anomaly_scores, threshold = model.score(X)
+    else:
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+        
+        # Scale features
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+        
+        # Apply Isolation Forest
+        clf = IsolationForest(
+            n_estimators=100,
+            max_samples='auto',
+            contamination=0.1,
+            random_state=42
+        )
+        
+        # Fit and predict
+        clf.fit(X_scaled)
+        anomaly_scores = -clf.score_samples(X_scaled)  # Higher score = more anomalous
+        threshold = np.percentile(anomaly_scores, 90)
     
     # Add anomaly scores back to features
     result_df = features_df.copy()
     result_df['anomaly_score'] = anomaly_scores
-    result_df['is_anomaly'] = anomaly_scores > np.percentile(anomaly_scores, 90)
+    result_df['is_anomaly'] = anomaly_scores > threshold
     
     # Update Prometheus metrics
     avg_anomaly_score = np.mean(anomaly_scores)
@@ -259,6 +1581,219 @@ def detect_anomalies(features_df):
     
     return result_df
 
+@stage_duration.labels(stage='detect_group_anomalies').time()
+def detect_group_anomalies(group_df, model, top_k=None):
+    """Score the newest per-resource-type and per-namespace vectors in one batch.
+
+    All group rows of the latest snapshot are stacked into one matrix and
+    scored with a single score_samples call. Every resource type is
+    exported; only the top_k highest-scoring namespaces are, and
+    namespaces that drop out of the top K are removed from the gauge.
+    """
+    global exported_namespaces
+    
+    if group_df.empty:
+        return pd.DataFrame()
+    
+    top_k = top_k or ANOMALY_TOP_K
+    features = group_df[['timestamp', 'scope', 'key'] + GROUP_FEATURE_COLUMNS]
+    model.observe(features)
+    if model.needs_refit(GROUP_FEATURE_COLUMNS):
+        model.fit(GROUP_FEATURE_COLUMNS)
+    
+    latest = group_df[group_df['timestamp'] == group_df['timestamp'].max()].copy()
+    scores, threshold = model.score(latest)
+    latest['anomaly_score'] = scores
+    latest['is_anomaly'] = scores > threshold
+    
+    for row in latest[latest['scope'] == 'resource_type'].itertuples():
+        anomaly_score.labels(resource_type=row.key).set(row.anomaly_score)
+    
+    top_namespaces = latest[latest['scope'] == 'namespace'].nlargest(top_k, 'anomaly_score')
+    for row in top_namespaces.itertuples():
+        namespace_anomaly_score.labels(namespace=row.key).set(row.anomaly_score)
+    for namespace in exported_namespaces - set(top_namespaces['key']):
+        namespace_anomaly_score.remove(namespace)
+    exported_namespaces = set(top_namespaces['key'])
+    
+    return latest
+
+def to_epoch(timestamps):
+    """Convert snapshot timestamps (YYYYmmdd_HHMMSS or anything pandas parses) to epoch seconds"""
+    series = pd.Series(timestamps)
+    parsed = pd.to_datetime(series, format="%Y%m%d_%H%M%S", errors='coerce')
+    if parsed.isna().any():
+        parsed = parsed.fillna(pd.to_datetime(series[parsed.isna()]))
+    return (parsed - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+
+class FeatureStore:
+    """Append-only time-series store for feature rows in a SQLite file.
+
+    Rows are stored in long form, one (timestamp, feature, value) per
+    cell, in tables clustered on timestamp so a time range is read
+    without scanning the rest. Hourly and daily rollups keep count, sum,
+    min and max per feature and are updated as rows are appended, so
+    means stay exact. Timestamps that were already ingested are skipped,
+    which makes appending overlapping windows safe, except that rows stored
+    before a model could score them get their score columns once they are
+    scored. Each tier has its own retention, measured from the newest
+    ingested timestamp.
+    """
+
+    # Tier name -> bucket width in seconds (None for raw rows)
+    TIERS = {'raw': None, '1h': 3600, '1d': 86400}
+    SCORE_COLUMNS = ['anomaly_score', 'is_anomaly']
+
+    def __init__(self, path, retention_days=None):
+        self.retention_days = retention_days or {
+            'raw': FEATURE_STORE_RAW_DAYS,
+            '1h': FEATURE_STORE_HOURLY_DAYS,
+            '1d': FEATURE_STORE_DAILY_DAYS,
+        }
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets ad-hoc readers query while the processor writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS ingested (ts INTEGER PRIMARY KEY)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS features_raw ("
+                "ts INTEGER, feature TEXT, value REAL, PRIMARY KEY (ts, feature)) WITHOUT ROWID"
+            )
+            for tier in ('1h', '1d'):
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS features_{tier} ("
+                    "ts INTEGER, feature TEXT, count INTEGER, sum REAL, min REAL, max REAL, "
+                    "PRIMARY KEY (ts, feature)) WITHOUT ROWID"
+                )
+
+    @stage_duration.labels(stage='feature_store_append').time()
+    def append(self, df):
+        """Store the numeric columns of rows whose timestamp is new and update the rollups.
+
+        Returns the number of new rows.
+        """
+        if df.empty:
+            return 0
+        values = df.drop(columns=['timestamp']).select_dtypes(include=['number', 'bool']).astype(float)
+        values.insert(0, 'ts', to_epoch(df['timestamp']).to_numpy())
+        values = values.drop_duplicates('ts', keep='last')
+        start, end = int(values['ts'].min()), int(values['ts'].max())
+        
+        with self.connection:
+            ingested = {row[0] for row in self.connection.execute(
+                "SELECT ts FROM ingested WHERE ts BETWEEN ? AND ?", (start, end)
+            )}
+            is_new = ~values['ts'].isin(ingested)
+            cells = values[is_new].melt(id_vars='ts', var_name='feature', value_name='value').dropna()
+            
+            # Scores of rows that were stored unscored, e.g. before the first model was fitted
+            score_columns = [column for column in self.SCORE_COLUMNS if column in values]
+            if score_columns and not is_new.all():
+                scored = {row for row in self.connection.execute(
+                    f"SELECT ts, feature FROM features_raw WHERE ts BETWEEN ? AND ? "
+                    f"AND feature IN ({', '.join('?' * len(score_columns))})", (start, end, *score_columns)
+                )}
+                late = values.loc[~is_new, ['ts'] + score_columns].melt(
+                    id_vars='ts', var_name='feature', value_name='value'
+                ).dropna()
+                late = late[[(int(ts), feature) not in scored for ts, feature in zip(late['ts'], late['feature'])]]
+                cells = pd.concat([cells, late], ignore_index=True)
+            if cells.empty:
+                return 0
+            
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO features_raw VALUES (?, ?, ?)",
+                cells.itertuples(index=False, name=None)
+            )
+            for tier in ('1h', '1d'):
+                width = self.TIERS[tier]
+                buckets = cells.assign(ts=cells['ts'] // width * width).groupby(['ts', 'feature'])['value'].agg(
+                    ['count', 'sum', 'min', 'max']
+                ).reset_index()
+                self.connection.executemany(
+                    f"INSERT INTO features_{tier} VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (ts, feature) DO UPDATE SET "
+                    "count = count + excluded.count, sum = sum + excluded.sum, "
+                    "min = MIN(min, excluded.min), max = MAX(max, excluded.max)",
+                    buckets.itertuples(index=False, name=None)
+                )
+            self.connection.executemany(
+                "INSERT INTO ingested VALUES (?)", [(int(ts),) for ts in values.loc[is_new, 'ts']]
+            )
+        
+        self.prune()
+        return int(is_new.sum())
+
+    def prune(self):
+        """Delete rows older than each tier's retention"""
+        newest = self.connection.execute("SELECT MAX(ts) FROM ingested").fetchone()[0]
+        if newest is None:
+            return
+        with self.connection:
+            for tier in self.TIERS:
+                cutoff = newest - self.retention_days[tier] * 86400
+                self.connection.execute(f"DELETE FROM features_{tier} WHERE ts < ?", (cutoff,))
+            # Ingested timestamps are kept as long as the longest tier so old rows are never re-added
+            cutoff = newest - max(self.retention_days.values()) * 86400
+            self.connection.execute("DELETE FROM ingested WHERE ts < ?", (cutoff,))
+
+    def query(self, start=None, end=None, features=None, tier='raw', stat='mean'):
+        """Return one row per timestamp (or bucket) between start and end, one column per feature.
+
+        start and end are inclusive and may be snapshot timestamps
+        (YYYYmmdd_HHMMSS) or anything pandas parses. Rollup tiers return
+        the given stat: 'mean', 'min', 'max', 'sum' or 'count'.
+        """
+        if tier not in self.TIERS:
+            raise ValueError(f"Unknown tier {tier}, expected one of {list(self.TIERS)}")
+        if tier == 'raw':
+            column = "value"
+        elif stat == 'mean':
+            column = "sum / count"
+        elif stat in ('min', 'max', 'sum', 'count'):
+            column = stat
+        else:
+            raise ValueError(f"Unknown stat {stat}")
+        
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("ts >= ?")
+            params.append(int(to_epoch([start]).iloc[0]))
+        if end is not None:
+            conditions.append("ts <= ?")
+            params.append(int(to_epoch([end]).iloc[0]))
+        if features:
+            conditions.append(f"feature IN ({', '.join('?' * len(features))})")
+            params.extend(features)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        cells = pd.read_sql_query(
+            f"SELECT ts, feature, {column} AS value FROM features_{tier}{where} ORDER BY ts", self.connection,
+            params=params
+        )
+        if cells.empty:
+            return pd.DataFrame(columns=['timestamp'])
+        wide = cells.pivot(index='ts', columns='feature', values='value')
+        wide.columns.name = None
+        wide.index = pd.to_datetime(wide.index, unit='s')
+        return wide.rename_axis('timestamp').reset_index()
+
+    def close(self):
+        self.connection.close()
+
+def write_frame(df, path_without_extension):
+    """Write a DataFrame in the configured output format and return its path"""
+    if OUTPUT_FORMAT == "parquet" and pq is not None:
+        path = f"{path_without_extension}.parquet"
+        df.to_parquet(path, index=False)
+    else:
+        path = f"{path_without_extension}.csv"
+        df.to_csv(path, index=False)
+    bytes_written.inc(os.path.getsize(path))
+    return path
+
+@stage_duration.labels(stage='save_processed_data').time()
 def save_processed_data(features_df, anomalies_df, output_dir):
     """Save processed data and anomalies to files"""
     os.makedirs(output_dir, exist_ok=True)
@@ -266,20 +1801,18 @@ def save_processed_data(features_df, anomalies_df, output_dir):
     timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
     
     # Save features
-    features_path = os.path.join(output_dir, f"features_{timestamp}.csv")
-    features_df.to_csv(features_path, index=False)
+    features_path = write_frame(features_df, os.path.join(output_dir, f"features_{timestamp}"))
     logger.info(f"Saved features to {features_path}")
     
     # Save anomalies if any were detected
     if not anomalies_df.empty:
-        anomalies_path = os.path.join(output_dir, f"anomalies_{timestamp}.csv")
-        anomalies_df.to_csv(anomalies_path, index=False)
+        anomalies_path = write_frame(anomalies_df, os.path.join(output_dir, f"anomalies_{timestamp}"))
         logger.info(f"Saved anomalies to {anomalies_path}")
     
     # Keep a rolling window of processed data
     files_to_keep = 48  # Keep 2 days worth of data assuming processing every 30 minutes
-    all_feature_files = sorted(glob.glob(os.path.join(output_dir, "features_*.csv")))
-    all_anomaly_files = sorted(glob.glob(os.path.join(output_dir, "anomalies_*.csv")))
+    all_feature_files = sorted(glob.glob(os.path.join(output_dir, "features_*.csv")) + glob.glob(os.path.join(output_dir, "features_*.parquet")))
+    all_anomaly_files = sorted(glob.glob(os.path.join(output_dir, "anomalies_*.csv")) + glob.glob(os.path.join(output_dir, "anomalies_*.parquet")))
     
     if len(all_feature_files) > files_to_keep:
         for old_file in all_feature_files[:-files_to_keep]:
@@ -291,53 +1824,329 @@ def save_processed_data(features_df, anomalies_df, output_dir):
             os.remove(old_file)
             logger.info(f"Removed old anomaly file {old_file}")
 
+def share_frame(df):
+    """Copy a feature frame's values into shared memory and return a handle to it.
+
+    Only the handle (segment name, shape, column names and timestamps) is
+    pickled back to the parent, which rebuilds the frame with read_shared_frame.
+    """
+    columns = [column for column in df.columns if column != 'timestamp']
+    values = df[columns].to_numpy(dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+    # The parent unlinks the segment, so this process must not clean it up on exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    shm.close()
+    return {
+        'name': shm.name,
+        'shape': values.shape,
+        'columns': columns,
+        'timestamps': df['timestamp'].tolist()
+    }
+
+def read_shared_frame(handle):
+    """Rebuild a frame from share_frame's handle and release the shared memory"""
+    shm = shared_memory.SharedMemory(name=handle['name'])
+    try:
+        values = np.ndarray(handle['shape'], dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    frame = pd.DataFrame(values, columns=handle['columns'])
+    frame.insert(0, 'timestamp', handle['timestamps'])
+    return frame
+
+def featurize_chunk(files, first, input_format):
+    """Featurize files[first:] in a worker process and return a shared frame handle.
+
+    files[:first] are replayed for context only: they provide the previous
+    snapshot for version changes and the state for change and flapping
+    counts, and their rows are dropped.
+    """
+    window = FeatureWindow(len(files), input_format)
+    for file_path, frame, snapshot in window._load_new(files, 0):
+        if not frame.empty:
+            window._append(file_path, file_path, frame, snapshot)
+    
+    keep = set(files[first:])
+    rows = [row for key, row in window.rows.items() if key in keep]
+    features_df = pd.DataFrame(rows)
+    if features_df.empty:
+        return None
+    return share_frame(features_df[[column for column in features_df.columns if not column.endswith('_ewma')]])
+
+@stage_duration.labels(stage='backfill').time()
+def backfill(input_dir, input_format="json", chunk_size=None, workers=None, span=3):
+    """Featurize every snapshot in input_dir on a pool of processes.
+
+    The snapshot range is split into chunks of chunk_size snapshots. Each
+    chunk is preceded by FLAP_WINDOW snapshots of context and, for delta
+    snapshots, by the files back to its keyframe, so its rows match what
+    the incremental window would produce. Peak memory per worker is bounded
+    by the chunk size. Chunks are merged in timestamp order and the _ewma
+    columns are computed over the merged series.
+    """
+    chunk_size = chunk_size or BACKFILL_CHUNK_SIZE
+    workers = workers or BACKFILL_WORKERS
+    
+    files = FeatureWindow(1, input_format)._list_files(input_dir)
+    if not files:
+        logger.warning(f"No snapshots found in {input_dir} to backfill")
+        return pd.DataFrame()
+    
+    tasks = []
+    for start in range(0, len(files), chunk_size):
+        context_start = max(0, start - max(1, FLAP_WINDOW))
+        if input_format != "table":
+            while context_start > 0 and parse_snapshot_name(files[context_start])[1] == "delta":
+                context_start -= 1
+        end = min(start + chunk_size, len(files))
+        tasks.append((files[context_start:end], start - context_start))
+    logger.info(f"Backfilling {len(files)} snapshots in {len(tasks)} chunks on {workers} processes")
+    
+    frames = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(featurize_chunk, chunk, first, input_format) for chunk, first in tasks]
+        # Futures are read in submission order, which is timestamp order
+        for future in futures:
+            handle = future.result()
+            if handle is not None:
+                frames.append(read_shared_frame(handle))
+    
+    if not frames:
+        return pd.DataFrame()
+    features_df = pd.concat(frames, ignore_index=True).fillna(0)
+    features_df = features_df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    feature_columns = order_feature_columns(list(features_df.columns))
+    ewma = features_df[feature_columns[1:]].ewm(span=span).mean().add_suffix('_ewma')
+    return pd.concat([features_df[feature_columns], ewma], axis=1)
+
+def run_backfill(model, store=None):
+    """Backfill features from INPUT_DIR, save them and retrain the model on them"""
+    start_time = time.time()
+    input_dir = INPUT_DIR
+    if MERGE_PARTIALS:
+        merge_partial_snapshots(INPUT_DIR, MERGED_DIR)
+        input_dir = MERGED_DIR
+    features_df = backfill(input_dir, INPUT_FORMAT)
+    if features_df.empty:
+        return
+    
+    timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+    features_path = write_frame(features_df, os.path.join(OUTPUT_DIR, f"backfill_features_{timestamp}"))
+    logger.info(f"Backfilled {len(features_df)} snapshots in {time.time() - start_time:.1f}s, saved to {features_path}")
+    if store is not None:
+        logger.info(f"Added {store.append(features_df)} backfilled rows to the feature store")
+    
+    model.observe(features_df.iloc[-model.history_size:])
+    model.fit(features_df.columns.drop('timestamp'))
+    model.save(MODEL_PATH)
+
+def run_profiled(cycle, name):
+    """Run one cycle, under cProfile when profiling is enabled and sampled.
+
+    Profiles of cycles slower than PROFILE_THRESHOLD are written to
+    PROFILE_DIR as pstats files, keeping the newest PROFILES_TO_KEEP.
+    """
+    if PROFILE_THRESHOLD <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return cycle()
+    
+    profiler = cProfile.Profile()
+    start_time = time.time()
+    profiler.enable()
+    try:
+        return cycle()
+    finally:
+        profiler.disable()
+        elapsed = time.time() - start_time
+        if elapsed > PROFILE_THRESHOLD:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+            profile_path = os.path.join(PROFILE_DIR, f"{name}_{timestamp}.prof")
+            profiler.dump_stats(profile_path)
+            logger.warning(f"Cycle took {elapsed:.1f}s (threshold {PROFILE_THRESHOLD}s), saved profile to {profile_path}")
+            
+            profiles = sorted(f for f in os.listdir(PROFILE_DIR) if f.startswith(f"{name}_"))
+            for old_profile in profiles[:-PROFILES_TO_KEEP]:
+                os.remove(os.path.join(PROFILE_DIR, old_profile))
+
+def feature_churn(features_df):
+    """Fraction of objects created, deleted or updated in the newest feature row"""
+    if features_df is None or features_df.empty:
+        return 0.0
+    row = features_df.iloc[-1]
+    total = row[[c for c in features_df.columns if c.startswith('count_')]].sum()
+    changed = sum(row.get(c, 0) for c in ('objects_created', 'objects_deleted', 'objects_updated'))
+    return float(changed / total) if total else 0.0
+
+class IntervalScheduler:
+    """Runs cycles at fixed-rate deadlines and adapts the interval within bounds.
+
+    Each deadline is the previous one plus the interval, so the time a
+    cycle takes does not add drift. A cycle that overruns the next
+    deadline counts it as missed and the next cycle starts at once, on the
+    latest deadline that has passed, rather than catching up back to back.
+    """
+
+    def __init__(self, interval, min_interval, max_interval, start=None):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        # Scheduled start of the current cycle
+        self.deadline = time.time() if start is None else start
+        effective_interval.set(self.interval)
+
+    def adapt(self, churn):
+        """Adjust the interval from the fraction of objects that changed"""
+        if churn > CHURN_HIGH:
+            interval = self.interval / 2
+        elif churn < CHURN_LOW:
+            interval = self.interval * 1.25
+        else:
+            return self.interval
+        
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if interval != self.interval:
+            logger.info(f"Changing interval from {self.interval:.0f}s to {interval:.0f}s (churn {churn:.2%})")
+            self.interval = interval
+            effective_interval.set(interval)
+        return self.interval
+
+    def wait(self):
+        """Sleep until the next deadline"""
+        self.deadline += self.interval
+        now = time.time()
+        if now > self.deadline:
+            missed = int((now - self.deadline) // self.interval) + 1
+            self.deadline += (missed - 1) * self.interval
+            missed_deadlines.inc(missed)
+            logger.warning(f"Cycle overran, missed {missed} deadline(s)")
+            return
+        logger.info(f"Sleeping for {self.deadline - now:.0f} seconds...")
+        time.sleep(self.deadline - now)
+
+def record_first_result():
+    """Export the time from startup to the first processed result, once"""
+    global first_result_recorded
+    if first_result_recorded or started_at is None:
+        return
+    elapsed = time.perf_counter() - started_at
+    time_to_first_result.set(elapsed)
+    logger.info(f"First result {elapsed:.2f}s after startup")
+    first_result_recorded = True
+
+def processing_cycle(window, model, group_model, snapshot=None, store=None):
+    """Featurize new snapshots, score them and save the results.
+
+    With a streamed snapshot only that snapshot is added, otherwise the
+    window catches up on the snapshot files in INPUT_DIR (or on the
+    snapshots merged from its partial snapshots). New rows are
+    appended to the feature store when one is given and the window is
+    checkpointed to CHECKPOINT_PATH. Returns the window's features.
+    """
+    logger.info("Processing Kubernetes metadata snapshots...")
+    
+    # Featurize only the snapshots that arrived since the last cycle;
+    # EWMA columns for trend analysis are maintained incrementally
+    if snapshot is not None:
+        features_df = window.push(snapshot)
+    elif MERGE_PARTIALS:
+        merge_partial_snapshots(INPUT_DIR, MERGED_DIR)
+        features_df = window.update(MERGED_DIR)
+    else:
+        features_df = window.update(INPUT_DIR)
+    
+    if features_df.empty:
+        logger.warning("No snapshots available for processing")
+        return features_df
+    
+    processed_features_count.set(len(window.feature_columns) - 1)  # Subtract timestamp column
+    
+    # Detect anomalies
+    anomalies_df = detect_anomalies(features_df, model)
+    if store is not None:
+        # Scored rows carry anomaly_score and is_anomaly alongside the features
+        store.append(features_df if anomalies_df.empty else anomalies_df)
+    if not anomalies_df.empty:
+        anomalies_df = anomalies_df[anomalies_df['is_anomaly']]
+        model.save(MODEL_PATH)
+    
+    # Localize anomalies to resource types and namespaces
+    group_anomalies_df = detect_group_anomalies(window.group_features(), group_model)
+    if not group_anomalies_df.empty:
+        group_model.save(GROUP_MODEL_PATH)
+        flagged = group_anomalies_df[group_anomalies_df['is_anomaly']]
+        for row in flagged.nlargest(ANOMALY_TOP_K, 'anomaly_score').itertuples():
+            logger.info(f"Anomalous {row.scope} {row.key}: score {row.anomaly_score:.3f}")
+    
+    # Publish the most strongly associated pairs of categorical metadata fields
+    update_correlation_metrics(window.correlations.scores())
+    
+    # Save processed data
+    save_processed_data(features_df, anomalies_df, OUTPUT_DIR)
+    record_first_result()
+    
+    if CHECKPOINT_PATH:
+        try:
+            window.save(CHECKPOINT_PATH)
+        except Exception as e:
+            logger.error(f"Error checkpointing the feature window: {e}")
+    
+    logger.info(f"Processing complete. Found {len(anomalies_df)} potential anomalies.")
+    return features_df
+
 def main():
     """Main function to run the data processor"""
+    global started_at
+    started_at = time.perf_counter()
+    
+    # scikit-learn is imported lazily where a model is fitted or scored, so
+    # importing this module stays cheap; the first cycle needs it anyway, so
+    # import it here once and export what it costs
+    for module in ('sklearn.ensemble', 'sklearn.preprocessing'):
+        importlib.import_module(module)
+    elapsed = time.perf_counter() - started_at
+    import_seconds.set(elapsed)
+    logger.info(f"Imported scikit-learn in {elapsed:.2f}s")
+    
     # Start Prometheus HTTP server
     start_http_server(8001)
     logger.info("Started Prometheus metrics server on port 8001")
     
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
+    if CHECKPOINT_PATH and not BACKFILL:
+        window = FeatureWindow.load(CHECKPOINT_PATH, WINDOW_SIZE, INPUT_FORMAT)
+    else:
+        window = FeatureWindow(WINDOW_SIZE, INPUT_FORMAT)
+    model = AnomalyModel.load(MODEL_PATH)
+    group_model = AnomalyModel.load(
+        GROUP_MODEL_PATH,
+        history_size=GROUP_MODEL_HISTORY_SIZE,
+        id_columns=('timestamp', 'scope', 'key')
+    )
+    
+    store = FeatureStore(FEATURE_STORE_PATH) if FEATURE_STORE_PATH else None
+    
+    if BACKFILL:
+        run_backfill(model, store)
+        return
+    
+    if HANDOFF_MODE == "stream":
+        receiver = SnapshotReceiver(HANDOFF_PORT)
+        receiver.start()
+        logger.info(f"Waiting for streamed snapshots on port {HANDOFF_PORT}")
+        while True:
+            snapshot = receiver.next_snapshot(timeout=PROCESSING_INTERVAL)
+            if snapshot is None:
+                continue
+            run_profiled(lambda: processing_cycle(window, model, group_model, snapshot, store), "processor")
+    
+    scheduler = IntervalScheduler(PROCESSING_INTERVAL, MIN_PROCESSING_INTERVAL, MAX_PROCESSING_INTERVAL)
     while True:
-        logger.info("Processing Kubernetes metadata snapshots...")
-        
-        # Load snapshots
-        snapshots = load_snapshots(INPUT_DIR, WINDOW_SIZE)
-        
-        if not snapshots:
-            logger.warning("No snapshots available for processing")
-            time.sleep(PROCESSING_INTERVAL)
-            continue
-        
-        # Extract features
-        features_df = extract_features(snapshots)
-        processed_features_count.set(len(features_df.columns) - 1)  # Subtract timestamp column
-        
-        # Calculate EWMA for trend analysis
-        numeric_columns = features_df.select_dtypes(include=[np.number]).columns
-        for col in numeric_columns:
-            if col != 'timestamp':
-                features_df[f"{col}_ewma"] = calculate_ewma(features_df[col])
-        
-        # Detect anomalies
-        anomalies_df = detect_anomalies(features_df)
-        anomalies_df = anomalies_df[anomalies_df['is_anomaly']]
-        
-        # Calculate categorical correlations
-        # This would typically be done for categorical fields, but we're mostly dealing with numeric data
-        # Just as an example, if we had categorical columns:
-        # cat_columns = ['status_pod', 'status_deployment']
-        # correlations = calculate_categorical_correlation(features_df, cat_columns)
-        # for field_pair, corr_value in correlations.items():
-        #     correlation_score.labels(field_pair=field_pair).set(corr_value)
-        
-        # Save processed data
-        save_processed_data(features_df, anomalies_df, OUTPUT_DIR)
-        
-        logger.info(f"Processing complete. Found {len(anomalies_df)} potential anomalies.")
-        logger.info(f"Sleeping for {PROCESSING_INTERVAL} seconds...")
-        time.sleep(PROCESSING_INTERVAL)
+        features_df = run_profiled(lambda: processing_cycle(window, model, group_model, store=store), "processor")
+        scheduler.adapt(feature_churn(features_df))
+        scheduler.wait()
 
 if __name__ == "__main__":
     main()
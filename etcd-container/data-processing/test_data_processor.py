@@ -0,0 +1,283 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processor import CorrelationTracker, FeatureStore, extract_features
+
+RESOURCE_TYPES = ['pods', 'services', 'deployments', 'configmaps', 'secrets']
+NAMESPACES = ['default', 'kube-system', 'monitoring', None]
+
+
+def legacy_extract_features(snapshots):
+    """The row-loop extract_features that the frame-based version replaced"""
+    resource_counts = {}
+    owner_ref_counts = {}
+    resource_versions = {}
+    status_changes = {}
+
+    for snapshot in snapshots:
+        timestamp = snapshot['timestamp']
+        if timestamp not in resource_counts:
+            resource_counts[timestamp] = {}
+            owner_ref_counts[timestamp] = {}
+            resource_versions[timestamp] = {}
+            status_changes[timestamp] = {}
+
+        for resource in snapshot['data']:
+            resource_type = resource['resource_type']
+            resource_counts[timestamp][resource_type] = resource_counts[timestamp].get(resource_type, 0) + 1
+            owner_ref_counts[timestamp][resource_type] = (
+                owner_ref_counts[timestamp].get(resource_type, 0) + len(resource.get('owner_references', []))
+            )
+            resource_id = f"{resource_type}_{resource.get('namespace', 'cluster')}_{resource.get('name', 'unknown')}"
+            resource_versions[timestamp][resource_id] = resource.get('resource_version', '0')
+            if 'status' in resource:
+                status_key = f"{resource_type}_status"
+                status_changes[timestamp][status_key] = status_changes[timestamp].get(status_key, 0) + 1
+
+    timestamps = sorted(resource_counts.keys())
+    resource_types = set()
+    for ts_counts in resource_counts.values():
+        resource_types.update(ts_counts.keys())
+
+    resource_count_df = pd.DataFrame([
+        {'timestamp': ts, **{f"count_{rt}": resource_counts[ts].get(rt, 0) for rt in resource_types}}
+        for ts in timestamps
+    ])
+    owner_ref_df = pd.DataFrame([
+        {'timestamp': ts, **{f"owner_refs_{rt}": owner_ref_counts[ts].get(rt, 0) for rt in resource_types}}
+        for ts in timestamps
+    ])
+
+    version_change_data = []
+    for prev_ts, curr_ts in zip(timestamps, timestamps[1:]):
+        version_changes = 0
+        for resource_id in set(resource_versions[prev_ts]) | set(resource_versions[curr_ts]):
+            if resource_versions[prev_ts].get(resource_id, '0') != resource_versions[curr_ts].get(resource_id, '0'):
+                version_changes += 1
+        version_change_data.append({'timestamp': curr_ts, 'version_change_rate': version_changes})
+    version_change_df = pd.DataFrame(version_change_data) if version_change_data else pd.DataFrame(columns=['timestamp', 'version_change_rate'])
+
+    status_keys = set()
+    for ts_status in status_changes.values():
+        status_keys.update(ts_status.keys())
+    status_change_df = pd.DataFrame([
+        {'timestamp': ts, **{key: status_changes[ts].get(key, 0) for key in status_keys}}
+        for ts in timestamps
+    ])
+
+    feature_dfs = [resource_count_df]
+    if not owner_ref_df.empty:
+        feature_dfs.append(owner_ref_df.drop(columns=['timestamp'], errors='ignore'))
+    if not version_change_df.empty:
+        merged_df = pd.merge(feature_dfs[0], version_change_df, on='timestamp', how='left')
+        merged_df['version_change_rate'] = merged_df['version_change_rate'].fillna(0)
+        feature_dfs[0] = merged_df
+    if not status_change_df.empty:
+        feature_dfs.append(status_change_df.drop(columns=['timestamp'], errors='ignore'))
+
+    features_df = feature_dfs[0]
+    for df in feature_dfs[1:]:
+        features_df = pd.concat([features_df, df], axis=1)
+    return features_df.fillna(0)
+
+
+def random_resource(rng, index):
+    resource = {
+        'resource_type': rng.choice(RESOURCE_TYPES),
+        'name': f"object-{index}",
+        'uid': f"uid-{index}",
+        'resource_version': str(rng.randint(1, 5)),
+        'owner_references': [{'kind': 'ReplicaSet', 'name': 'owner'}] * rng.randint(0, 2),
+    }
+    namespace = rng.choice(NAMESPACES)
+    if namespace is not None:
+        resource['namespace'] = namespace
+    if rng.random() < 0.6:
+        resource['status'] = {'phase': rng.choice(['Running', 'Pending'])}
+    return resource
+
+
+def random_window(rng):
+    """Snapshots where objects persist, change version, appear and disappear"""
+    objects = {index: random_resource(rng, index) for index in range(rng.randint(0, 40))}
+    next_index = len(objects)
+    snapshots = []
+    for step in range(rng.randint(1, 8)):
+        snapshots.append({
+            'timestamp': f"2024-01-01T00:{step:02d}:00",
+            'data': [dict(resource) for resource in objects.values()],
+        })
+        for index in list(objects):
+            roll = rng.random()
+            if roll < 0.1:
+                del objects[index]
+            elif roll < 0.3:
+                objects[index]['resource_version'] = str(int(objects[index]['resource_version']) + 1)
+        for _ in range(rng.randint(0, 5)):
+            objects[next_index] = random_resource(rng, next_index)
+            next_index += 1
+    rng.shuffle(snapshots)
+    return snapshots
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_extract_features_matches_legacy_loop(seed):
+    snapshots = random_window(random.Random(seed))
+    expected = legacy_extract_features(snapshots)
+    features_df = extract_features(snapshots)
+
+    if expected.empty:
+        assert features_df.empty
+        return
+    # Ownership graph features are newer than the loop; compare the columns it produced
+    actual = features_df[expected.columns]
+    pd.testing.assert_frame_equal(
+        actual.sort_index(axis=1).reset_index(drop=True),
+        expected.sort_index(axis=1).reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_feature_store_adds_scores_to_rows_stored_unscored(tmp_path):
+    store = FeatureStore(str(tmp_path / "features.db"))
+    features = pd.DataFrame({
+        'timestamp': ['20240101_000000', '20240101_000500'],
+        'count_pods': [10, 12],
+    })
+    assert store.append(features) == 2
+
+    # The next cycle scores the same rows and adds one new row
+    scored = pd.concat([features, pd.DataFrame({'timestamp': ['20240101_001000'], 'count_pods': [11]})], ignore_index=True)
+    scored['anomaly_score'] = [0.1, 0.9, 0.2]
+    scored['is_anomaly'] = [False, True, False]
+    assert store.append(scored) == 1
+
+    raw = store.query(tier='raw')
+    assert raw['anomaly_score'].tolist() == [0.1, 0.9, 0.2]
+    assert raw['is_anomaly'].tolist() == [0.0, 1.0, 0.0]
+    assert raw['count_pods'].tolist() == [10, 12, 11]
+    hourly = store.query(tier='1h', stat='count')
+    assert hourly['anomaly_score'].tolist() == [3]
+    assert hourly['count_pods'].tolist() == [3]
+
+    # Scores already stored are kept, and the rollups are not counted twice
+    rescored = scored.assign(anomaly_score=[0.5, 0.5, 0.5])
+    assert store.append(rescored) == 0
+    assert store.query(tier='raw')['anomaly_score'].tolist() == [0.1, 0.9, 0.2]
+    assert store.query(tier='1h', stat='sum')['anomaly_score'].tolist() == [pytest.approx(1.2)]
+    store.close()
+
+
+def crosstab_cramers_v(frame, field1, field2):
+    """Bias-corrected Cramer's V of two columns from their crosstab, None where undefined"""
+    pair = frame[[field1, field2]].dropna()
+    contingency = pd.crosstab(pair[field1], pair[field2]).to_numpy().astype(float)
+    n = contingency.sum()
+    r, k = contingency.shape
+    if n < 2 or r < 2 or k < 2:
+        return None
+    expected = contingency.sum(axis=1, keepdims=True) * contingency.sum(axis=0, keepdims=True) / n
+    phi2 = ((contingency - expected) ** 2 / expected).sum() / n
+    phi2corr = max(0, phi2 - (k - 1) * (r - 1) / (n - 1))
+    rcorr = r - (r - 1) ** 2 / (n - 1)
+    kcorr = k - (k - 1) ** 2 / (n - 1)
+    return np.sqrt(phi2corr / min(kcorr - 1, rcorr - 1))
+
+
+class ReferenceCategories:
+    """Maps values to categories like CorrelationTracker: the first max_values per field, then "<other>" """
+
+    def __init__(self, max_values):
+        self.max_values = max_values
+        self.values = {}
+        # uid -> field -> category the object was last encoded with
+        self.rows = {}
+
+    def apply(self, objects):
+        for obj in objects:
+            self.rows[obj['uid']] = self.encode(obj)
+
+    def encode(self, obj):
+        fields = {
+            'resource_type': obj['resource_type'],
+            'status_phase': (obj.get('status') or {}).get('phase'),
+            'owner_kind': obj['owner_references'][0]['kind'] if obj.get('owner_references') else 'none',
+        }
+        fields.update({f"label:{key}": value for key, value in sorted((obj.get('labels') or {}).items())})
+        row = {}
+        for field, value in fields.items():
+            if value is None:
+                continue
+            values = self.values.setdefault(field, [])
+            if value not in values and len(values) < self.max_values:
+                values.append(value)
+            row[field] = value if value in values else "<other>"
+        return row
+
+
+def random_object(rng, index):
+    resource_type = rng.choice(['pods', 'pods', 'services', 'configmaps'])
+    obj = {
+        'uid': f"uid-{index}",
+        'resource_type': resource_type,
+        'labels': {'app': f"app-{rng.randint(0, 5)}"},
+        'owner_references': [{'kind': rng.choice(['ReplicaSet', 'StatefulSet'])}] if rng.random() < 0.6 else [],
+    }
+    if resource_type == 'pods':
+        # Phases follow the owner often enough to give the pairs some association
+        phases = ['Running', 'Pending', 'Failed', 'Succeeded', 'Unknown']
+        obj['status'] = {'phase': phases[0] if obj['owner_references'] and rng.random() < 0.5 else rng.choice(phases)}
+    if rng.random() < 0.7:
+        obj['labels']['tier'] = rng.choice(['web', 'db'])
+    return obj
+
+
+def assert_matches_crosstab(tracker, reference, live):
+    frame = pd.DataFrame([reference.rows[uid] for uid in live])
+    scores = tracker.scores(min_objects=2)
+    fields = list(tracker.fields)
+    for i, field1 in enumerate(fields):
+        for field2 in fields[i + 1:]:
+            key = f"{field1}__{field2}"
+            expected = crosstab_cramers_v(frame, field1, field2) if field1 in frame and field2 in frame else None
+            if expected is None:
+                assert key not in scores
+            else:
+                assert scores[key] == pytest.approx(expected, abs=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_correlation_tracker_matches_crosstab(seed):
+    rng = random.Random(seed)
+    tracker = CorrelationTracker(max_fields=8, max_values=3)
+    reference = ReferenceCategories(max_values=3)
+
+    objects = {f"uid-{index}": random_object(rng, index) for index in range(300)}
+    tracker.resync(objects.values())
+    reference.apply(objects.values())
+    # Five phases and six apps with room for three values each, so both fields use "<other>"
+    assert "<other>" in set(row.get('status_phase') for row in reference.rows.values())
+    assert_matches_crosstab(tracker, reference, objects)
+
+    # A delta removes, modifies and adds objects
+    removed = rng.sample(sorted(objects), 80)
+    for uid in removed:
+        del objects[uid]
+    modified = []
+    for uid in rng.sample(sorted(objects), 40):
+        objects[uid] = dict(random_object(rng, 0), uid=uid)
+        modified.append(objects[uid])
+    added = [random_object(rng, index) for index in range(300, 340)]
+    objects.update((obj['uid'], obj) for obj in added)
+    tracker.apply_delta({'added': added, 'modified': modified, 'removed': removed})
+    reference.apply(added + modified)
+    assert_matches_crosstab(tracker, reference, objects)
+
+    # A resync to a smaller snapshot removes everything else
+    objects = dict(rng.sample(sorted(objects.items()), 100))
+    tracker.resync(objects.values())
+    reference.apply(objects.values())
+    assert_matches_crosstab(tracker, reference, objects)
@@ -1,12 +1,48 @@
 #!/usr/bin/env python3
+import asyncio
 import os
 import time
 import json
 import logging
 import datetime
+import gzip
+import hashlib
+import queue
+import random
+import socket
+import struct
+import cProfile
+import threading
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from resource import getrusage, RUSAGE_SELF
 import pandas as pd
-from kubernetes import client, config
-from prometheus_client import start_http_server, Gauge
+from kubernetes import client, config, watch
+from kubernetes.client.rest import ApiException
+from prometheus_client import start_http_server, Counter as MetricCounter, Gauge, Histogram
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import aiohttp
+    from kubernetes_asyncio import client as async_client, config as async_config, watch as async_watch
+    from kubernetes_asyncio.client.rest import ApiException as AsyncApiException
+except ImportError:
+    async_client = None
 
 # Set up logging
 logging.basicConfig(
@@ -17,69 +53,406 @@ logger = logging.getLogger("metadata-collector")
 
 # Collection interval in seconds
 COLLECTION_INTERVAL = int(os.environ.get('COLLECTION_INTERVAL', '300'))
+# Collections run at fixed-rate deadlines. Within MIN_COLLECTION_INTERVAL and
+# MAX_COLLECTION_INTERVAL (both default to COLLECTION_INTERVAL, a fixed rate)
+# the interval is halved when more than CHURN_HIGH of the objects changed in a
+# cycle, grown by a quarter below CHURN_LOW, and doubled to spare the apiserver
+# when a list request took longer than APISERVER_LATENCY_TARGET seconds
+MIN_COLLECTION_INTERVAL = float(os.environ.get('MIN_COLLECTION_INTERVAL', str(COLLECTION_INTERVAL)))
+MAX_COLLECTION_INTERVAL = float(os.environ.get('MAX_COLLECTION_INTERVAL', str(COLLECTION_INTERVAL)))
+CHURN_HIGH = float(os.environ.get('CHURN_HIGH', '0.05'))
+CHURN_LOW = float(os.environ.get('CHURN_LOW', '0.005'))
+APISERVER_LATENCY_TARGET = float(os.environ.get('APISERVER_LATENCY_TARGET', '2.0'))
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', '/data')
+# 'list' relists every resource type each interval, 'watch' keeps an informer-style cache
+COLLECTION_MODE = os.environ.get('COLLECTION_MODE', 'list')
+# Server-side timeout for a single watch request before it is re-established
+WATCH_TIMEOUT = int(os.environ.get('WATCH_TIMEOUT', '300'))
+WATCH_RETRY_DELAY = int(os.environ.get('WATCH_RETRY_DELAY', '5'))
+# Run list or watch collection on asyncio with kubernetes_asyncio: one task per
+# resource type over a single pool of ASYNC_POOL_SIZE connections. A list request
+# taking over REQUEST_TIMEOUT seconds or failing transiently is retried up to
+# REQUEST_RETRIES times with jittered exponential backoff from RETRY_BACKOFF
+# seconds; a type that still fails keeps its previous objects for the cycle
+ASYNC_COLLECTION = os.environ.get('ASYNC_COLLECTION', 'false').lower() == 'true'
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', '16'))
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', '30'))
+REQUEST_RETRIES = int(os.environ.get('REQUEST_RETRIES', '3'))
+RETRY_BACKOFF = float(os.environ.get('RETRY_BACKOFF', '1.0'))
+
+# 'delta' writes compressed keyframes plus per-interval deltas, 'json' writes full JSON dumps
+SNAPSHOT_FORMAT = os.environ.get('SNAPSHOT_FORMAT', 'delta')
+# Number of snapshots between full keyframes in the delta format
+KEYFRAME_INTERVAL = int(os.environ.get('KEYFRAME_INTERVAL', '12'))
+# 'gzip' or 'zstd' (zstd requires the zstandard package)
+SNAPSHOT_COMPRESSION = os.environ.get('SNAPSHOT_COMPRESSION', 'gzip')
+SNAPSHOTS_TO_KEEP = int(os.environ.get('SNAPSHOTS_TO_KEEP', '100'))
+# Also write a columnar Arrow table per snapshot for memory-mapped reads (requires pyarrow)
+SNAPSHOT_TABLE = os.environ.get('SNAPSHOT_TABLE', 'false').lower() == 'true'
+
+# An object whose status changes FLAP_THRESHOLD times within FLAP_WINDOW
+# collection intervals is counted as flapping
+FLAP_WINDOW = int(os.environ.get('FLAP_WINDOW', '6'))
+FLAP_THRESHOLD = int(os.environ.get('FLAP_THRESHOLD', '3'))
+
+# Resource types to collect (namespaces are always collected first)
+RESOURCE_TYPES = [
+    "pods", "services", "configmaps", "secrets",
+    "deployments", "replicasets", "statefulsets", "daemonsets",
+    "jobs", "cronjobs", "ingresses", "networkpolicies"
+]
+# Page size for list calls and number of resource types listed concurrently
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '500'))
+COLLECTION_WORKERS = int(os.environ.get('COLLECTION_WORKERS', '4'))
+
+# 'raw' lists objects as JSON and extracts the needed fields directly,
+# 'typed' deserializes them into kubernetes client model objects first
+EXTRACTION_MODE = os.environ.get('EXTRACTION_MODE', 'raw')
+# Annotations named in ANNOTATION_EXCLUDE are dropped and values longer than
+# ANNOTATION_HASH_MIN_BYTES are replaced by their hash (0 keeps every value)
+ANNOTATION_EXCLUDE = {key.strip() for key in os.environ.get('ANNOTATION_EXCLUDE', '').split(',') if key.strip()}
+ANNOTATION_HASH_MIN_BYTES = int(os.environ.get('ANNOTATION_HASH_MIN_BYTES', '0'))
+
+# Opt-in profiling: a share of cycles (PROFILE_SAMPLE_RATE) runs under cProfile
+# and cycles slower than PROFILE_THRESHOLD seconds are dumped to PROFILE_DIR
+PROFILE_THRESHOLD = float(os.environ.get('PROFILE_THRESHOLD', '0'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '1.0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(OUTPUT_DIR, 'profiles'))
+PROFILES_TO_KEEP = int(os.environ.get('PROFILES_TO_KEEP', '20'))
+
+# Streaming handoff: host:port of the data processor's handoff listener
+# (empty disables it), seconds to wait on connecting and sending, seconds to
+# wait for a frame to be acknowledged (the processor acknowledges once it has
+# queued the frame, which waits on a slow processing cycle) and how many
+# snapshots may wait to be sent before the backlog is dropped
+HANDOFF_ADDRESS = os.environ.get('HANDOFF_ADDRESS', '')
+HANDOFF_TIMEOUT = float(os.environ.get('HANDOFF_TIMEOUT', '30'))
+HANDOFF_ACK_TIMEOUT = float(os.environ.get('HANDOFF_ACK_TIMEOUT', '600'))
+HANDOFF_QUEUE_SIZE = int(os.environ.get('HANDOFF_QUEUE_SIZE', '4'))
+
+# Sharded collection: with SHARD_COUNT > 1 replicas split the work by
+# 'resource_type' or 'namespace' (hash), coordinated through one Lease per
+# shard named LEASE_PREFIX-<shard> in LEASE_NAMESPACE, and each replica
+# writes partial snapshots for the shards it holds
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', '0'))
+SHARD_BY = os.environ.get('SHARD_BY', 'resource_type')
+SHARD_IDENTITY = os.environ.get('POD_NAME', socket.gethostname())
+LEASE_NAMESPACE = os.environ.get('LEASE_NAMESPACE', os.environ.get('POD_NAMESPACE', 'monitoring'))
+LEASE_PREFIX = os.environ.get('LEASE_PREFIX', 'metadata-collector-shard')
+LEASE_DURATION = int(os.environ.get('LEASE_DURATION', '60'))
 
 # Prometheus metrics
 metadata_count = Gauge('k8s_metadata_count', 'Count of Kubernetes resources', ['resource_type'])
 metadata_change_rate = Gauge('k8s_metadata_change_rate', 'Rate of changes in Kubernetes resources', ['resource_type'])
 owner_reference_count = Gauge('k8s_owner_reference_count', 'Count of owner references', ['resource_type'])
+object_changes = Gauge('k8s_object_changes', 'Objects created, deleted, updated or restarted in the last interval', ['resource_type', 'change'])
+flapping_objects = Gauge('k8s_flapping_objects', 'Objects whose status is flapping', ['resource_type'])
+collection_duration = Gauge('k8s_collection_duration_seconds', 'Wall-clock time of the last metadata collection')
+collector_peak_rss = Gauge('k8s_collector_peak_rss_bytes', 'Peak resident set size of the collector process')
+stage_duration = Histogram(
+    'k8s_collector_stage_duration_seconds', 'Time spent in each collector stage', ['stage'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+list_duration = Histogram(
+    'k8s_collector_list_duration_seconds', 'Time spent listing and extracting one resource type', ['resource_type'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+bytes_written = MetricCounter('k8s_collector_bytes_written', 'Bytes written to snapshot files')
+objects_per_second = Gauge('k8s_collector_objects_per_second', 'Objects processed per second in the last cycle')
+list_request_duration = Histogram(
+    'k8s_collector_list_request_seconds', 'Duration of single apiserver list requests (one page each)',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+list_retries = MetricCounter('k8s_collector_list_retries', 'List requests retried after a timeout or transient error', ['resource_type'])
+list_failures = MetricCounter('k8s_collector_list_failures', 'Resource type lists that failed after all retries', ['resource_type'])
+effective_interval = Gauge('k8s_collector_effective_interval_seconds', 'Current interval between collection deadlines')
+missed_deadlines = MetricCounter('k8s_collector_missed_deadlines', 'Collection deadlines skipped because a cycle overran')
+extraction_rate = Gauge('k8s_collector_extraction_objects_per_second', 'Objects listed and extracted per second', ['resource_type'])
+bytes_per_object = Gauge('k8s_collector_bytes_per_object', 'Average list response bytes per object in raw extraction mode', ['resource_type'])
+full_object_pages = MetricCounter('k8s_collector_full_object_pages', 'Metadata-only list pages the apiserver answered with full objects', ['resource_type'])
+handoff_sent = MetricCounter('k8s_handoff_snapshots_sent', 'Snapshots streamed to the data processor', ['kind'])
+handoff_dropped = MetricCounter('k8s_handoff_snapshots_dropped', 'Snapshots dropped because the handoff stream was backed up or down')
+handoff_send_duration = Histogram(
+    'k8s_handoff_send_duration_seconds', 'Time from sending a snapshot frame until the processor acknowledged it',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+)
+owned_shards = Gauge('k8s_collector_owned_shards', 'Number of collection shards held by this replica')
+shard_transitions = MetricCounter('k8s_collector_shard_transitions', 'Shard leases acquired or released by this replica', ['action'])
 
-# Previous snapshots for calculating change rates
-previous_counts = {}
+# State of the delta snapshot chain: the previous snapshot keyed by uid,
+# its file name and the number of deltas written since the last keyframe
+snapshot_chain = {"objects": None, "filename": None, "deltas": 0}
 
-def collect_namespaces(api):
-    """Collect all namespaces metadata"""
-    try:
-        return api.list_namespace().items
-    except Exception as e:
-        logger.error(f"Error collecting namespaces: {e}")
-        return []
+# Streams saved snapshots to the data processor when HANDOFF_ADDRESS is set
+publisher = None
+
+# Holds this replica's shard leases when SHARD_COUNT > 1
+shard_coordinator = None
+
+# Slowest list request since the scheduler last looked, its apiserver load signal
+_slowest_list_request = 0.0
+_slowest_list_request_lock = threading.Lock()
+
+# Metadata-only types already warned about being answered with full objects
+_full_object_types = set()
+
+# Last successful (metadata, owner reference count) per (resource_type, namespace),
+# reused when listing fails so a failed type does not look deleted
+_last_listings = {}
 
-def collect_resources(api, resource_type, namespace=None):
-    """Collect resources of a specific type"""
+def load_kube_config():
+    """Load in-cluster configuration, falling back to the local kubeconfig"""
     try:
-        if resource_type == "pods":
-            if namespace:
-                return api.list_namespaced_pod(namespace).items
-            else:
-                return api.list_pod_for_all_namespaces().items
-        elif resource_type == "deployments":
-            apps_v1 = client.AppsV1Api()
-            if namespace:
-                return apps_v1.list_namespaced_deployment(namespace).items
-            else:
-                return apps_v1.list_deployment_for_all_namespaces().items
-        elif resource_type == "services":
-            if namespace:
-                return api.list_namespaced_service(namespace).items
-            else:
-                return api.list_service_for_all_namespaces().items
-        elif resource_type == "configmaps":
-            if namespace:
-                return api.list_namespaced_config_map(namespace).items
-            else:
-                return api.list_config_map_for_all_namespaces().items
-        elif resource_type == "secrets":
-            if namespace:
-                return api.list_namespaced_secret(namespace).items
-            else:
-                return api.list_secret_for_all_namespaces().items
-        elif resource_type == "statefulsets":
-            apps_v1 = client.AppsV1Api()
-            if namespace:
-                return apps_v1.list_namespaced_stateful_set(namespace).items
-            else:
-                return apps_v1.list_stateful_set_for_all_namespaces().items
-        elif resource_type == "daemonsets":
-            apps_v1 = client.AppsV1Api()
-            if namespace:
-                return apps_v1.list_namespaced_daemon_set(namespace).items
-            else:
-                return apps_v1.list_daemon_set_for_all_namespaces().items
-        # Add more resource types as needed
-    except Exception as e:
-        logger.error(f"Error collecting {resource_type}: {e}")
-        return []
+        config.load_incluster_config()
+    except config.ConfigException:
+        config.load_kube_config()
+
+# API class and list functions (namespaced, cluster-wide) for each resource type
+RESOURCE_LISTERS = {
+    "namespaces": ("CoreV1Api", None, "list_namespace"),
+    "pods": ("CoreV1Api", "list_namespaced_pod", "list_pod_for_all_namespaces"),
+    "services": ("CoreV1Api", "list_namespaced_service", "list_service_for_all_namespaces"),
+    "configmaps": ("CoreV1Api", "list_namespaced_config_map", "list_config_map_for_all_namespaces"),
+    "secrets": ("CoreV1Api", "list_namespaced_secret", "list_secret_for_all_namespaces"),
+    "deployments": ("AppsV1Api", "list_namespaced_deployment", "list_deployment_for_all_namespaces"),
+    "replicasets": ("AppsV1Api", "list_namespaced_replica_set", "list_replica_set_for_all_namespaces"),
+    "statefulsets": ("AppsV1Api", "list_namespaced_stateful_set", "list_stateful_set_for_all_namespaces"),
+    "daemonsets": ("AppsV1Api", "list_namespaced_daemon_set", "list_daemon_set_for_all_namespaces"),
+    "jobs": ("BatchV1Api", "list_namespaced_job", "list_job_for_all_namespaces"),
+    "cronjobs": ("BatchV1Api", "list_namespaced_cron_job", "list_cron_job_for_all_namespaces"),
+    "ingresses": ("NetworkingV1Api", "list_namespaced_ingress", "list_ingress_for_all_namespaces"),
+    "networkpolicies": ("NetworkingV1Api", "list_namespaced_network_policy", "list_network_policy_for_all_namespaces"),
+}
+
+# Types whose status is not extracted are listed as PartialObjectMetadataList,
+# which leaves out spec, status and payloads such as secret and configmap data.
+# Plain JSON is accepted as a fallback for servers that cannot serve it.
+METADATA_ONLY_TYPES = {"namespaces", "services", "configmaps", "secrets", "cronjobs", "ingresses", "networkpolicies"}
+METADATA_ONLY_ACCEPT = "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,application/json"
+# Cluster-wide list paths, for requests that need their own Accept header
+RESOURCE_LIST_PATHS = {
+    "namespaces": "/api/v1/namespaces",
+    "pods": "/api/v1/pods",
+    "services": "/api/v1/services",
+    "configmaps": "/api/v1/configmaps",
+    "secrets": "/api/v1/secrets",
+    "deployments": "/apis/apps/v1/deployments",
+    "replicasets": "/apis/apps/v1/replicasets",
+    "statefulsets": "/apis/apps/v1/statefulsets",
+    "daemonsets": "/apis/apps/v1/daemonsets",
+    "jobs": "/apis/batch/v1/jobs",
+    "cronjobs": "/apis/batch/v1/cronjobs",
+    "ingresses": "/apis/networking.k8s.io/v1/ingresses",
+    "networkpolicies": "/apis/networking.k8s.io/v1/networkpolicies",
+}
+# Types whose API objects have no status at all
+TYPES_WITHOUT_STATUS = {"configmaps", "secrets", "networkpolicies"}
+
+# API clients are shared so every list call reuses the same connection pool
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+
+def get_api(api_class):
+    """Return the shared API client instance for an API group"""
+    with _api_clients_lock:
+        if api_class not in _api_clients:
+            _api_clients[api_class] = getattr(client, api_class)()
+        return _api_clients[api_class]
+
+def get_list_function(resource_type, namespace=None):
+    """Return the list function for a resource type, namespaced if requested"""
+    api_class, namespaced_function, all_function = RESOURCE_LISTERS[resource_type]
+    api = get_api(api_class)
+    if namespace and namespaced_function:
+        list_function = getattr(api, namespaced_function)
+        return lambda **kwargs: list_function(namespace, **kwargs)
+    return getattr(api, all_function)
+
+def iter_list_pages(list_function, page_size=None):
+    """Yield list results one page at a time using limit/continue"""
+    page_size = page_size or LIST_PAGE_SIZE
+    continue_token = None
+    
+    while True:
+        kwargs = {"limit": page_size}
+        if continue_token:
+            kwargs["_continue"] = continue_token
+        start_time = time.time()
+        result = list_function(**kwargs)
+        record_list_request(time.time() - start_time)
+        yield result
+        
+        continue_token = result.metadata._continue
+        if not continue_token:
+            break
+
+def load_json(data):
+    """Parse JSON bytes, with orjson when it is installed"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def iter_raw_pages(list_function, page_size=None, headers=None):
+    """Yield (parsed JSON page, response size in bytes) using limit/continue.
+
+    The response is not deserialized into client model objects.
+    """
+    page_size = page_size or LIST_PAGE_SIZE
+    continue_token = None
+    
+    while True:
+        kwargs = {"limit": page_size, "_preload_content": False}
+        if headers:
+            kwargs["_headers"] = dict(headers)
+        if continue_token:
+            kwargs["_continue"] = continue_token
+        start_time = time.time()
+        data = list_function(**kwargs).data
+        record_list_request(time.time() - start_time)
+        page = load_json(data)
+        yield page, len(data)
+        
+        continue_token = (page.get("metadata") or {}).get("continue")
+        if not continue_token:
+            break
+
+def record_list_request(elapsed):
+    """Record the duration of one list request"""
+    global _slowest_list_request
+    list_request_duration.observe(elapsed)
+    with _slowest_list_request_lock:
+        _slowest_list_request = max(_slowest_list_request, elapsed)
+
+def take_slowest_list_request():
+    """Return the slowest list request since the last call and reset it"""
+    global _slowest_list_request
+    with _slowest_list_request_lock:
+        slowest, _slowest_list_request = _slowest_list_request, 0.0
+    return slowest
+
+def check_metadata_only(page, resource_type):
+    """Count a metadata-only list page that the apiserver answered with full objects"""
+    kind = page.get("kind")
+    if kind == "PartialObjectMetadataList":
+        return
+    full_object_pages.labels(resource_type=resource_type).inc()
+    if resource_type not in _full_object_types:
+        _full_object_types.add(resource_type)
+        logger.warning(f"Listing {resource_type} returned {kind} instead of PartialObjectMetadataList, full objects are being downloaded")
+
+def iter_page_metadata(resource_type, list_function=None):
+    """Yield (extracted metadata, response bytes or None, resourceVersion) per list page"""
+    list_function = list_function or get_list_function(resource_type)
+    if EXTRACTION_MODE == "raw":
+        headers = {"Accept": METADATA_ONLY_ACCEPT} if resource_type in METADATA_ONLY_TYPES else None
+        for page, page_bytes in iter_raw_pages(list_function, headers=headers):
+            if headers:
+                check_metadata_only(page, resource_type)
+            yield (
+                [extract_raw_metadata(item, resource_type) for item in page.get("items") or []],
+                page_bytes,
+                (page.get("metadata") or {}).get("resourceVersion")
+            )
+    else:
+        for result in iter_list_pages(list_function):
+            yield (
+                [extract_metadata(resource, resource_type) for resource in result.items],
+                None,
+                result.metadata.resource_version
+            )
+
+def record_extraction(resource_type, objects, total_bytes, elapsed):
+    """Export the extraction rate and, for raw responses, bytes per object"""
+    if elapsed > 0:
+        extraction_rate.labels(resource_type=resource_type).set(objects / elapsed)
+    if objects and total_bytes:
+        bytes_per_object.labels(resource_type=resource_type).set(total_bytes / objects)
+
+def collect_resource_metadata(resource_type, namespace=None):
+    """Collect and extract metadata for one resource type page by page.
+
+    Raw responses or typed client objects are dropped as soon as each page
+    has been extracted, so only one page is held in memory at a time.
+    List errors are raised, so a failed listing is never mistaken for an
+    empty one.
+    """
+    metadata = []
+    owner_ref_count = 0
+    total_bytes = 0
+    start_time = time.time()
+    with list_duration.labels(resource_type=resource_type).time():
+        for page_metadata, page_bytes, _ in iter_page_metadata(resource_type, get_list_function(resource_type, namespace)):
+            total_bytes += page_bytes or 0
+            for resource_metadata in page_metadata:
+                metadata.append(resource_metadata)
+                owner_ref_count += len(resource_metadata["owner_references"])
+    record_extraction(resource_type, len(metadata), total_bytes, time.time() - start_time)
+    return metadata, owner_ref_count
+
+def filter_annotations(annotations):
+    """Drop excluded annotations and hash long values so their changes stay visible"""
+    if not annotations:
+        return {}
+    if not ANNOTATION_EXCLUDE and not ANNOTATION_HASH_MIN_BYTES:
+        return annotations
+    
+    filtered = {}
+    for key, value in annotations.items():
+        if key in ANNOTATION_EXCLUDE:
+            continue
+        if ANNOTATION_HASH_MIN_BYTES and value and len(value) > ANNOTATION_HASH_MIN_BYTES:
+            value = "sha256:" + hashlib.sha256(value.encode('utf-8')).hexdigest()
+        filtered[key] = value
+    return filtered
+
+def extract_raw_metadata(item, resource_type):
+    """Extract the same fields as extract_metadata from a raw JSON object"""
+    item_metadata = item.get("metadata") or {}
+    creation_timestamp = item_metadata.get("creationTimestamp")
+    if creation_timestamp and creation_timestamp.endswith("Z"):
+        # Match the isoformat() of the datetime the typed client would parse
+        creation_timestamp = creation_timestamp[:-1] + "+00:00"
+    
+    metadata = {
+        "resource_type": resource_type,
+        "name": item_metadata.get("name"),
+        "namespace": item_metadata.get("namespace"),
+        "creation_timestamp": creation_timestamp,
+        "resource_version": item_metadata.get("resourceVersion"),
+        "uid": item_metadata.get("uid"),
+        "labels": item_metadata.get("labels") or {},
+        "annotations": filter_annotations(item_metadata.get("annotations")),
+        "owner_references": [
+            {"kind": owner.get("kind"), "name": owner.get("name"), "uid": owner.get("uid")}
+            for owner in item_metadata.get("ownerReferences") or []
+        ]
+    }
+    
+    if resource_type in TYPES_WITHOUT_STATUS:
+        return metadata
+    
+    metadata["status"] = {}
+    status = item.get("status")
+    if status is None:
+        return metadata
+    if resource_type == "pods":
+        metadata["status"]["phase"] = status.get("phase")
+        metadata["status"]["restart_count"] = sum(
+            container.get("restartCount") or 0
+            for container in status.get("containerStatuses") or []
+        )
+        metadata["status"]["ready"] = any(
+            condition.get("type") == "Ready" and condition.get("status") == "True"
+            for condition in status.get("conditions") or []
+        )
+    elif resource_type in ["deployments", "replicasets", "statefulsets"]:
+        # DaemonSet status has no replica counts, as in extract_metadata
+        metadata["status"]["ready_replicas"] = status.get("readyReplicas")
+        metadata["status"]["replicas"] = status.get("replicas")
+    elif resource_type == "jobs":
+        metadata["status"]["active"] = status.get("active")
+        metadata["status"]["succeeded"] = status.get("succeeded")
+        metadata["status"]["failed"] = status.get("failed")
+    
+    return metadata
 
 def extract_metadata(resource, resource_type):
     """Extract relevant metadata from a resource"""
@@ -91,7 +464,7 @@ def extract_metadata(resource, resource_type):
         "resource_version": resource.metadata.resource_version,
         "uid": resource.metadata.uid,
         "labels": resource.metadata.labels if resource.metadata.labels else {},
-        "annotations": resource.metadata.annotations if resource.metadata.annotations else {},
+        "annotations": filter_annotations(resource.metadata.annotations),
         "owner_references": []
     }
     
@@ -109,82 +482,1184 @@ def extract_metadata(resource, resource_type):
         metadata["status"] = {}
         if resource_type == "pods" and hasattr(resource.status, 'phase'):
             metadata["status"]["phase"] = resource.status.phase
-        elif resource_type in ["deployments", "statefulsets", "daemonsets"]:
+            metadata["status"]["restart_count"] = sum(
+                container.restart_count or 0
+                for container in (resource.status.container_statuses or [])
+            )
+            metadata["status"]["ready"] = any(
+                condition.type == "Ready" and condition.status == "True"
+                for condition in (resource.status.conditions or [])
+            )
+        elif resource_type in ["deployments", "replicasets", "statefulsets", "daemonsets"]:
             if hasattr(resource.status, 'ready_replicas'):
                 metadata["status"]["ready_replicas"] = resource.status.ready_replicas
             if hasattr(resource.status, 'replicas'):
                 metadata["status"]["replicas"] = resource.status.replicas
+        elif resource_type == "jobs":
+            metadata["status"]["active"] = resource.status.active
+            metadata["status"]["succeeded"] = resource.status.succeeded
+            metadata["status"]["failed"] = resource.status.failed
     
     return metadata
 
-def collect_all_metadata():
-    """Collect metadata from all resources"""
+@stage_duration.labels(stage='collect_all_metadata').time()
+def reuse_last_listing(resource_type, namespace, error):
+    """Return the last successful listing of a resource type after a failed one"""
+    list_failures.labels(resource_type=resource_type).inc()
+    previous = _last_listings.get((resource_type, namespace))
+    logger.error(f"Error collecting {resource_type}: {error}, {'keeping its previous objects' if previous else 'no previous objects'}")
+    return previous or ([], 0)
+
+def collect_all_metadata(shards=None):
+    """Collect metadata from all resources, or only those in the given shards.
+
+    Returns the metadata and the resource types that failed to list; those
+    contribute their last successful listing instead.
+    """
+    start_time = time.time()
     metadata = []
+    failed = set()
+    resource_types = ["namespaces"] + RESOURCE_TYPES
+    namespaces = [None]
+    collected = {}
     
-    # Load Kubernetes configuration
-    try:
-        config.load_incluster_config()
-    except config.ConfigException:
-        config.load_kube_config()
-    
-    core_v1 = client.CoreV1Api()
+    if shards is not None and SHARD_BY == "namespace":
+        # Namespaces are listed in full to find the owned ones, which are then listed one by one
+        try:
+            all_namespaces, _ = _last_listings[("namespaces", None)] = collect_resource_metadata("namespaces")
+        except Exception as e:
+            failed.add("namespaces")
+            all_namespaces, _ = reuse_last_listing("namespaces", None, e)
+        owned = [ns for ns in all_namespaces if shard_of("namespaces", ns["name"]) in shards]
+        collected["namespaces"] = [(owned, 0)]
+        namespaces = [ns["name"] for ns in owned]
+    elif shards is not None:
+        resource_types = [resource_type for resource_type in resource_types if shard_of(resource_type) in shards]
     
-    # Collect namespaces
-    namespaces = collect_namespaces(core_v1)
-    for ns in namespaces:
-        metadata.append(extract_metadata(ns, "namespaces"))
+    # Collect namespaces and resource types concurrently on a bounded pool
+    with ThreadPoolExecutor(max_workers=COLLECTION_WORKERS) as executor:
+        futures = {
+            resource_type: [
+                executor.submit(collect_resource_metadata, resource_type, namespace)
+                for namespace in namespaces
+            ]
+            for resource_type in resource_types if resource_type not in collected
+        }
+        
+        # Results are merged in a fixed order so snapshots stay stable
+        for resource_type in resource_types:
+            results = collected.get(resource_type)
+            if results is None:
+                results = []
+                for namespace, future in zip(namespaces, futures[resource_type]):
+                    try:
+                        result = _last_listings[(resource_type, namespace)] = future.result()
+                    except Exception as e:
+                        failed.add(resource_type)
+                        result = reuse_last_listing(resource_type, namespace, e)
+                    results.append(result)
+            for resource_metadata, _ in results:
+                metadata.extend(resource_metadata)
+            if resource_type == "namespaces":
+                continue
+            
+            type_count = sum(len(resource_metadata) for resource_metadata, _ in results)
+            owner_ref_count = sum(count for _, count in results)
+            
+            # Update Prometheus metrics
+            metadata_count.labels(resource_type=resource_type).set(type_count)
+            owner_reference_count.labels(resource_type=resource_type).set(owner_ref_count)
+            
     
-    # Resource types to collect
-    resource_types = [
-        "pods", "services", "configmaps", "secrets", 
-        "deployments", "statefulsets", "daemonsets"
-    ]
+    collection_duration.set(time.time() - start_time)
+    update_peak_rss()
     
-    # Collect resources
+    return metadata, failed
+
+def update_peak_rss():
+    """Export the process peak RSS (ru_maxrss is reported in KiB on Linux)"""
+    collector_peak_rss.set(getrusage(RUSAGE_SELF).ru_maxrss * 1024)
+
+class ObjectStateTable:
+    """Per-uid state table used to count exact object changes.
+
+    Each uid maps to its resource type, namespace, name, resource version,
+    status, owner uids and container restart count. Updates are applied one
+    object at a time (from watch events or a resync), so the work per
+    interval is proportional to the number of changes. Counters are kept per
+    (resource_type, namespace) and drained with end_interval.
+    """
+
+    CHANGE_KINDS = ("created", "deleted", "updated", "restarted")
+
+    def __init__(self, flap_window=FLAP_WINDOW, flap_threshold=FLAP_THRESHOLD):
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        self.lock = threading.Lock()
+        # uid -> (resource_type, namespace, name, resource_version, status, owners, restarts)
+        self.objects = {}
+        # (resource_type, namespace, name) -> interval in which it was last deleted
+        self.recently_deleted = {}
+        # uid -> intervals in which its status changed, only for objects that changed recently
+        self.status_changes = {}
+        self.changes = Counter()
+        self.interval = 0
+
+    @staticmethod
+    def _state(obj):
+        status = dict(obj.get("status") or {})
+        restarts = status.pop("restart_count", None) or 0
+        owners = tuple(owner["uid"] for owner in obj.get("owner_references", []))
+        return (
+            obj["resource_type"], obj.get("namespace"), obj.get("name"),
+            obj.get("resource_version"), tuple(sorted(status.items())), owners, restarts
+        )
+
+    def _upsert(self, obj, count=True):
+        uid = obj["uid"]
+        new = self._state(obj)
+        old = self.objects.get(uid)
+        self.objects[uid] = new
+        if not count:
+            return
+        
+        resource_type, namespace, name = new[:3]
+        if old is None:
+            self.changes[(resource_type, namespace, "created")] += 1
+            # A new uid under a name deleted this or last interval is a recreation
+            deleted_in = self.recently_deleted.pop((resource_type, namespace, name), None)
+            if deleted_in is not None and self.interval - deleted_in <= 1:
+                self.changes[(resource_type, namespace, "restarted")] += 1
+        elif old[3] != new[3]:
+            self.changes[(resource_type, namespace, "updated")] += 1
+            if old[4] != new[4]:
+                self.status_changes.setdefault(uid, deque()).append(self.interval)
+            if new[6] > old[6]:
+                self.changes[(resource_type, namespace, "restarted")] += new[6] - old[6]
+
+    def _delete(self, uid, count=True):
+        old = self.objects.pop(uid, None)
+        if old is None:
+            return
+        self.status_changes.pop(uid, None)
+        if count:
+            resource_type, namespace, name = old[:3]
+            self.changes[(resource_type, namespace, "deleted")] += 1
+            self.recently_deleted[(resource_type, namespace, name)] = self.interval
+
+    def upsert(self, obj):
+        """Record an added or modified object"""
+        with self.lock:
+            self._upsert(obj)
+
+    def delete(self, uid):
+        """Record a deleted object"""
+        with self.lock:
+            self._delete(uid)
+
+    def resync(self, metadata, resource_type=None, count=True, keep_types=()):
+        """Reconcile the table with a full listing (of one resource type if given).
+
+        Only objects whose resource version differs are re-processed. With
+        count=False the listing becomes the new baseline without being
+        reported as changes. Objects of keep_types, the types that failed
+        to list, are not deleted when they are missing from the listing.
+        """
+        with self.lock:
+            current = {obj["uid"]: obj for obj in metadata}
+            for uid, state in list(self.objects.items()):
+                if uid not in current and (resource_type is None or state[0] == resource_type) \
+                        and state[0] not in keep_types:
+                    self._delete(uid, count)
+            for uid, obj in current.items():
+                state = self.objects.get(uid)
+                if state is None or state[3] != obj.get("resource_version"):
+                    self._upsert(obj, count)
+
+    def end_interval(self):
+        """Return and reset this interval's change counts.
+
+        Returns (changes, flapping): changes maps (resource_type, namespace,
+        kind) to a count and flapping maps (resource_type, namespace) to the
+        number of objects whose status changed flap_threshold times within
+        the last flap_window intervals.
+        """
+        with self.lock:
+            changes = self.changes
+            self.changes = Counter()
+            
+            flapping = Counter()
+            oldest = self.interval - self.flap_window + 1
+            for uid, intervals in list(self.status_changes.items()):
+                while intervals and intervals[0] < oldest:
+                    intervals.popleft()
+                if not intervals:
+                    del self.status_changes[uid]
+                elif len(intervals) >= self.flap_threshold:
+                    resource_type, namespace = self.objects[uid][:2]
+                    flapping[(resource_type, namespace)] += 1
+            
+            self.recently_deleted = {
+                key: deleted_in for key, deleted_in in self.recently_deleted.items()
+                if self.interval - deleted_in < 1
+            }
+            self.interval += 1
+            return changes, flapping
+
+# Per-uid object state shared by the list and watch collection modes
+object_state = ObjectStateTable()
+
+def update_object_change_metrics(changes, flapping, resource_types):
+    """Export per-type change counts; metadata_change_rate is the exact churn.
+
+    Returns the total churn over all types.
+    """
+    total_churn = 0
     for resource_type in resource_types:
-        resources = collect_resources(core_v1, resource_type)
-        type_count = 0
+        type_changes = {kind: 0 for kind in ObjectStateTable.CHANGE_KINDS}
+        for (rt, _, kind), count in changes.items():
+            if rt == resource_type:
+                type_changes[kind] += count
+        for kind, count in type_changes.items():
+            object_changes.labels(resource_type=resource_type, change=kind).set(count)
+        
+        churn = type_changes["created"] + type_changes["deleted"] + type_changes["updated"]
+        metadata_change_rate.labels(resource_type=resource_type).set(churn)
+        total_churn += churn
+        flapping_objects.labels(resource_type=resource_type).set(
+            sum(count for (rt, _), count in flapping.items() if rt == resource_type)
+        )
+    return total_churn
+
+class ResourceCache:
+    """Informer-style cache of resource metadata kept up to date by watch streams.
+
+    Each resource type is listed once and then followed with a watch that
+    resumes from the last seen resourceVersion. When the apiserver answers
+    410 Gone the type is relisted and the cache for it is replaced.
+    """
+
+    def __init__(self, resource_types):
+        self.resource_types = ["namespaces"] + list(resource_types)
+        self.lock = threading.Lock()
+        # resource_type -> {uid: metadata}
+        self.objects = {resource_type: {} for resource_type in self.resource_types}
+        self.owner_ref_counts = {resource_type: 0 for resource_type in self.resource_types}
+        self.synced = {resource_type: threading.Event() for resource_type in self.resource_types}
+
+    def start(self):
+        """Start one watch thread per resource type"""
+        for resource_type in self.resource_types:
+            thread = threading.Thread(
+                target=self._run, args=(resource_type,),
+                name=f"watch-{resource_type}", daemon=True
+            )
+            thread.start()
+
+    def wait_for_sync(self, timeout=None):
+        """Block until every resource type has completed its initial list"""
+        deadline = time.time() + timeout if timeout is not None else None
+        for resource_type, synced in self.synced.items():
+            remaining = max(0, deadline - time.time()) if deadline is not None else None
+            if not synced.wait(remaining):
+                logger.warning(f"Cache for {resource_type} has not synced yet")
+                return False
+        return True
+
+    def _relist(self, resource_type, list_function):
+        """List a resource type page by page and replace its cached objects"""
+        metadata = []
+        total_bytes = 0
+        start_time = time.time()
+        with list_duration.labels(resource_type=resource_type).time():
+            for page_metadata, page_bytes, resource_version in iter_page_metadata(resource_type, list_function):
+                total_bytes += page_bytes or 0
+                metadata.extend(page_metadata)
+        record_extraction(resource_type, len(metadata), total_bytes, time.time() - start_time)
+        return self._replace(resource_type, metadata, resource_version)
+
+    def _replace(self, resource_type, metadata, resource_version):
+        """Replace the cached objects of a resource type with a fresh list"""
+        objects = {resource_metadata["uid"]: resource_metadata for resource_metadata in metadata}
+        owner_refs = sum(len(resource_metadata["owner_references"]) for resource_metadata in metadata)
+        with self.lock:
+            self.objects[resource_type] = objects
+            self.owner_ref_counts[resource_type] = owner_refs
+            self._update_metrics(resource_type)
+        
+        # The initial list is the baseline, later relists after 410 Gone are changes
+        object_state.resync(objects.values(), resource_type, count=self.synced[resource_type].is_set())
+        self.synced[resource_type].set()
+        logger.info(f"Listed {len(objects)} {resource_type} at resourceVersion {resource_version}")
+        return resource_version
+
+    def _run(self, resource_type):
+        """List then watch a single resource type forever"""
+        list_function = get_list_function(resource_type)
+        resource_version = None
+        
+        while True:
+            try:
+                if resource_version is None:
+                    resource_version = self._relist(resource_type, list_function)
+                
+                w = watch.Watch()
+                for event in w.stream(
+                    list_function,
+                    resource_version=resource_version,
+                    timeout_seconds=WATCH_TIMEOUT,
+                    allow_watch_bookmarks=True
+                ):
+                    if event['type'] != 'BOOKMARK':
+                        self._apply_event(resource_type, event['type'], event['object'])
+                    resource_version = w.resource_version
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info(f"Watch for {resource_type} expired (410 Gone), relisting")
+                    resource_version = None
+                    continue
+                logger.error(f"Error watching {resource_type}: {e}")
+                time.sleep(WATCH_RETRY_DELAY)
+            except Exception as e:
+                logger.error(f"Error watching {resource_type}: {e}")
+                time.sleep(WATCH_RETRY_DELAY)
+
+    def _apply_event(self, resource_type, event_type, resource):
+        """Apply a single watch event to the cache"""
+        uid = resource.metadata.uid
+        with self.lock:
+            objects = self.objects[resource_type]
+            previous = objects.pop(uid, None)
+            if previous is not None:
+                self.owner_ref_counts[resource_type] -= len(previous["owner_references"])
+            
+            if event_type in ("ADDED", "MODIFIED"):
+                resource_metadata = extract_metadata(resource, resource_type)
+                objects[uid] = resource_metadata
+                self.owner_ref_counts[resource_type] += len(resource_metadata["owner_references"])
+                object_state.upsert(resource_metadata)
+            else:
+                object_state.delete(uid)
+            
+            self._update_metrics(resource_type)
+
+    def _update_metrics(self, resource_type):
+        """Refresh the per-type gauges from the cache (caller holds the lock)"""
+        if resource_type == "namespaces":
+            return
+        metadata_count.labels(resource_type=resource_type).set(len(self.objects[resource_type]))
+        owner_reference_count.labels(resource_type=resource_type).set(self.owner_ref_counts[resource_type])
+
+    def snapshot(self):
+        """Return the cached metadata in the same shape as collect_all_metadata"""
+        metadata = []
+        with self.lock:
+            for resource_type in self.resource_types:
+                metadata.extend(self.objects[resource_type].values())
+        return metadata
+
+async def load_async_kube_config():
+    """Load in-cluster configuration for kubernetes_asyncio, falling back to the local kubeconfig"""
+    try:
+        async_config.load_incluster_config()
+    except async_config.ConfigException:
+        await async_config.load_kube_config()
+
+class AsyncCollector:
+    """Lists resource types concurrently on asyncio over one shared connection pool.
+
+    Each type is listed by its own task as raw JSON pages, so a slow type
+    only delays its own task. Requests are bounded by REQUEST_TIMEOUT and
+    retried with jittered backoff; a type that still fails contributes its
+    last successful result instead of appearing to have been deleted.
+    Snapshots are saved on a single writer thread so disk and compression
+    never block the event loop.
+    """
+
+    def __init__(self, resource_types):
+        self.resource_types = ["namespaces"] + list(resource_types)
+        self.api_client = None
+        self.apis = {}
+        # resource_type -> (metadata, owner reference count) of its last successful list
+        self.last_results = {}
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-writer")
+
+    async def start(self):
+        await load_async_kube_config()
+        configuration = async_client.Configuration.get_default_copy()
+        configuration.connection_pool_maxsize = ASYNC_POOL_SIZE
+        self.api_client = async_client.ApiClient(configuration)
+
+    def list_function(self, resource_type):
+        """Return the cluster-wide async list function of a resource type"""
+        api_class, _, all_function = RESOURCE_LISTERS[resource_type]
+        if api_class not in self.apis:
+            self.apis[api_class] = getattr(async_client, api_class)(self.api_client)
+        return getattr(self.apis[api_class], all_function)
+
+    async def _request(self, resource_type, query_params, accept):
+        """Fetch one raw list page, retrying timeouts and transient errors with jitter.
+
+        The request goes through call_api because the generated list
+        functions replace any Accept header passed in _headers.
+        """
+        async def fetch():
+            response = await self.api_client.call_api(
+                RESOURCE_LIST_PATHS[resource_type], 'GET',
+                query_params=query_params,
+                header_params={"Accept": accept},
+                auth_settings=['BearerToken'],
+                _preload_content=False
+            )
+            try:
+                # Unparsed responses are not checked by the client
+                if not 200 <= response.status <= 299:
+                    raise AsyncApiException(status=response.status, reason=response.reason)
+                return await response.read()
+            finally:
+                response.release()
+        
+        for attempt in range(REQUEST_RETRIES + 1):
+            start_time = time.time()
+            try:
+                data = await asyncio.wait_for(fetch(), REQUEST_TIMEOUT)
+                record_list_request(time.time() - start_time)
+                return data
+            except (asyncio.TimeoutError, aiohttp.ClientError, AsyncApiException) as e:
+                record_list_request(time.time() - start_time)
+                transient = not isinstance(e, AsyncApiException) or e.status in (429, 500, 502, 503, 504)
+                if not transient or attempt == REQUEST_RETRIES:
+                    raise
+                delay = RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+                list_retries.labels(resource_type=resource_type).inc()
+                error = f"HTTP {e.status}" if isinstance(e, AsyncApiException) else type(e).__name__
+                logger.warning(f"Listing {resource_type} failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def list_metadata(self, resource_type):
+        """List one resource type page by page; returns (metadata, owner reference count, resourceVersion)"""
+        metadata_only = resource_type in METADATA_ONLY_TYPES
+        accept = METADATA_ONLY_ACCEPT if metadata_only else "application/json"
+        metadata = []
         owner_ref_count = 0
+        total_bytes = 0
+        continue_token = None
+        start_time = time.time()
         
-        for resource in resources:
-            resource_metadata = extract_metadata(resource, resource_type)
-            metadata.append(resource_metadata)
-            type_count += 1
-            owner_ref_count += len(resource_metadata["owner_references"])
+        while True:
+            query_params = [("limit", LIST_PAGE_SIZE)]
+            if continue_token:
+                query_params.append(("continue", continue_token))
+            data = await self._request(resource_type, query_params, accept)
+            total_bytes += len(data)
+            page = load_json(data)
+            if metadata_only:
+                check_metadata_only(page, resource_type)
+            for item in page.get("items") or []:
+                resource_metadata = extract_raw_metadata(item, resource_type)
+                metadata.append(resource_metadata)
+                owner_ref_count += len(resource_metadata["owner_references"])
+            
+            page_metadata = page.get("metadata") or {}
+            continue_token = page_metadata.get("continue")
+            if not continue_token:
+                break
         
-        # Update Prometheus metrics
-        metadata_count.labels(resource_type=resource_type).set(type_count)
-        owner_reference_count.labels(resource_type=resource_type).set(owner_ref_count)
+        elapsed = time.time() - start_time
+        list_duration.labels(resource_type=resource_type).observe(elapsed)
+        record_extraction(resource_type, len(metadata), total_bytes, elapsed)
+        return metadata, owner_ref_count, page_metadata.get("resourceVersion")
+
+    async def _collect_type(self, resource_type):
+        try:
+            metadata, owner_ref_count, _ = await self.list_metadata(resource_type)
+        except Exception as e:
+            list_failures.labels(resource_type=resource_type).inc()
+            previous = self.last_results.get(resource_type)
+            error = f"HTTP {e.status}" if isinstance(e, AsyncApiException) else repr(e)
+            logger.error(f"Error collecting {resource_type}: {error}, {'keeping its previous objects' if previous else 'no previous objects'}")
+            return previous or ([], 0), False
+        self.last_results[resource_type] = (metadata, owner_ref_count)
+        return (metadata, owner_ref_count), True
+
+    async def collect_all_metadata(self):
+        """Collect metadata from all resources concurrently; returns it with the types that failed to list"""
+        start_time = time.time()
+        results = await asyncio.gather(*(self._collect_type(resource_type) for resource_type in self.resource_types))
         
-        # Calculate change rate if we have previous data
-        if resource_type in previous_counts:
-            change_rate = abs(type_count - previous_counts[resource_type])
-            metadata_change_rate.labels(resource_type=resource_type).set(change_rate)
+        # Results are merged in a fixed order so snapshots stay stable
+        metadata = []
+        failed = set()
+        for resource_type, ((resource_metadata, owner_ref_count), listed) in zip(self.resource_types, results):
+            metadata.extend(resource_metadata)
+            if not listed:
+                failed.add(resource_type)
+            if resource_type == "namespaces":
+                continue
+            metadata_count.labels(resource_type=resource_type).set(len(resource_metadata))
+            owner_reference_count.labels(resource_type=resource_type).set(owner_ref_count)
         
-        # Update previous counts
-        previous_counts[resource_type] = type_count
-    
-    return metadata
+        elapsed = time.time() - start_time
+        stage_duration.labels(stage='collect_all_metadata').observe(elapsed)
+        collection_duration.set(elapsed)
+        update_peak_rss()
+        return metadata, failed
+
+class AsyncResourceCache(ResourceCache):
+    """ResourceCache whose lists and watches run as asyncio tasks on an AsyncCollector's pool"""
+
+    def __init__(self, resource_types, collector):
+        super().__init__(resource_types)
+        self.collector = collector
+        self.tasks = []
+
+    def start(self):
+        """Start one watch task per resource type on the running event loop"""
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self._run_async(resource_type)) for resource_type in self.resource_types]
+
+    async def wait_for_sync_async(self, timeout=None):
+        """Wait until every resource type has completed its initial list"""
+        deadline = time.time() + timeout if timeout is not None else None
+        while not all(synced.is_set() for synced in self.synced.values()):
+            if deadline is not None and time.time() > deadline:
+                logger.warning("Watch cache has not synced yet")
+                return False
+            await asyncio.sleep(0.5)
+        return True
+
+    async def _run_async(self, resource_type):
+        """List then watch a single resource type forever"""
+        list_function = self.collector.list_function(resource_type)
+        resource_version = None
+        
+        while True:
+            try:
+                if resource_version is None:
+                    metadata, _, resource_version = await self.collector.list_metadata(resource_type)
+                    self._replace(resource_type, metadata, resource_version)
+                
+                w = async_watch.Watch()
+                async for event in w.stream(
+                    list_function,
+                    resource_version=resource_version,
+                    timeout_seconds=WATCH_TIMEOUT,
+                    allow_watch_bookmarks=True
+                ):
+                    if event['type'] != 'BOOKMARK':
+                        self._apply_event(resource_type, event['type'], event['object'])
+                    resource_version = w.resource_version
+            except AsyncApiException as e:
+                if e.status == 410:
+                    logger.info(f"Watch for {resource_type} expired (410 Gone), relisting")
+                    resource_version = None
+                    continue
+                logger.error(f"Error watching {resource_type}: {e}")
+                await asyncio.sleep(WATCH_RETRY_DELAY)
+            except Exception as e:
+                logger.error(f"Error watching {resource_type}: {e!r}")
+                await asyncio.sleep(WATCH_RETRY_DELAY)
 
-def save_metadata_snapshot(metadata):
+def write_atomic(path, data):
+    """Write bytes to path via a temporary file and rename.
+
+    The temporary file starts with a dot so readers globbing for
+    metadata_snapshot_* never see a half-written snapshot.
+    """
+    tmp_path = os.path.join(os.path.dirname(path), f".tmp-{os.path.basename(path)}")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    bytes_written.inc(len(data))
+
+def compress_snapshot(payload):
+    """Serialize and compress a snapshot payload, returning (bytes, extension)"""
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    if SNAPSHOT_COMPRESSION == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data), "zst"
+    return gzip.compress(data, compresslevel=6), "gz"
+
+def diff_snapshots(previous, current):
+    """Compute added, modified and removed objects between two uid-keyed snapshots"""
+    added = []
+    modified = []
+    for uid, obj in current.items():
+        previous_obj = previous.get(uid)
+        if previous_obj is None:
+            added.append(obj)
+        elif previous_obj != obj:
+            modified.append(obj)
+    removed = [uid for uid in previous if uid not in current]
+    return added, modified, removed
+
+@stage_duration.labels(stage='save_metadata_snapshot').time()
+def save_metadata_snapshot(metadata, timestamp=None):
     """Save metadata snapshot to a file"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{OUTPUT_DIR}/metadata_snapshot_{timestamp}.json"
+    timestamp = timestamp or datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    with open(filename, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    base = None
+    if SNAPSHOT_FORMAT == "json":
+        filename = f"{OUTPUT_DIR}/metadata_snapshot_{timestamp}.json"
+        data = json.dumps(metadata, indent=2).encode('utf-8')
+        write_atomic(filename, data)
+    else:
+        base = snapshot_chain["filename"]
+        filename, data = save_delta_snapshot(metadata, timestamp)
+        if ".full." in filename:
+            base = None
     
     logger.info(f"Saved metadata snapshot to {filename}")
+    if publisher is not None:
+        publisher.publish(os.path.basename(filename), data, metadata, base)
+    cleanup_snapshots(OUTPUT_DIR, SNAPSHOTS_TO_KEEP)
+    
+    if SNAPSHOT_TABLE:
+        save_metadata_table(metadata, timestamp)
+
+def save_delta_snapshot(metadata, timestamp):
+    """Write either a full keyframe or a delta against the previous snapshot"""
+    current = {obj["uid"]: obj for obj in metadata}
+    previous = snapshot_chain["objects"]
     
-    # Keep a rolling window of snapshots (keep last 24 hours assuming 5-min intervals)
-    snapshots_to_keep = 100 #24 * 60 // COLLECTION_INTERVAL
-    all_snapshots = sorted([f for f in os.listdir(OUTPUT_DIR) if f.startswith("metadata_snapshot_")])
+    if previous is None or snapshot_chain["deltas"] >= KEYFRAME_INTERVAL - 1:
+        data, extension = compress_snapshot(metadata)
+        basename = f"metadata_snapshot_{timestamp}.full.json.{extension}"
+        snapshot_chain["deltas"] = 0
+    else:
+        added, modified, removed = diff_snapshots(previous, current)
+        data, extension = compress_snapshot({
+            "base": snapshot_chain["filename"],
+            "added": added,
+            "modified": modified,
+            "removed": removed
+        })
+        basename = f"metadata_snapshot_{timestamp}.delta.json.{extension}"
+        snapshot_chain["deltas"] += 1
+        logger.info(f"Delta: {len(added)} added, {len(modified)} modified, {len(removed)} removed")
     
-    if len(all_snapshots) > snapshots_to_keep:
-        for old_snapshot in all_snapshots[:-snapshots_to_keep]:
-            os.remove(os.path.join(OUTPUT_DIR, old_snapshot))
-            logger.info(f"Removed old snapshot {old_snapshot}")
+    filename = os.path.join(OUTPUT_DIR, basename)
+    write_atomic(filename, data)
+    snapshot_chain["objects"] = current
+    snapshot_chain["filename"] = basename
+    return filename, data
+
+def metadata_to_table(metadata):
+    """Build a columnar table with one row per object"""
+    statuses = [obj.get("status") for obj in metadata]
+    # The first owner reference, which is the controller for built-in workloads
+    owners = [obj["owner_references"][0] if obj["owner_references"] else {} for obj in metadata]
+    return pa.table({
+        "resource_type": pa.array([obj["resource_type"] for obj in metadata], pa.string()),
+        "namespace": pa.array([obj["namespace"] for obj in metadata], pa.string()),
+        "name": pa.array([obj["name"] for obj in metadata], pa.string()),
+        "uid": pa.array([obj["uid"] for obj in metadata], pa.string()),
+        "resource_version": pa.array([obj["resource_version"] for obj in metadata], pa.string()),
+        "owner_ref_count": pa.array([len(obj["owner_references"]) for obj in metadata], pa.int32()),
+        "owner_uid": pa.array([owner.get("uid") for owner in owners], pa.string()),
+        "owner_kind": pa.array([owner.get("kind") for owner in owners], pa.string()),
+        "has_status": pa.array([status is not None for status in statuses], pa.bool_()),
+        "status_phase": pa.array([status.get("phase") if status else None for status in statuses], pa.string()),
+        "ready_replicas": pa.array([status.get("ready_replicas") if status else None for status in statuses], pa.int64()),
+        "replicas": pa.array([status.get("replicas") if status else None for status in statuses], pa.int64()),
+        "ready": pa.array([status.get("ready") if status else None for status in statuses], pa.bool_()),
+    })
+
+def save_metadata_table(metadata, timestamp):
+    """Write the snapshot as an uncompressed Arrow IPC file so readers can memory-map it"""
+    if pa is None:
+        logger.warning("SNAPSHOT_TABLE is enabled but pyarrow is not installed")
+        return
+    
+    table = metadata_to_table(metadata)
+    filename = os.path.join(OUTPUT_DIR, f"metadata_table_{timestamp}.arrow")
+    tmp_path = os.path.join(OUTPUT_DIR, f".tmp-{os.path.basename(filename)}")
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, filename)
+    bytes_written.inc(os.path.getsize(filename))
+    logger.info(f"Saved metadata table to {filename}")
+    
+    all_tables = sorted([f for f in os.listdir(OUTPUT_DIR) if f.startswith("metadata_table_")])
+    for old_table in all_tables[:-SNAPSHOTS_TO_KEEP]:
+        os.remove(os.path.join(OUTPUT_DIR, old_table))
+        logger.info(f"Removed old table {old_table}")
+
+def save_partial_snapshot(metadata, timestamp, shards):
+    """Save the objects of this replica's shards as a partial snapshot.
+
+    Partials are always complete for their shards rather than deltas,
+    because the shards a replica holds can change between cycles. The
+    data processor merges the partials of a timestamp once every shard
+    is covered.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    data, extension = compress_snapshot({
+        "shard_count": SHARD_COUNT,
+        "shards": sorted(shards),
+        "objects": metadata
+    })
+    basename = f"metadata_partial_{timestamp}.{SHARD_IDENTITY}.json.{extension}"
+    write_atomic(os.path.join(OUTPUT_DIR, basename), data)
+    logger.info(f"Saved partial snapshot for shards {sorted(shards)} to {basename}")
+    if publisher is not None:
+        publisher.publish(basename, data, metadata)
+    
+    cleanup_partial_snapshots(OUTPUT_DIR, SNAPSHOTS_TO_KEEP)
+
+def cleanup_partial_snapshots(output_dir, snapshots_to_keep):
+    """Keep the partials of the newest timestamps, whichever replica wrote them.
+
+    Pruning by timestamp rather than by identity also removes the partials
+    of replaced pods, which come back under a new POD_NAME. Every replica
+    prunes, so a file may already be gone.
+    """
+    partials = [f for f in os.listdir(output_dir) if f.startswith("metadata_partial_")]
+    timestamps = sorted({f[len("metadata_partial_"):].split(".", 1)[0] for f in partials})
+    expired = set(timestamps[:-snapshots_to_keep])
+    for old_partial in partials:
+        if old_partial[len("metadata_partial_"):].split(".", 1)[0] in expired:
+            try:
+                os.remove(os.path.join(output_dir, old_partial))
+            except FileNotFoundError:
+                pass
+
+def cleanup_snapshots(output_dir, snapshots_to_keep):
+    """Keep a rolling window of snapshots without orphaning retained deltas"""
+    all_snapshots = sorted([f for f in os.listdir(output_dir) if f.startswith("metadata_snapshot_")])
+    if len(all_snapshots) <= snapshots_to_keep:
+        return
+    
+    # Move the cut-off back to a keyframe so every kept delta can be rebuilt
+    cutoff = len(all_snapshots) - snapshots_to_keep
+    while cutoff > 0 and ".delta." in all_snapshots[cutoff]:
+        cutoff -= 1
+    
+    for old_snapshot in all_snapshots[:cutoff]:
+        os.remove(os.path.join(output_dir, old_snapshot))
+        logger.info(f"Removed old snapshot {old_snapshot}")
+
+def shard_of(resource_type, namespace=None):
+    """Return the shard that collects a resource type, or a namespace's objects"""
+    if SHARD_BY == "namespace":
+        return zlib.crc32((namespace or "").encode('utf-8')) % SHARD_COUNT
+    return (["namespaces"] + RESOURCE_TYPES).index(resource_type) % SHARD_COUNT
+
+class ShardCoordinator:
+    """Splits collection across replicas with one coordination.k8s.io Lease per shard.
+
+    Every replica also keeps a membership lease (LEASE_PREFIX-member-<identity>)
+    renewed, so replicas that hold no shards yet are counted as live. A
+    replica renews the shard leases it holds, then takes
+    free or expired leases until it holds its share (shards divided by
+    live replicas, rounded up), and releases its highest shards while it
+    holds more. Shards therefore move to new replicas and away from dead
+    ones within about one lease duration. Writes carry the lease's
+    resourceVersion, so when two replicas race for a lease only one wins.
+    """
+
+    def __init__(self, shard_count, identity, namespace=LEASE_NAMESPACE, prefix=LEASE_PREFIX,
+                 lease_duration=LEASE_DURATION):
+        self.shard_count = shard_count
+        self.identity = identity
+        self.namespace = namespace
+        self.prefix = prefix
+        self.lease_duration = lease_duration
+        self.lock = threading.Lock()
+        self.owned = set()
+        # Shards the last collection covered, to tell rebalances from churn
+        self.collected = None
+
+    def start(self):
+        """Reconcile now and then keep the leases renewed in the background"""
+        self.reconcile()
+        threading.Thread(target=self._run, name="shard-coordinator", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.lease_duration / 3)
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Error reconciling shard leases: {e}")
+
+    def owned_shards(self):
+        with self.lock:
+            return set(self.owned)
+
+    def _lease_name(self, shard):
+        return f"{self.prefix}-{shard}"
+
+    def _member_lease_name(self, identity):
+        return f"{self.prefix}-member-{identity}"
+
+    def _holder(self, lease, now):
+        """Return the lease's holder, or None if it is free or expired"""
+        spec = lease.spec if lease is not None else None
+        if spec is None or not spec.holder_identity or spec.renew_time is None:
+            return None
+        duration = spec.lease_duration_seconds or self.lease_duration
+        if spec.renew_time + datetime.timedelta(seconds=duration) < now:
+            return None
+        return spec.holder_identity
+
+    def _write(self, api, name, lease, holder, now):
+        """Create or update a lease; returns False if another replica changed it first"""
+        spec = client.V1LeaseSpec(
+            holder_identity=holder,
+            lease_duration_seconds=self.lease_duration,
+            renew_time=now if holder else None
+        )
+        try:
+            if lease is None:
+                api.create_namespaced_lease(self.namespace, client.V1Lease(
+                    metadata=client.V1ObjectMeta(name=name, namespace=self.namespace),
+                    spec=spec
+                ))
+            else:
+                previous = lease.spec
+                taken_over = previous is None or previous.holder_identity != holder
+                spec.acquire_time = now if taken_over and holder else (previous.acquire_time if previous else None)
+                spec.lease_transitions = ((previous.lease_transitions if previous else None) or 0) + (1 if taken_over and holder else 0)
+                lease.spec = spec
+                api.replace_namespaced_lease(name, self.namespace, lease)
+            return True
+        except ApiException as e:
+            if e.status == 409:
+                return False
+            raise
+
+    def reconcile(self):
+        """Renew, acquire and release shard leases once and return the owned shards"""
+        api = get_api("CoordinationV1Api")
+        now = datetime.datetime.now(datetime.timezone.utc)
+        leases = {lease.metadata.name: lease for lease in api.list_namespaced_lease(self.namespace).items}
+        member_name = self._member_lease_name(self.identity)
+        self._write(api, member_name, leases.get(member_name), self.identity, now)
+        
+        live = {self.identity}
+        for name, lease in leases.items():
+            if not name.startswith(self._member_lease_name("")) or name == member_name:
+                continue
+            if self._holder(lease, now):
+                live.add(lease.spec.holder_identity)
+            else:
+                # Replicas get new identities when they are replaced, so expired members are removed
+                try:
+                    api.delete_namespaced_lease(name, self.namespace)
+                except ApiException as e:
+                    if e.status != 404:
+                        raise
+        
+        shards = {shard: leases.get(self._lease_name(shard)) for shard in range(self.shard_count)}
+        holders = {shard: self._holder(lease, now) for shard, lease in shards.items()}
+        share = -(-self.shard_count // len(live))
+        owned = sorted(shard for shard, holder in holders.items() if holder == self.identity)
+        
+        for shard in owned[share:]:
+            if self._write(api, self._lease_name(shard), shards[shard], None, now):
+                shard_transitions.labels(action="released").inc()
+        owned = {
+            shard for shard in owned[:share]
+            if self._write(api, self._lease_name(shard), shards[shard], self.identity, now)
+        }
+        
+        for shard, holder in holders.items():
+            if len(owned) >= share:
+                break
+            if holder is None and self._write(api, self._lease_name(shard), shards[shard], self.identity, now):
+                owned.add(shard)
+                shard_transitions.labels(action="acquired").inc()
+        
+        with self.lock:
+            changed = owned != self.owned
+            self.owned = owned
+        owned_shards.set(len(owned))
+        if changed:
+            logger.info(f"Holding shards {sorted(owned)} of {self.shard_count} ({len(live)} live replicas)")
+        return owned
+
+class SnapshotPublisher:
+    """Streams saved snapshots to the data processor over TCP.
+
+    Each frame is a length-prefixed JSON header followed by the
+    length-prefixed snapshot bytes exactly as written to disk. The
+    processor acknowledges a frame once it has queued it, so a slow
+    processor holds back the sender thread for up to ack_timeout; when the
+    sender's bounded queue is full the backlog is dropped and counted in
+    k8s_handoff_snapshots_dropped. A delta is only sent when its
+    base was the last snapshot the processor acknowledged, otherwise it is
+    replaced by a full keyframe, so drops and reconnects never leave the
+    processor with a broken chain. Snapshot files are still written, so
+    the file-based handoff keeps working alongside the stream.
+    """
+
+    def __init__(self, address, queue_size=HANDOFF_QUEUE_SIZE, timeout=HANDOFF_TIMEOUT,
+                 ack_timeout=HANDOFF_ACK_TIMEOUT):
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.timeout = timeout
+        self.ack_timeout = ack_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.sock = None
+        # Name of the last snapshot the processor acknowledged
+        self.last_sent = None
+
+    def start(self):
+        threading.Thread(target=self._run, name="handoff-publisher", daemon=True).start()
+
+    def publish(self, name, data, metadata, base=None):
+        """Queue a saved snapshot without blocking collection"""
+        try:
+            self.queue.put_nowait((name, data, metadata, base))
+        except queue.Full:
+            dropped = 0
+            while True:
+                try:
+                    self.queue.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    break
+            handoff_dropped.inc(dropped)
+            logger.warning(f"Handoff stream is backed up, dropped {dropped} queued snapshots")
+            self.queue.put_nowait((name, data, metadata, base))
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.last_sent = None
+        logger.info(f"Connected to handoff listener at {self.address[0]}:{self.address[1]}")
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.last_sent = None
+
+    def _send(self, name, data, metadata, base):
+        """Send one snapshot and wait for the processor's acknowledgement"""
+        if base is None or base == self.last_sent:
+            kind = "full" if base is None else "delta"
+            encoding = name.rsplit(".", 1)[-1]
+        else:
+            # The processor missed this delta's base, send the whole snapshot instead
+            kind = "full"
+            data, encoding = compress_snapshot(metadata)
+        
+        header = json.dumps({
+            "name": name,
+            "kind": kind,
+            "encoding": encoding if encoding in ("gz", "zst") else "",
+            "sent_at": time.time()
+        }).encode('utf-8')
+        start_time = time.time()
+        self.sock.sendall(struct.pack(">I", len(header)) + header + struct.pack(">I", len(data)))
+        self.sock.sendall(data)
+        # The acknowledgement waits for room in the processor's queue, so a
+        # slow processing cycle must not look like a dead connection
+        self.sock.settimeout(self.ack_timeout)
+        try:
+            ack = self.sock.recv(1)
+        finally:
+            self.sock.settimeout(self.timeout)
+        if ack != b"\x01":
+            raise ConnectionError("handoff listener closed the connection")
+        handoff_send_duration.observe(time.time() - start_time)
+        handoff_sent.labels(kind=kind).inc()
+        self.last_sent = name
+
+    def _run(self):
+        while True:
+            name, data, metadata, base = self.queue.get()
+            try:
+                if self.sock is None:
+                    self._connect()
+                self._send(name, data, metadata, base)
+            except OSError as e:
+                # The snapshot is still on disk; the next one is sent as a keyframe
+                logger.error(f"Error streaming snapshot {name}: {e}")
+                handoff_dropped.inc()
+                self._close()
+                time.sleep(WATCH_RETRY_DELAY)
+
+def run_profiled(cycle, name):
+    """Run one cycle, under cProfile when profiling is enabled and sampled.
+
+    Profiles of cycles slower than PROFILE_THRESHOLD are written to
+    PROFILE_DIR as pstats files, keeping the newest PROFILES_TO_KEEP.
+    """
+    if PROFILE_THRESHOLD <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return cycle()
+    
+    profiler = cProfile.Profile()
+    start_time = time.time()
+    profiler.enable()
+    try:
+        return cycle()
+    finally:
+        profiler.disable()
+        elapsed = time.time() - start_time
+        if elapsed > PROFILE_THRESHOLD:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            profile_path = os.path.join(PROFILE_DIR, f"{name}_{timestamp}.prof")
+            profiler.dump_stats(profile_path)
+            logger.warning(f"Cycle took {elapsed:.1f}s (threshold {PROFILE_THRESHOLD}s), saved profile to {profile_path}")
+            
+            profiles = sorted(f for f in os.listdir(PROFILE_DIR) if f.startswith(f"{name}_"))
+            for old_profile in profiles[:-PROFILES_TO_KEEP]:
+                os.remove(os.path.join(PROFILE_DIR, old_profile))
+
+class IntervalScheduler:
+    """Runs cycles at fixed-rate deadlines and adapts the interval within bounds.
+
+    Each deadline is the previous one plus the interval, so the time a
+    cycle takes does not add drift. A cycle that overruns the next
+    deadline counts it as missed and the next cycle starts at once, on the
+    latest deadline that has passed, rather than catching up back to back.
+    """
+
+    def __init__(self, interval, min_interval, max_interval, start=None):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        # Scheduled start of the current cycle
+        self.deadline = time.time() if start is None else start
+        effective_interval.set(self.interval)
+
+    def adapt(self, churn, latency=None):
+        """Adjust the interval from the fraction of objects that changed and the slowest request"""
+        if latency is not None and latency > APISERVER_LATENCY_TARGET:
+            interval, reason = self.interval * 2, f"apiserver latency {latency:.2f}s"
+        elif churn > CHURN_HIGH:
+            interval, reason = self.interval / 2, f"churn {churn:.2%}"
+        elif churn < CHURN_LOW:
+            interval, reason = self.interval * 1.25, f"churn {churn:.2%}"
+        else:
+            return self.interval
+        
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if interval != self.interval:
+            logger.info(f"Changing interval from {self.interval:.0f}s to {interval:.0f}s ({reason})")
+            self.interval = interval
+            effective_interval.set(interval)
+        return self.interval
+
+    def _advance(self):
+        """Move to the next deadline and return the time left until it"""
+        self.deadline += self.interval
+        now = time.time()
+        if now > self.deadline:
+            missed = int((now - self.deadline) // self.interval) + 1
+            self.deadline += (missed - 1) * self.interval
+            missed_deadlines.inc(missed)
+            logger.warning(f"Cycle overran, missed {missed} deadline(s)")
+            return 0
+        logger.info(f"Sleeping for {self.deadline - now:.0f} seconds...")
+        return self.deadline - now
+
+    def wait(self):
+        """Sleep until the next deadline"""
+        time.sleep(self._advance())
+
+    async def wait_async(self):
+        """Sleep until the next deadline without blocking the event loop"""
+        await asyncio.sleep(self._advance())
+
+def collection_cycle(cache, timestamp=None, scheduler=None):
+    """Collect one snapshot, update the change metrics and save it.
+
+    A sharded replica collects only its shards and saves a partial snapshot.
+    The scheduler, if given, adapts to the cycle's churn and list latency.
+    """
+    start_time = time.time()
+    shards = shard_coordinator.owned_shards() if shard_coordinator is not None else None
+    if shards is not None and not shards:
+        logger.info("Holding no shards, skipping collection")
+        return []
+    
+    if cache is not None:
+        logger.info("Taking metadata snapshot from watch cache...")
+        with stage_duration.labels(stage='cache_snapshot').time():
+            metadata = cache.snapshot()
+    else:
+        logger.info("Collecting Kubernetes metadata...")
+        metadata, failed = collect_all_metadata(shards)
+        # Objects that arrive or leave with a rebalanced shard are not changes
+        rebalanced = shard_coordinator is not None and shard_coordinator.collected != shards
+        if shard_coordinator is not None:
+            shard_coordinator.collected = shards
+        with stage_duration.labels(stage='object_state_resync').time():
+            object_state.resync(metadata, count=bool(object_state.objects) and not rebalanced, keep_types=failed)
+    
+    changes, flapping = object_state.end_interval()
+    churn = update_object_change_metrics(changes, flapping, RESOURCE_TYPES)
+    if scheduler is not None:
+        scheduler.adapt(churn / max(len(metadata), 1), take_slowest_list_request())
+    if shards is not None:
+        save_partial_snapshot(metadata, timestamp, shards)
+    else:
+        save_metadata_snapshot(metadata)
+    
+    elapsed = time.time() - start_time
+    if elapsed > 0:
+        objects_per_second.set(len(metadata) / elapsed)
+    logger.info(f"Collected metadata for {len(metadata)} resources")
+    return metadata
+
+def log_write_error(future):
+    """Log a snapshot write that failed on the writer thread"""
+    if future.exception() is not None:
+        logger.error(f"Error saving snapshot: {future.exception()}")
+
+async def async_collection_cycle(collector, cache, scheduler):
+    """Collect one snapshot on the event loop and hand it to the writer thread"""
+    start_time = time.time()
+    if cache is not None:
+        logger.info("Taking metadata snapshot from watch cache...")
+        with stage_duration.labels(stage='cache_snapshot').time():
+            metadata = cache.snapshot()
+    else:
+        logger.info("Collecting Kubernetes metadata...")
+        metadata, failed = await collector.collect_all_metadata()
+        with stage_duration.labels(stage='object_state_resync').time():
+            object_state.resync(metadata, count=bool(object_state.objects), keep_types=failed)
+    
+    changes, flapping = object_state.end_interval()
+    churn = update_object_change_metrics(changes, flapping, RESOURCE_TYPES)
+    scheduler.adapt(churn / max(len(metadata), 1), take_slowest_list_request())
+    # Writes run one at a time in order, so the delta chain stays consistent
+    collector.writer.submit(save_metadata_snapshot, metadata).add_done_callback(log_write_error)
+    
+    elapsed = time.time() - start_time
+    if elapsed > 0:
+        objects_per_second.set(len(metadata) / elapsed)
+    logger.info(f"Collected metadata for {len(metadata)} resources")
+
+async def run_async():
+    """Run list or watch collection on asyncio until the process exits"""
+    collector = AsyncCollector(RESOURCE_TYPES)
+    await collector.start()
+    
+    cache = None
+    if COLLECTION_MODE == "watch":
+        cache = AsyncResourceCache(RESOURCE_TYPES, collector)
+        cache.start()
+        await cache.wait_for_sync_async(timeout=COLLECTION_INTERVAL)
+        logger.info("Started asyncio watch-based metadata cache")
+    
+    scheduler = IntervalScheduler(COLLECTION_INTERVAL, MIN_COLLECTION_INTERVAL, MAX_COLLECTION_INTERVAL)
+    while True:
+        try:
+            await async_collection_cycle(collector, cache, scheduler)
+        except Exception as e:
+            logger.error(f"Error in collection cycle: {e!r}")
+        await scheduler.wait_async()
 
 def main():
     """Main function to run the metadata collector"""
@@ -192,13 +1667,51 @@ def main():
     start_http_server(8000)
     logger.info("Started Prometheus metrics server on port 8000")
     
+    # Load Kubernetes configuration
+    load_kube_config()
+    
+    global publisher, shard_coordinator
+    if HANDOFF_ADDRESS:
+        publisher = SnapshotPublisher(HANDOFF_ADDRESS)
+        publisher.start()
+        logger.info(f"Streaming snapshots to {HANDOFF_ADDRESS}")
+    
+    if SHARD_COUNT > 1:
+        shard_coordinator = ShardCoordinator(SHARD_COUNT, SHARD_IDENTITY)
+        shard_coordinator.start()
+        logger.info(f"Collecting as {SHARD_IDENTITY}, one of up to {SHARD_COUNT} shards by {SHARD_BY}")
+        if COLLECTION_MODE == "watch" or ASYNC_COLLECTION:
+            logger.warning("Watch mode and asyncio collection are not supported with sharding, listing shards every interval instead")
+        # Replicas label partials with the same interval-aligned deadline so they
+        # can be merged, so the interval stays fixed
+        scheduler = IntervalScheduler(
+            COLLECTION_INTERVAL, COLLECTION_INTERVAL, COLLECTION_INTERVAL,
+            start=time.time() // COLLECTION_INTERVAL * COLLECTION_INTERVAL
+        )
+        while True:
+            timestamp = datetime.datetime.fromtimestamp(scheduler.deadline).strftime("%Y%m%d_%H%M%S")
+            run_profiled(lambda: collection_cycle(None, timestamp), "collector")
+            scheduler.wait()
+    
+    if ASYNC_COLLECTION:
+        if async_client is None:
+            logger.error("ASYNC_COLLECTION requires the kubernetes_asyncio package, using threaded collection")
+        else:
+            logger.info("Collecting on asyncio")
+            asyncio.run(run_async())
+            return
+    
+    cache = None
+    if COLLECTION_MODE == "watch":
+        cache = ResourceCache(RESOURCE_TYPES)
+        cache.start()
+        cache.wait_for_sync(timeout=COLLECTION_INTERVAL)
+        logger.info("Started watch-based metadata cache")
+    
+    scheduler = IntervalScheduler(COLLECTION_INTERVAL, MIN_COLLECTION_INTERVAL, MAX_COLLECTION_INTERVAL)
     while True:
-        logger.info("Collecting Kubernetes metadata...")
-        metadata = collect_all_metadata()
-        save_metadata_snapshot(metadata)
-        logger.info(f"Collected metadata for {len(metadata)} resources")
-        logger.info(f"Sleeping for {COLLECTION_INTERVAL} seconds...")
-        time.sleep(COLLECTION_INTERVAL)
+        run_profiled(lambda: collection_cycle(cache, scheduler=scheduler), "collector")
+        scheduler.wait()
 
 if __name__ == "__main__":
-    main() 
+    main()
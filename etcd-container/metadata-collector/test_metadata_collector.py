@@ -0,0 +1,229 @@
+import copy
+import datetime
+import socket
+import threading
+import time
+
+import pytest
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from prometheus_client import REGISTRY
+
+import metadata_collector
+from metadata_collector import ShardCoordinator
+
+SHARD_COUNT = 12
+
+
+class FakeLeaseApi:
+    """In-memory CoordinationV1Api lease calls with resourceVersion conflicts"""
+
+    def __init__(self):
+        self.leases = {}
+        self.resource_version = 0
+
+    def _store(self, body):
+        self.resource_version += 1
+        body.metadata.resource_version = str(self.resource_version)
+        self.leases[body.metadata.name] = copy.deepcopy(body)
+
+    def list_namespaced_lease(self, namespace):
+        return client.V1LeaseList(items=[copy.deepcopy(lease) for lease in self.leases.values()])
+
+    def create_namespaced_lease(self, namespace, body):
+        if body.metadata.name in self.leases:
+            raise ApiException(status=409)
+        self._store(body)
+
+    def replace_namespaced_lease(self, name, namespace, body):
+        if self.leases[name].metadata.resource_version != body.metadata.resource_version:
+            raise ApiException(status=409)
+        self._store(body)
+
+    def delete_namespaced_lease(self, name, namespace):
+        if name not in self.leases:
+            raise ApiException(status=404)
+        del self.leases[name]
+
+    def expire(self, identity, seconds=600):
+        """Age every lease renewed by identity, as if it stopped renewing"""
+        for lease in self.leases.values():
+            if lease.spec.holder_identity == identity and lease.spec.renew_time:
+                lease.spec.renew_time -= datetime.timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeLeaseApi()
+    monkeypatch.setitem(metadata_collector._api_clients, "CoordinationV1Api", api)
+    return api
+
+
+def replicas(identities):
+    return [ShardCoordinator(SHARD_COUNT, identity, namespace="monitoring") for identity in identities]
+
+
+def converge(coordinators, rounds=3):
+    """Reconcile every replica in turn and return the shards each holds"""
+    for _ in range(rounds):
+        owned = {coordinator.identity: coordinator.reconcile() for coordinator in coordinators}
+    return owned
+
+
+def assert_partition(owned):
+    shards = [shard for held in owned.values() for shard in held]
+    assert sorted(shards) == list(range(SHARD_COUNT))
+    share = -(-SHARD_COUNT // len(owned))
+    assert all(len(held) <= share for held in owned.values())
+
+
+def test_single_replica_holds_every_shard(api):
+    owned = converge(replicas("a"))
+    assert owned == {"a": set(range(SHARD_COUNT))}
+
+
+def test_shards_rebalance_when_replicas_join(api):
+    a, b, c = replicas("abc")
+    converge([a])
+
+    owned = converge([a, b])
+    assert_partition(owned)
+    assert len(owned["b"]) == SHARD_COUNT // 2
+
+    owned = converge([a, b, c])
+    assert_partition(owned)
+    assert all(len(held) == SHARD_COUNT // 3 for held in owned.values())
+
+
+def test_shards_move_away_from_an_expired_replica(api):
+    a, b, c = replicas("abc")
+    owned = converge([a, b, c])
+    held_by_c = owned["c"]
+
+    # c stops renewing; a and b take its shards once its leases expire
+    api.expire("c")
+    owned = converge([a, b])
+    assert_partition(owned)
+    assert held_by_c <= owned["a"] | owned["b"]
+    # Its expired membership lease is cleaned up
+    assert a._member_lease_name("c") not in api.leases
+
+
+def test_replacement_replica_takes_its_share(api):
+    a, b = replicas("ab")
+    converge([a, b])
+    api.expire("b")
+    assert converge([a]) == {"a": set(range(SHARD_COUNT))}
+
+    # A replacement replica comes up under a new identity
+    c, = replicas("c")
+    owned = converge([a, c])
+    assert_partition(owned)
+    assert len(owned["c"]) == SHARD_COUNT // 2
+
+
+def make_object(resource_type, index):
+    return metadata_collector.extract_raw_metadata({
+        "metadata": {
+            "name": f"{resource_type}-{index}",
+            "namespace": None if resource_type == "namespaces" else "default",
+            "uid": f"{resource_type}-uid-{index}",
+            "resourceVersion": "1",
+        },
+        "status": {},
+    }, resource_type)
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    """Serve a fixed set of objects per type; types in the returned set fail to list"""
+    objects = {
+        resource_type: [make_object(resource_type, index) for index in range(3)]
+        for resource_type in ["namespaces"] + metadata_collector.RESOURCE_TYPES
+    }
+    failing = set()
+
+    def iter_page_metadata(resource_type, list_function=None):
+        if resource_type in failing:
+            raise ApiException(status=500)
+        yield [dict(obj) for obj in objects[resource_type]], None, "1"
+
+    monkeypatch.setattr(metadata_collector, "get_list_function", lambda resource_type, namespace=None: None)
+    monkeypatch.setattr(metadata_collector, "iter_page_metadata", iter_page_metadata)
+    monkeypatch.setattr(metadata_collector, "object_state", metadata_collector.ObjectStateTable())
+    monkeypatch.setattr(metadata_collector, "_last_listings", {})
+    monkeypatch.setattr(metadata_collector, "save_metadata_snapshot", lambda metadata, timestamp=None: None)
+    return failing
+
+
+def change_rate(resource_type):
+    return REGISTRY.get_sample_value("k8s_metadata_change_rate", {"resource_type": resource_type})
+
+
+def test_failed_listing_keeps_previous_objects(listings):
+    metadata_collector.collection_cycle(None)
+
+    listings.add("secrets")
+    metadata = metadata_collector.collection_cycle(None)
+    assert sum(obj["resource_type"] == "secrets" for obj in metadata) == 3
+    assert change_rate("secrets") == 0
+
+    # Once the type lists again nothing is counted as re-created
+    listings.clear()
+    metadata_collector.collection_cycle(None)
+    assert change_rate("secrets") == 0
+    assert len(metadata_collector.object_state.objects) == 3 * (1 + len(metadata_collector.RESOURCE_TYPES))
+
+
+def test_resync_leaves_failed_types_in_place():
+    table = metadata_collector.ObjectStateTable()
+    pods = [make_object("pods", index) for index in range(3)]
+    secrets = [make_object("secrets", index) for index in range(3)]
+    table.resync(pods + secrets, count=False)
+
+    table.resync(pods, keep_types={"secrets"})
+    changes, _ = table.end_interval()
+    assert not any(kind == "deleted" for _, _, kind in changes)
+    assert len(table.objects) == 6
+
+
+def test_partial_snapshots_of_replaced_pods_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata_collector, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(metadata_collector, "SNAPSHOTS_TO_KEEP", 2)
+    monkeypatch.setattr(metadata_collector, "SHARD_COUNT", 2)
+
+    monkeypatch.setattr(metadata_collector, "SHARD_IDENTITY", "collector-old")
+    for minute in range(3):
+        metadata_collector.save_partial_snapshot([], f"20240101_00{minute:02d}00", {0})
+
+    # The pod is replaced and its successor writes under a new name
+    monkeypatch.setattr(metadata_collector, "SHARD_IDENTITY", "collector-new")
+    for minute in range(3, 6):
+        metadata_collector.save_partial_snapshot([], f"20240101_00{minute:02d}00", {0})
+
+    assert sorted(path.name.split(".")[0:2] for path in tmp_path.iterdir()) == [
+        ["metadata_partial_20240101_000400", "collector-new"],
+        ["metadata_partial_20240101_000500", "collector-new"],
+    ]
+
+
+def test_publisher_waits_for_a_slow_acknowledgement():
+    publisher = metadata_collector.SnapshotPublisher("localhost:0", timeout=0.1, ack_timeout=5)
+    publisher.sock, listener = socket.socketpair()
+    publisher.sock.settimeout(publisher.timeout)
+
+    def slow_processor():
+        # Read the whole frame, then take longer than the send timeout to queue it
+        header = listener.recv(4 + int.from_bytes(listener.recv(4), "big"))
+        listener.recv(int.from_bytes(header[-4:], "big"), socket.MSG_WAITALL)
+        time.sleep(0.5)
+        listener.sendall(b"\x01")
+
+    thread = threading.Thread(target=slow_processor)
+    thread.start()
+    publisher._send("metadata_20240101_000000.json", b"[]", [], None)
+    thread.join()
+    assert publisher.last_sent == "metadata_20240101_000000.json"
+    assert publisher.sock.gettimeout() == 0.1
+    publisher._close()
+    listener.close()